@@ -0,0 +1,96 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+Benchmarks for the allocate plugin: allocating a resource to each of
+[allocations] nodes from a pool of [size] free resources, then allocating
+them again (the nodes already have a resource).
+
+    PYTHONPATH=./ python test/benchmarks/bench_allocate.py [size] \
+        [allocations]
+'''
+
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from ztpserver.config import runtime
+from ztpserver.constants import CONTENT_TYPE_YAML
+from ztpserver.serializers import dump
+
+from bench_lib import report
+
+PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      os.pardir, os.pardir, 'plugins', 'allocate')
+
+def run(plugin, count):
+    ''' Returns the time (seconds) spent allocating a resource to count
+    nodes
+    '''
+    start = time.time()
+    for index in xrange(count):
+        plugin.main('%012x' % index, 'pool', None)
+    return time.time() - start
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else size
+
+    data_root = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(data_root, 'resources'))
+        dump(dict(('10.%d.%d.%d/31' % (x >> 16, (x >> 8) & 0xff, x & 0xff),
+                   None) for x in range(size)),
+             os.path.join(data_root, 'resources', 'pool'),
+             CONTENT_TYPE_YAML)
+        runtime.set_value('data_root', data_root, 'default')
+        plugin = imp.load_source('allocate', PLUGIN)
+
+        elapsed = run(plugin, count)
+        report('allocate (%d of %d, new)' % (count, size), elapsed, 'sec')
+        report('allocate (%d of %d, new), per allocation' % (count, size),
+               elapsed / count, 'usec')
+
+        elapsed = run(plugin, count)
+        report('allocate (%d of %d, existing)' % (count, size), elapsed,
+               'sec')
+        report('allocate (%d of %d, existing), per allocation' %
+               (count, size), elapsed / count, 'usec')
+    finally:
+        shutil.rmtree(data_root)
+
+if __name__ == '__main__':
+    main()
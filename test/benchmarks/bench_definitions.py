@@ -0,0 +1,148 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+#
+'''
+Benchmarks for GET /nodes/{id} with topology validation and node
+attributes:
+    - with an allocate() resource per action, with and without the
+      definition cache
+    - with variables only (no plugins), without the definition cache
+
+    PYTHONPATH=./ python test/benchmarks/bench_definitions.py [actions]
+'''
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from webob import Request
+
+from ztpserver.config import runtime
+from ztpserver.constants import CONTENT_TYPE_YAML
+from ztpserver.controller import Router
+from ztpserver.definitions import definition_cache
+from ztpserver.serializers import dump
+
+from bench_lib import timed, report
+
+NODE_ID = '001c73000001'
+VARIABLES_NODE_ID = '001c73000002'
+
+def write_node(data_root, node_id, count):
+    node_dir = os.path.join(data_root, 'nodes', node_id)
+    os.makedirs(node_dir)
+    with open(os.path.join(node_dir, '.node'), 'w') as fhandler:
+        json.dump({'serialnumber': node_id, 'systemmac': node_id,
+                   'model': 'vEOS', 'version': '4.14.5F',
+                   'neighbors': {'Ethernet1': [{'device': 'spine1',
+                                                'port': 'Ethernet1'}]}},
+                  fhandler)
+    dump({'name': 'leaf',
+          'interfaces': [{'Ethernet1': 'spine1:Ethernet1'}]},
+         os.path.join(node_dir, 'pattern'), CONTENT_TYPE_YAML)
+    dump(dict(('value%d' % index, 'foo') for index in range(count)),
+         os.path.join(node_dir, 'attributes'), CONTENT_TYPE_YAML)
+    return node_dir
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    data_root = tempfile.mkdtemp()
+    try:
+        runtime.set_value('data_root', data_root, 'default')
+        for folder in [os.path.join(data_root, 'plugins'),
+                       os.path.join(data_root, 'resources')]:
+            os.makedirs(folder)
+        shutil.copy(os.path.join('plugins', 'allocate'),
+                    os.path.join(data_root, 'plugins'))
+
+        node_dir = write_node(data_root, NODE_ID, count)
+        dump(dict(('10.0.0.%d/24' % index, None) for index in range(250)),
+             os.path.join(data_root, 'resources', 'mgmt_subnet'),
+             CONTENT_TYPE_YAML)
+        actions = [{'name': 'action %d' % index,
+                    'action': 'add_config',
+                    'attributes': {'url': 'files/templates/leaf',
+                                   'variables': {'value': '$value%d' % index,
+                                                 'ip': "allocate('mgmt_"
+                                                       "subnet')"}}}
+                   for index in range(count)]
+        dump({'name': 'leaf', 'actions': actions},
+             os.path.join(node_dir, 'definition'), CONTENT_TYPE_YAML)
+
+        variables_count = count * 10
+        variables_dir = write_node(data_root, VARIABLES_NODE_ID,
+                                   variables_count)
+        actions = [{'name': 'action %d' % index,
+                    'action': 'add_config',
+                    'attributes': {'url': 'files/templates/leaf',
+                                   'variables': dict(
+                                       ('var%d' % var, '$value%d' % var)
+                                       for var in range(index % 10,
+                                                        variables_count,
+                                                        10))}}
+                   for index in range(variables_count)]
+        dump({'name': 'leaf', 'actions': actions},
+             os.path.join(variables_dir, 'definition'), CONTENT_TYPE_YAML)
+
+        router = Router()
+
+        def get(node_id=NODE_ID):
+            response = Request.blank('/nodes/%s' % node_id). \
+                get_response(router)
+            assert response.status_code == 200, response.status
+
+        get()
+        for (name, size) in [('uncached', 0), ('cached', 4096)]:
+            runtime.set_value('definition_cache_size', size, 'default')
+            definition_cache.clear()
+            get()
+            report('GET /nodes/{id} (%d actions, %s)' % (count, name),
+                   timed(get, number=200), 'msec')
+
+        runtime.set_value('definition_cache_size', 0, 'default')
+        definition_cache.clear()
+        get(VARIABLES_NODE_ID)
+        report('GET /nodes/{id} (%d actions, variables only, uncached)' %
+               variables_count,
+               timed(lambda: get(VARIABLES_NODE_ID), number=50), 'msec')
+    finally:
+        runtime.clear_value('definition_cache_size', 'default')
+        runtime.clear_value('data_root', 'default')
+        shutil.rmtree(data_root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+Throughput benchmark for downloading a large file (GET /files/...) from the
+standalone server.
+
+    PYTHONPATH=./ python test/benchmarks/bench_file_delivery.py [size in MB]
+'''
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from wsgiref.simple_server import make_server as make_wsgiref_server
+from wsgiref.simple_server import WSGIRequestHandler, ServerHandler
+
+import ztpserver.controller
+import ztpserver.server
+
+from ztpserver.config import runtime
+
+
+BUFFER_SIZE = 1024 * 1024
+
+class CopyRequestHandler(WSGIRequestHandler):
+    ''' stock wsgiref request handler without wsgi.file_wrapper, i.e. the
+    file is copied through Python in FileIter blocks
+    '''
+
+    def handle(self):
+        self.raw_requestline = self.rfile.readline(65537)
+        if not self.parse_request():
+            return
+        handler = ServerHandler(self.rfile, self.wfile, self.get_stderr(),
+                                self.get_environ())
+        handler.wsgi_file_wrapper = None
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+    def log_message(self, *args):
+        pass
+
+def download(port, size):
+    ''' Downloads /files/image in a child process and returns the elapsed
+    time
+    '''
+    (read_fd, write_fd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        sock = socket.create_connection(('127.0.0.1', port))
+        start = time.time()
+        sock.sendall('GET /files/image HTTP/1.0\r\n\r\n')
+        buf = bytearray(BUFFER_SIZE)
+        received = 0
+        while True:
+            count = sock.recv_into(buf)
+            if not count:
+                break
+            received += count
+        elapsed = time.time() - start
+        assert received > size, received
+        os.write(write_fd, repr(elapsed))
+        os._exit(0)     # pylint: disable=W0212
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as fd:
+        result = float(fd.read())
+    os.waitpid(pid, 0)
+    return result
+
+def bench(name, server, size, repeat=3):
+    server.RequestHandlerClass.log_message = lambda *args: None
+    best = None
+    for _ in range(repeat):
+        thread = threading.Thread(target=server.handle_request)
+        thread.start()
+        elapsed = download(server.server_port, size)
+        thread.join()
+        best = elapsed if best is None else min(best, elapsed)
+    print '%-50s %8.2f s %8.1f MB/s' % (name, best, size / 1048576.0 / best)
+    server.server_close()
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    size = megabytes * 1024 * 1024
+
+    data_root = tempfile.mkdtemp()
+    try:
+        runtime.set_value('data_root', data_root, 'default')
+        os.makedirs(os.path.join(data_root, 'files'))
+        chunk = os.urandom(BUFFER_SIZE)
+        with open(os.path.join(data_root, 'files', 'image'), 'wb') as fd:
+            for _ in range(megabytes):
+                fd.write(chunk)
+
+        app = ztpserver.controller.Router()
+
+        # warm up the page cache and the digest index
+        bench('%d MB, warm-up' % megabytes,
+              make_wsgiref_server('127.0.0.1', 0, app,
+                                  handler_class=CopyRequestHandler), size,
+              repeat=1)
+
+        bench('%d MB, copy through Python (wsgiref)' % megabytes,
+              make_wsgiref_server('127.0.0.1', 0, app,
+                                  handler_class=CopyRequestHandler), size)
+
+        libc_sendfile = ztpserver.server.LIBC_SENDFILE
+        ztpserver.server.LIBC_SENDFILE = None
+        bench('%d MB, wsgi.file_wrapper (no sendfile)' % megabytes,
+              ztpserver.server.make_server('127.0.0.1', 0, app), size)
+        ztpserver.server.LIBC_SENDFILE = libc_sendfile
+
+        bench('%d MB, wsgi.file_wrapper + sendfile' % megabytes,
+              ztpserver.server.make_server('127.0.0.1', 0, app), size)
+    finally:
+        runtime.clear_value('data_root', 'default')
+        shutil.rmtree(data_root)
+
+if __name__ == '__main__':
+    main()
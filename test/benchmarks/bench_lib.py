@@ -0,0 +1,128 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+Helpers shared by the ztpserver benchmarks.
+
+Benchmarks are standalone scripts which are not run as part of the test
+suite.  Run them from the top of the source tree, e.g.:
+
+    PYTHONPATH=./ python test/benchmarks/bench_topology.py
+'''
+
+import gc
+import logging
+import os
+import resource
+import sys
+import time
+import types
+
+# keep the ztpserver loggers quiet - benchmarks measure the code, not the
+# log handlers
+logging.getLogger('ztpserver').setLevel(logging.CRITICAL)
+
+def timed(func, number=1, repeat=3):
+    ''' Returns the best wall time (seconds) of func() over repeat runs of
+    number calls each, divided by number
+    '''
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for _ in xrange(number):
+            func()
+        elapsed = (time.time() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def report(name, seconds, unit='usec'):
+    ''' Prints a single benchmark result line '''
+    scale = {'sec': 1, 'msec': 1e3, 'usec': 1e6}[unit]
+    print '%-50s %12.2f %s' % (name, seconds * scale, unit)
+
+def rss():
+    ''' Returns the resident set size of the process, in bytes '''
+    try:
+        with open('/proc/self/statm') as fd:
+            pages = int(fd.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except IOError:
+        # peak (not current) RSS, in KB on Linux and bytes on Darwin
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def report_size(name, nbytes, unit='KB'):
+    ''' Prints a single memory benchmark result line '''
+    scale = {'B': 1, 'KB': 1024, 'MB': 1024 * 1024}[unit]
+    print '%-50s %12.2f %s' % (name, float(nbytes) / scale, unit)
+
+SHARED_TYPES = (type, types.ModuleType, types.CodeType,
+                types.BuiltinFunctionType)
+
+def sizeof(obj):
+    ''' Returns the size (bytes) of obj and all objects it references,
+    excluding objects shared with the rest of the process (modules,
+    classes, code)
+    '''
+    seen = set(id(vars(x)) for x in sys.modules.values() if x)
+    stack = [obj]
+    size = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, SHARED_TYPES):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        stack.extend(gc.get_referents(item))
+    return size
+
+def peak_rss(func):
+    ''' Returns the peak resident set size (bytes) of a child process
+    running func(), relative to the size of the process before the call
+    '''
+    (read_fd, write_fd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        gc.collect()
+        start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        func()
+        end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write_fd, str((end - start) * 1024))
+        os._exit(0)     # pylint: disable=W0212
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as fd:
+        result = int(fd.read())
+    os.waitpid(pid, 0)
+    return result
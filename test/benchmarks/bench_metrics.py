@@ -0,0 +1,104 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+#
+'''
+Benchmarks for the metrics middleware:
+    - GET /bootstrap/config without and with the middleware
+    - GET /metrics, served from the process and aggregated from the
+      snapshots of 16 processes in the metrics directory
+
+    PYTHONPATH=./ python test/benchmarks/bench_metrics.py
+'''
+
+import json
+import os
+import shutil
+import tempfile
+
+from webob import Request
+
+from ztpserver.config import runtime
+from ztpserver.constants import CONTENT_TYPE_YAML
+from ztpserver.controller import Router
+from ztpserver.metrics import Metrics, MetricsMiddleware
+from ztpserver.serializers import dump
+
+from bench_lib import timed, report
+
+def get(app, url):
+    (status, _, app_iter) = Request.blank(url).call_application(app)
+    ''.join(app_iter)
+    if hasattr(app_iter, 'close'):
+        app_iter.close()
+    assert status.startswith('200'), status
+
+def main():
+    data_root = tempfile.mkdtemp()
+    directory = tempfile.mkdtemp()
+    try:
+        runtime.set_value('data_root', data_root, 'default')
+        os.makedirs(os.path.join(data_root, 'bootstrap'))
+        dump({'logging': [{'destination': 'pcl.example.com:514',
+                           'level': 'DEBUG'}]},
+             os.path.join(data_root, 'bootstrap', 'bootstrap.conf'),
+             CONTENT_TYPE_YAML)
+
+        router = Router()
+        metrics = Metrics()
+        app = MetricsMiddleware(router, metrics)
+        for (name, wsgiapp) in [('router', router),
+                                ('metrics middleware', app)]:
+            report('GET /bootstrap/config (%s)' % name,
+                   timed(lambda: get(wsgiapp, '/bootstrap/config'),
+                         number=5000))
+        report('GET /metrics (in-process)',
+               timed(lambda: get(app, '/metrics'), number=1000))
+
+        runtime.set_value('directory', directory, 'metrics')
+        snapshot = metrics.store.snapshot()
+        for pid in range(16):
+            snapshot['pid'] = os.getpid() if pid == 0 else 1
+            with open(os.path.join(directory, 'metrics-%d.json' % pid),
+                      'w') as fhandler:
+                json.dump(snapshot, fhandler)
+        report('GET /metrics (16 processes)',
+               timed(lambda: get(app, '/metrics'), number=1000))
+    finally:
+        runtime.clear_value('directory', 'metrics')
+        runtime.clear_value('data_root', 'default')
+        shutil.rmtree(data_root)
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+#
+'''
+Benchmark for POST /nodes (dynamic provisioning) against a large
+neighbordb, with the ztpserver loggers at INFO writing to /dev/null, with
+and without tracing.
+
+    PYTHONPATH=./ python test/benchmarks/bench_nodes.py [patterns]
+'''
+
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from webob import Request
+
+from ztpserver.config import runtime
+from ztpserver.constants import CONTENT_TYPE_YAML
+from ztpserver.controller import Router
+from ztpserver.serializers import dump
+from ztpserver.tracing import tracer
+
+from bench_lib import timed, report
+
+PORTS = 64
+
+def neighbordb(count):
+    # only the last pattern matches the node
+    patterns = [{'name': 'leaf %d' % index,
+                 'definition': 'leaf',
+                 'interfaces': [{'Ethernet1': 'spine%d:Ethernet1' % index},
+                                {'Ethernet2-%d' % PORTS: 'any'}]}
+                for index in range(count)]
+    return {'patterns': patterns}
+
+def node_request(serialnumber, count):
+    neighbors = dict(('Ethernet%d' % port,
+                      [{'device': 'spine%d' % (count - 1 if port == 1
+                                               else port),
+                        'port': 'Ethernet%d' % port}])
+                     for port in range(1, PORTS + 1))
+    body = json.dumps({'model': 'DCS-7050TX-64',
+                       'serialnumber': serialnumber,
+                       'systemmac': serialnumber,
+                       'version': '4.14.5F',
+                       'neighbors': neighbors})
+    return Request.blank('/nodes', method='POST', body=body,
+                         content_type='application/json')
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    ztps_log = logging.getLogger('ztpserver')
+    ztps_log.setLevel(logging.INFO)
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    handler.setFormatter(logging.Formatter(
+        '%(asctime)s:%(levelname)s:[%(module)s:%(lineno)d] %(message)s'))
+    ztps_log.addHandler(handler)
+
+    data_root = tempfile.mkdtemp()
+    try:
+        runtime.set_value('data_root', data_root, 'default')
+        for folder in ['definitions', 'nodes']:
+            os.makedirs(os.path.join(data_root, folder))
+        dump(neighbordb(count), os.path.join(data_root, 'neighbordb'),
+             CONTENT_TYPE_YAML)
+        dump({'name': 'leaf', 'actions': []},
+             os.path.join(data_root, 'definitions', 'leaf'),
+             CONTENT_TYPE_YAML)
+
+        router = Router()
+        serials = itertools.count()
+
+        def post():
+            request = node_request('%012x' % next(serials), count)
+            response = request.get_response(router)
+            assert response.status_code == 201, response.status
+
+        post()
+        report('POST /nodes at INFO (%d patterns, %d ports)' %
+               (count, PORTS), timed(post, number=20), 'msec')
+
+        runtime.set_value('filename', os.path.join(data_root, 'trace.jsonl'),
+                          'tracing')
+        post()
+        report('POST /nodes at INFO, traced', timed(post, number=20), 'msec')
+
+        def trace():
+            tracer.start('node')
+            for _ in range(5):
+                with tracer.span('state', 'node_exists'):
+                    pass
+            tracer.finish(201)
+
+        report('trace of 5 spans (written)', timed(trace, number=1000),
+               'usec')
+    finally:
+        runtime.clear_value('filename', 'tracing')
+        runtime.clear_value('data_root', 'default')
+        shutil.rmtree(data_root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+#
+'''
+Benchmarks for reading node files from the repository with and without the
+file cache, and for GET /meta digests of a large image.
+
+    PYTHONPATH=./ python test/benchmarks/bench_repository.py
+'''
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from ztpserver.config import runtime
+from ztpserver.constants import CONTENT_TYPE_JSON, CONTENT_TYPE_OTHER
+from ztpserver.constants import CONTENT_TYPE_PYTHON, CONTENT_TYPE_YAML
+from ztpserver.repository import Repository, DigestIndex, file_cache
+from ztpserver.serializers import dump
+
+from bench_lib import timed, report, report_size, peak_rss
+
+def definition(count):
+    return {'name': 'leaf',
+            'actions': [{'name': 'action %d' % index,
+                         'action': 'replace_config',
+                         'attributes': {'url': '/files/config/%d' % index,
+                                        'variables': ['a', 'b', 'c']}}
+                        for index in range(count)]}
+
+def create_node(path):
+    node = os.path.join(path, 'nodes', '001c73000001')
+    os.makedirs(node)
+    os.makedirs(os.path.join(path, 'bootstrap'))
+
+    dump(definition(50), os.path.join(node, 'definition'), CONTENT_TYPE_YAML)
+    dump({'ntp': '1.1.1.1', 'hostname': 'leaf1'},
+         os.path.join(node, 'attributes'), CONTENT_TYPE_YAML)
+    dump({'name': 'leaf', 'interfaces': [{'any': 'any:any'}]},
+         os.path.join(node, 'pattern'), CONTENT_TYPE_YAML)
+    dump({'serialnumber': '001c73000001', 'neighbors': {}},
+         os.path.join(node, '.node'), CONTENT_TYPE_JSON)
+    dump('hostname leaf1\n' * 500, os.path.join(node, 'startup-config'),
+         CONTENT_TYPE_OTHER)
+    dump('#!/usr/bin/env python\n' + '# bootstrap\n' * 5000,
+         os.path.join(path, 'bootstrap', 'bootstrap'), CONTENT_TYPE_OTHER)
+
+FILES = [('nodes/001c73000001/.node', CONTENT_TYPE_JSON),
+         ('nodes/001c73000001/pattern', CONTENT_TYPE_YAML),
+         ('nodes/001c73000001/startup-config', CONTENT_TYPE_OTHER),
+         ('nodes/001c73000001/definition', CONTENT_TYPE_YAML),
+         ('nodes/001c73000001/attributes', CONTENT_TYPE_YAML),
+         ('bootstrap/bootstrap', CONTENT_TYPE_PYTHON)]
+
+def read_files(repository):
+    for (filename, content_type) in FILES:
+        repository.get_file(filename).read(content_type)
+
+def bench_file_cache(path):
+    create_node(path)
+    repository = Repository(path)
+    try:
+        for size in [0, 16777216]:
+            runtime.set_value('file_cache_size', size, 'default')
+            file_cache.clear()
+            report('read node files (file_cache_size=%d)' % size,
+                   timed(lambda: read_files(repository), number=200),
+                   'msec')
+    finally:
+        runtime.clear_value('file_cache_size', 'default')
+
+def read_sha1(filename):
+    # what GET /meta used to do on every request
+    return hashlib.sha1(open(filename).read()).hexdigest()
+
+def file_digests_cold(path, filename):
+    os.remove(os.path.join(path, '.digests'))
+    DigestIndex(path).digests(filename)
+
+def bench_digests(path, size):
+    filename = os.path.join(path, 'image.swi')
+    with open(filename, 'wb') as fhandler:
+        for _ in range(size):
+            fhandler.write(os.urandom(1024 * 1024))
+
+    report('%d MB image: sha1 of whole file' % size,
+           timed(lambda: read_sha1(filename), repeat=1), 'msec')
+    report_size('%d MB image: sha1 of whole file, peak RSS' % size,
+                peak_rss(lambda: read_sha1(filename)), 'MB')
+
+    report('%d MB image: first digests' % size,
+           timed(lambda: DigestIndex(path).digests(filename), repeat=1),
+           'msec')
+    report_size('%d MB image: first digests, peak RSS' % size,
+                peak_rss(lambda: file_digests_cold(path, filename)), 'MB')
+
+    index = DigestIndex(path)
+    report('%d MB image: indexed digests' % size,
+           timed(lambda: index.digests(filename), number=1000), 'usec')
+    report('%d MB image: indexed digests (new process)' % size,
+           timed(lambda: DigestIndex(path).digests(filename), number=100),
+           'usec')
+
+def main():
+    path = tempfile.mkdtemp()
+    try:
+        bench_file_cache(path)
+        bench_digests(path, 512)
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+#
+'''
+Benchmarks for the per-request overhead of the router:
+    - dispatch of the hot routes through routes.Mapper vs the route trie
+    - GET /bootstrap/config with a controller built for every request vs
+      the long-lived controllers of the application context, and with
+      and without the route trie
+
+    PYTHONPATH=./ python test/benchmarks/bench_router.py
+'''
+
+import os
+import shutil
+import tempfile
+
+import routes
+
+from webob import Request
+
+from ztpserver.config import runtime
+from ztpserver.constants import CONTENT_TYPE_YAML
+from ztpserver.controller import Router, BootstrapController
+from ztpserver.serializers import dump
+from ztpserver.wsgiapp import WSGIRouter, RouteTrie
+
+from bench_lib import timed, report
+
+HOT_ROUTES = [('GET', '/bootstrap'),
+              ('GET', '/bootstrap/config'),
+              ('POST', '/nodes'),
+              ('GET', '/nodes/001c73000001'),
+              ('GET', '/nodes/001c73000001/startup-config'),
+              ('GET', '/actions/install_image'),
+              ('GET', '/files/images/vEOS.swi'),
+              ('GET', '/meta/files/images/vEOS.swi')]
+
+class PerRequestRouter(Router):
+    ''' Router building a new controller (and repository) per request '''
+
+    controller = WSGIRouter.controller
+
+class MapperRouter(Router):
+    ''' Router dispatching every request through routes.Mapper '''
+
+    def __init__(self):
+        super(MapperRouter, self).__init__()
+        self.trie = RouteTrie(routes.Mapper())
+
+def bench_dispatch(router):
+    for (method, url) in HOT_ROUTES:
+        environ = Request.blank(url, method=method).environ
+        report('%s %s: mapper' % (method, url),
+               timed(lambda: router.map.routematch(environ=environ),
+                     number=10000))
+        report('%s %s: trie' % (method, url),
+               timed(lambda: router.trie.match(environ), number=10000))
+
+def get(router, url):
+    response = Request.blank(url).get_response(router)
+    assert response.status_code == 200, response.status
+
+def main():
+    data_root = tempfile.mkdtemp()
+    try:
+        runtime.set_value('data_root', data_root, 'default')
+        os.makedirs(os.path.join(data_root, 'bootstrap'))
+        dump({'logging': [{'destination': 'pcl.example.com:514',
+                           'level': 'DEBUG'}]},
+             os.path.join(data_root, 'bootstrap', 'bootstrap.conf'),
+             CONTENT_TYPE_YAML)
+
+        bench_dispatch(Router())
+
+        for (name, router) in [('per-request controller', PerRequestRouter()),
+                               ('mapper', MapperRouter()),
+                               ('trie', Router())]:
+            report('get controller (%s)' % name,
+                   timed(lambda: router.controller(BootstrapController),
+                         number=10000))
+            report('GET /bootstrap/config (%s)' % name,
+                   timed(lambda: get(router, '/bootstrap/config'),
+                         number=2000))
+    finally:
+        runtime.clear_value('data_root', 'default')
+        shutil.rmtree(data_root)
+
+if __name__ == '__main__':
+    main()
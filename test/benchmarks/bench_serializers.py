@@ -0,0 +1,124 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+Benchmarks for the YAML serializer backends (pure-Python and libyaml).
+
+    PYTHONPATH=./ python test/benchmarks/bench_serializers.py
+'''
+
+import json
+import yaml
+
+from collections import OrderedDict
+
+from ztpserver.constants import CONTENT_TYPE_JSON, CONTENT_TYPE_YAML
+from ztpserver.serializers import YAMLLoader, YAMLDumper, YAMLSerializer
+from ztpserver.serializers import loads
+
+from bench_lib import peak_rss, timed, report, report_size
+
+def neighbordb(count):
+    ''' Returns a neighbordb with count global patterns '''
+    patterns = list()
+    for index in range(count):
+        patterns.append(OrderedDict([
+            ('name', 'leaf %d' % index),
+            ('definition', 'leaf'),
+            ('variables', {'spine': "regex('spine%d')" % (index % 8)}),
+            ('interfaces', [{'Ethernet1': '$spine:Ethernet%d' % index},
+                            {'Ethernet2-48': 'any'},
+                            {'any': 'none'}])]))
+    return dict(variables={'any_spine': "regex('spine\\d+')"},
+                patterns=patterns)
+
+def resource_pool(count):
+    ''' Returns an allocate plugin resource pool with count entries, half
+    of them allocated
+    '''
+    return dict(('10.%d.%d.%d/31' % (x >> 16, (x >> 8) & 0xff, x & 0xff),
+                 'JPE%08d' % x if x % 2 else None)
+                for x in range(count))
+
+def lldp_neighbors(count):
+    ''' Returns a POST /nodes body with count LLDP neighbors '''
+    neighbors = dict(('Ethernet%d' % x,
+                      [dict(device='spine%d.example.com' % (x % 4),
+                            port='Ethernet%d/%d' % (x / 48 + 1, x % 48 + 1))])
+                     for x in range(1, count + 1))
+    return dict(model='DCS-7508', serialnumber='JPE00000001',
+                systemmac='00:1c:73:00:00:01', version='4.14.5F',
+                neighbors=neighbors)
+
+def bench_loads(name, text, content_type, number, repeat=3, memory=False):
+    report_size('%s size' % name, len(text), 'MB')
+    report('%s loads()' % name,
+           timed(lambda: loads(text, content_type, 'bench'), number,
+                 repeat), 'msec')
+    if memory:
+        report_size('%s loads() peak memory' % name,
+                    peak_rss(lambda: loads(text, content_type, 'bench')),
+                    'MB')
+
+def bench(name, data, number):
+    text = yaml.safe_dump(data, default_flow_style=False)
+    serializer = YAMLSerializer('bench')
+    assert serializer.serialize(data) == text
+
+    report('%s load (SafeLoader)' % name,
+           timed(lambda: yaml.load(text, Loader=yaml.SafeLoader), number),
+           'msec')
+    report('%s load (%s)' % (name, YAMLLoader.__name__),
+           timed(lambda: yaml.load(text, Loader=YAMLLoader), number),
+           'msec')
+    report('%s dump (SafeDumper)' % name,
+           timed(lambda: yaml.dump(data, Dumper=yaml.SafeDumper,
+                                   default_flow_style=False), number),
+           'msec')
+    report('%s dump (%s)' % (name, YAMLDumper.__name__),
+           timed(lambda: serializer.serialize(data), number), 'msec')
+
+def main():
+    bench('neighbordb (1000 patterns)', neighbordb(1000), 1)
+    bench('resource pool (10000 entries)', resource_pool(10000), 1)
+
+    # ~10 MB neighbordb
+    text = yaml.dump(neighbordb(65000), Dumper=YAMLDumper,
+                     default_flow_style=False)
+    bench_loads('neighbordb (65000 patterns)', text, CONTENT_TYPE_YAML, 1,
+                repeat=1, memory=True)
+    text = json.dumps(lldp_neighbors(576))
+    bench_loads('POST /nodes (576 neighbors)', text, CONTENT_TYPE_JSON, 20)
+
+if __name__ == '__main__':
+    main()
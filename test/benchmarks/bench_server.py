@@ -0,0 +1,169 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+Load test for the standalone server modes: bootstrap clients (GET
+/bootstrap) are started while slow clients are downloading a large image
+(GET /files/image) and the bootstrap latency is reported for each mode.
+
+    PYTHONPATH=./ python test/benchmarks/bench_server.py [clients]
+'''
+
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import ztpserver.controller
+import ztpserver.server
+
+from ztpserver.config import runtime
+
+
+IMAGE_SIZE = 32 * 1024 * 1024
+
+# slow downloads: READ_SIZE bytes every READ_DELAY seconds (~12.8 MB/s)
+READ_SIZE = 256 * 1024
+READ_DELAY = 0.02
+DOWNLOADS = 2
+
+def get(port, url, results=None, slow=False):
+    ''' Sends GET url over a new connection, reads the whole response and
+    appends the elapsed time to results
+    '''
+    start = time.time()
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall('GET %s HTTP/1.0\r\n\r\n' % url)
+    received = 0
+    while True:
+        data = sock.recv(READ_SIZE if slow else 65536)
+        if not data:
+            break
+        received += len(data)
+        if slow:
+            time.sleep(READ_DELAY)
+    sock.close()
+    if results is not None:
+        results.append(time.time() - start)
+    return received
+
+def start_server(mode):
+    ''' Forks a server process running in mode and returns its pid and
+    port
+    '''
+    runtime.set_value('mode', mode, 'server')
+    server = ztpserver.server.make_server('127.0.0.1', 0,
+                                          ztpserver.controller.Router())
+    pid = os.fork()
+    if pid == 0:
+        try:
+            if mode == 'prefork':
+                ztpserver.server.run_prefork(server, runtime.server.workers)
+            else:
+                ztpserver.server.run(server)
+        finally:
+            os._exit(0)     # pylint: disable=W0212
+    port = server.server_port
+    server.server_close()
+    return (pid, port)
+
+def bench(mode, clients):
+    (pid, port) = start_server(mode)
+    try:
+        # warm up
+        get(port, '/bootstrap')
+        get(port, '/files/image')
+
+        downloads = [threading.Thread(target=get,
+                                      args=(port, '/files/image', None, True))
+                     for _ in range(DOWNLOADS)]
+        for thread in downloads:
+            thread.start()
+        time.sleep(0.2)
+
+        results = []
+        threads = [threading.Thread(target=get,
+                                    args=(port, '/bootstrap', results))
+                   for _ in range(clients)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        for thread in downloads:
+            thread.join()
+
+        results.sort()
+        print '%-10s %4d clients: p50 %8.1f ms  max %8.1f ms  all done ' \
+              'after %8.1f ms' % (mode, clients,
+                                  results[len(results) / 2] * 1000,
+                                  results[-1] * 1000, elapsed * 1000)
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+        runtime.clear_value('mode', 'server')
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    logging.disable(logging.CRITICAL)
+    ztpserver.server.ZTPRequestHandler.log_message = lambda *args: None
+
+    data_root = tempfile.mkdtemp()
+    try:
+        runtime.set_value('data_root', data_root, 'default')
+        for folder in ['bootstrap', 'files']:
+            os.makedirs(os.path.join(data_root, folder))
+        with open(os.path.join(data_root, 'bootstrap', 'bootstrap'),
+                  'w') as fd:
+            fd.write('#!/usr/bin/env python\nSERVER = "$SERVER"\n' +
+                     '# bootstrap\n' * 1000)
+        with open(os.path.join(data_root, 'files', 'image'), 'wb') as fd:
+            fd.write(os.urandom(IMAGE_SIZE))
+
+        print 'GET /bootstrap while %d clients download %d MB at ~%.1f ' \
+              'MB/s' % (DOWNLOADS, IMAGE_SIZE / 1048576,
+                        READ_SIZE / READ_DELAY / 1048576)
+        for mode in ztpserver.server.SERVER_MODES:
+            bench(mode, clients)
+    finally:
+        runtime.clear_value('data_root', 'default')
+        shutil.rmtree(data_root)
+
+if __name__ == '__main__':
+    main()
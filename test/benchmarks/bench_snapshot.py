@@ -0,0 +1,93 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+Cold-start benchmark for loading neighbordb with and without the compiled
+neighbordb snapshot.
+
+    PYTHONPATH=./ python test/benchmarks/bench_snapshot.py
+'''
+
+import os
+import shutil
+import tempfile
+
+from ztpserver.config import runtime
+from ztpserver.constants import CONTENT_TYPE_YAML
+from ztpserver.serializers import dump
+from ztpserver.topology import create_neighbordb_snapshot
+from ztpserver.topology import load_compiled_neighbordb
+
+from bench_lib import timed, report
+
+def neighbordb(count):
+    patterns = []
+    for index in range(count):
+        patterns.append({'name': 'leaf %d' % index,
+                         'definition': 'leaf',
+                         'node': '%012x' % index,
+                         'variables': {'spine': "regex('spine%d')" % index},
+                         'interfaces': [{'Ethernet1': '$spine:Ethernet%d' %
+                                                     index},
+                                        {'Ethernet2-48': 'any'},
+                                        {'Ethernet49': 'none'}]})
+    return {'variables': {'any_spine': "regex('spine\\d+')"},
+            'patterns': patterns}
+
+def bench_cold_start(count):
+    data_root = tempfile.mkdtemp()
+    try:
+        runtime.set_value('data_root', data_root, 'default')
+        dump(neighbordb(count), os.path.join(data_root, 'neighbordb'),
+             CONTENT_TYPE_YAML)
+
+        runtime.set_value('snapshot', False, 'neighbordb')
+        assert load_compiled_neighbordb('bench') is not None
+        report('neighbordb cold start, %d patterns (YAML)' % count,
+               timed(lambda: load_compiled_neighbordb('bench')), 'msec')
+
+        runtime.set_value('snapshot', True, 'neighbordb')
+        assert create_neighbordb_snapshot('bench')
+        report('neighbordb cold start, %d patterns (snapshot)' % count,
+               timed(lambda: load_compiled_neighbordb('bench')), 'msec')
+    finally:
+        runtime.clear_value('data_root', 'default')
+        runtime.clear_value('snapshot', 'neighbordb')
+        shutil.rmtree(data_root)
+
+def main():
+    bench_cold_start(100)
+    bench_cold_start(1000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+Microbenchmarks for neighbordb pattern matching.
+
+    PYTHONPATH=./ python test/benchmarks/bench_topology.py
+'''
+
+import gc
+import itertools
+import os
+
+import yaml
+
+from collections import OrderedDict
+
+from ztpserver.topology import InterfacePattern, Neighbor, Node, Pattern
+from ztpserver.topology import compile_neighbordb
+
+from bench_lib import rss, sizeof, timed, report, report_size
+
+KEYWORDS = ['any', 'none']
+
+def interface_patterns():
+    ''' Returns one InterfacePattern for each (interface, device, port)
+    keyword class
+    '''
+    interfaces = KEYWORDS + ['Ethernet1']
+    devices = KEYWORDS + ['spine1', r"regex('spine\d+')"]
+    ports = KEYWORDS + ['Ethernet1', "includes('Ethernet')"]
+    return [InterfacePattern(intf, device, port, 'bench')
+            for (intf, device, port) in
+            itertools.product(interfaces, devices, ports)]
+
+def bench_interface_pattern_match():
+    patterns = interface_patterns()
+    neighbors = [Neighbor('leaf%d' % x, 'Ethernet%d' % x)
+                 for x in range(1, 4)] + [Neighbor('spine1', 'Ethernet1')]
+
+    def run():
+        for pattern in patterns:
+            for interface in ['Ethernet1', 'Ethernet2']:
+                pattern.match(interface, neighbors)
+
+    calls = len(patterns) * 2
+    report('InterfacePattern.match (per call)',
+           timed(run, number=2000) / calls)
+
+def bench_pattern_match_chassis():
+    # 7500-series chassis: 576 LLDP ports, pattern covering all of them
+    neighbors = OrderedDict(('Ethernet%d' % x,
+                             [dict(device='spine%d' % (x % 4),
+                                   port='Ethernet%d' % x)])
+                            for x in range(1, 577))
+    node = Node(serialnumber='bench', neighbors=neighbors)
+    pattern = Pattern(name='chassis', definition='bench', node_id='bench',
+                      interfaces=[{'Ethernet1-576': r"regex('spine\d')"},
+                                  {'none': 'leaf1'},
+                                  {'none': 'spine9'}])
+    assert pattern.match_node(node)
+
+    report('Pattern.match_node (576 ports)',
+           timed(lambda: pattern.match_node(node), number=5), 'msec')
+
+def bench_pattern_memory():
+    # 7500-series chassis (576 ports) and 48+4x4 port pattern ranges
+    interfaces = [{'Ethernet1-576': r"regex('spine\d')"},
+                  {'Ethernet1-48,Ethernet49/1-49/4': 'any'},
+                  {'none': 'leaf1'}]
+    count = 200
+
+    def create():
+        return Pattern(name='chassis', definition='bench', node_id='bench',
+                       interfaces=interfaces)
+
+    report('Pattern() (576+64 port ranges)', timed(create, number=5), 'msec')
+
+    gc.collect()
+    start = rss()
+    patterns = [create() for _ in range(count)]
+    gc.collect()
+    report_size('Pattern memory (576+64 port ranges, per pattern)',
+                (rss() - start) / len(patterns))
+
+def bench_neighbordb_memory():
+    filename = os.path.join(os.path.dirname(__file__), '..', 'neighbordb',
+                            'large_pattern_test.yml')
+    with open(filename) as fd:
+        contents = yaml.safe_load(fd)['neighbordb']
+
+    neighbordb = compile_neighbordb('bench', contents)
+    patterns = neighbordb.get_patterns()
+    report_size('Neighbordb memory (large_pattern_test, per pattern)',
+                sizeof(neighbordb) / len(patterns), 'B')
+
+def main():
+    bench_interface_pattern_match()
+    bench_pattern_match_chassis()
+    bench_pattern_memory()
+    bench_neighbordb_memory()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,471 @@
+#
+# Copyright (c) 2018, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+# pylint: disable=C0102,C0103,E1103,W0142,W0613,C0302,E1120
+#
+
+import imp
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import patch
+
+from ztpserver import allocation
+from ztpserver.config import runtime
+from ztpserver.constants import CONTENT_TYPE_YAML
+from ztpserver.serializers import load, dump
+
+PLUGINS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           os.pardir, os.pardir, 'plugins')
+
+
+class ResourcePoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_root)
+        os.mkdir(os.path.join(self.data_root, 'resources'))
+        runtime.set_value('data_root', self.data_root, 'default')
+        self.addCleanup(runtime.clear_value, 'data_root', 'default')
+
+    def set_journal_size(self, size):
+        runtime.set_value('resource_journal_size', size, 'default')
+        self.addCleanup(runtime.clear_value, 'resource_journal_size',
+                        'default')
+
+    def write_pool(self, contents, name='pool'):
+        filename = os.path.join(self.data_root, 'resources', name)
+        dump(contents, filename, CONTENT_TYPE_YAML)
+        return filename
+
+    def read_pool(self, name='pool'):
+        return load(os.path.join(self.data_root, 'resources', name),
+                    CONTENT_TYPE_YAML)
+
+    def journal(self, name='pool'):
+        filename = os.path.join(self.data_root, allocation.JOURNAL_DIR, name)
+        if not os.path.exists(filename):
+            return []
+        with open(filename) as fhandler:
+            return [json.loads(line) for line in fhandler if line.strip()]
+
+    def pool(self, name='pool'):
+        return allocation.ResourcePool(self.data_root, name)
+
+
+class ResourcePoolUnitTests(ResourcePoolTestCase):
+
+    def test_allocate(self):
+        self.write_pool({'a': 'node0', 'b': None, 'c': None})
+        pool = self.pool()
+        key1 = pool.allocate('node1')
+        key2 = pool.allocate('node2')
+        self.assertEqual(set([key1, key2]), set(['b', 'c']))
+        self.assertEqual(pool.allocate('node1'), key1)
+        self.assertEqual(pool.allocate('node0'), 'a')
+        self.assertIsNone(pool.allocate('node3'))
+
+        stats = pool.stats()
+        self.assertEqual(stats['allocations'], 2)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['loads'], 1)
+        self.assertEqual(stats['allocated'], 3)
+
+    def test_allocate_large_pool(self):
+        self.write_pool(dict(('10.0.%d.%d/31' % (index / 256, index % 256),
+                              'node%d' % index if index % 2 else None)
+                             for index in range(1000)))
+        pool = self.pool()
+        keys = [pool.allocate('new%d' % index) for index in range(500)]
+        self.assertEqual(len(set(keys)), 500)
+        self.assertTrue(all(int(key.split('.')[-1].split('/')[0]) % 2 == 0
+                            for key in keys))
+        self.assertIsNone(pool.allocate('full'))
+        self.assertEqual(pool.allocate('node1'), '10.0.0.1/31')
+
+    def test_journaled(self):
+        self.write_pool({'a': None})
+        pool = self.pool()
+        pool.allocate('node1')
+        self.assertEqual(self.read_pool(), {'a': None})
+        self.assertEqual(self.journal(), [['a', 'node1']])
+        self.assertEqual(pool.stats()['journal'], 1)
+
+    def test_compacted(self):
+        self.set_journal_size(3)
+        self.write_pool({'a': None, 'b': None, 'c': None, 'd': None})
+        pool = self.pool()
+        pool.allocate('node1')
+        pool.allocate('node2')
+        self.assertEqual(self.read_pool().values(), [None] * 4)
+        self.assertEqual(len(self.journal()), 2)
+
+        pool.allocate('node3')
+        self.assertEqual(sorted(self.read_pool().values()),
+                         [None, 'node1', 'node2', 'node3'])
+        self.assertEqual(self.journal(), [])
+        self.assertEqual(pool.stats()['compactions'], 1)
+
+        # the compaction itself does not reload the pool
+        pool.allocate('node4')
+        self.assertEqual(pool.stats()['loads'], 1)
+
+    def test_compaction_replaces_pool(self):
+        self.set_journal_size(0)
+        filename = self.write_pool({'a': None})
+        os.chmod(filename, 0640)
+        inode = os.stat(filename).st_ino
+
+        self.pool().allocate('node1')
+        self.assertNotEqual(os.stat(filename).st_ino, inode)
+        self.assertEqual(os.stat(filename).st_mode & 0777, 0640)
+        self.assertEqual(os.listdir(os.path.dirname(filename)), ['pool'])
+
+    def test_compaction_failure(self):
+        self.set_journal_size(0)
+        filename = self.write_pool({'a': None, 'b': None})
+        pool = self.pool()
+        with patch('ztpserver.allocation.os.rename', side_effect=OSError):
+            self.assertRaises(OSError, pool.allocate, 'node1')
+        self.assertEqual(os.listdir(os.path.dirname(filename)), ['pool'])
+        self.assertEqual(self.read_pool(), {'a': None, 'b': None})
+
+    def test_no_journal(self):
+        self.set_journal_size(0)
+        self.write_pool({'a': None})
+        self.pool().allocate('node1')
+        self.assertEqual(self.read_pool(), {'a': 'node1'})
+        self.assertEqual(self.journal(), [])
+
+    def test_journal_replayed(self):
+        self.write_pool({'a': None, 'b': None})
+        key = self.pool().allocate('node1')
+
+        pool = self.pool()
+        self.assertEqual(pool.allocate('node1'), key)
+        self.assertNotEqual(pool.allocate('node2'), key)
+
+    def test_journal_shared(self):
+        self.write_pool({'a': None, 'b': None, 'c': None})
+        (pool1, pool2) = (self.pool(), self.pool())
+        keys = [pool1.allocate('node1'), pool2.allocate('node2'),
+                pool1.allocate('node3')]
+        self.assertEqual(sorted(keys), ['a', 'b', 'c'])
+        self.assertEqual(pool2.allocate('node1'), keys[0])
+        self.assertEqual(pool2.stats()['loads'], 1)
+
+    def test_compaction_by_other_pool(self):
+        self.set_journal_size(2)
+        self.write_pool({'a': None, 'b': None, 'c': None})
+        (pool1, pool2) = (self.pool(), self.pool())
+        key1 = pool1.allocate('node1')
+        key2 = pool2.allocate('node2')
+        self.assertEqual(self.journal(), [])
+        key3 = pool1.allocate('node3')
+        self.assertEqual(sorted([key1, key2, key3]), ['a', 'b', 'c'])
+        self.assertEqual(pool1.allocate('node2'), key2)
+        self.assertEqual(pool1.stats()['loads'], 2)
+
+    def test_edited(self):
+        self.set_journal_size(2)
+        self.write_pool({'a': None, 'b': None, 'c': None})
+        pool = self.pool()
+        for node_id in ['node1', 'node2', 'node3']:
+            pool.allocate(node_id)
+        contents = self.read_pool()
+        keys = dict((value, key) for key, value in contents.items())
+        self.assertNotIn('node3', keys)
+
+        # node1 is freed, node3 is only journaled
+        contents[keys['node1']] = None
+        self.write_pool(contents)
+        self.assertEqual(pool.allocate('node4'), keys['node1'])
+        self.assertEqual(pool.allocate('node3'), keys[None])
+        self.assertIsNone(pool.allocate('node1'))
+        self.assertEqual(pool.stats()['loads'], 2)
+
+    def test_edited_journal_conflict(self):
+        self.write_pool({'a': None})
+        self.pool().allocate('node1')
+
+        # a was allocated manually: the journal record is dropped
+        self.write_pool({'a': 'node2', 'b': None})
+        pool = self.pool()
+        with patch.object(allocation.log, 'warning') as m_warning:
+            self.assertEqual(pool.allocate('node1'), 'b')
+        self.assertTrue(m_warning.called)
+        self.assertEqual(pool.allocate('node2'), 'a')
+
+    def test_compact(self):
+        self.write_pool({'a': None, 'b': None})
+        (pool1, pool2) = (self.pool(), self.pool())
+        key1 = pool1.allocate('node1')
+        key2 = pool2.allocate('node2')
+
+        # the allocations of the other pools (processes) are compacted too
+        pool1.compact()
+        self.assertEqual(self.read_pool(), {key1: 'node1', key2: 'node2'})
+        self.assertEqual(self.journal(), [])
+        self.assertEqual(pool1.stats()['compactions'], 1)
+
+        pool1.compact()
+        self.assertEqual(pool1.stats()['compactions'], 1)
+
+    def test_compact_not_loaded(self):
+        self.write_pool({'a': None})
+        self.pool().compact()
+        self.assertFalse(os.path.exists(os.path.join(self.data_root,
+                                                     allocation.JOURNAL_DIR)))
+
+    @patch.dict(allocation.POOLS, clear=True)
+    def test_compact_pools(self):
+        self.write_pool({'a': None})
+        self.write_pool({'b': None}, name='other')
+        allocation.resource_pool(self.data_root, 'pool').allocate('node1')
+        other = allocation.resource_pool(self.data_root, 'other')
+        other.allocate('node2')
+
+        with patch.object(other, 'compact', side_effect=OSError):
+            allocation.compact_pools()
+        self.assertEqual(self.read_pool(), {'a': 'node1'})
+        self.assertEqual(self.read_pool('other'), {'b': None})
+
+    @patch.dict(allocation.POOLS, clear=True)
+    @patch('ztpserver.allocation.compactor', None)
+    def test_compactor(self):
+        runtime.set_value('resource_compact_interval', 1, 'default')
+        self.addCleanup(runtime.clear_value, 'resource_compact_interval',
+                        'default')
+        self.write_pool({'a': None})
+        allocation.resource_pool(self.data_root, 'pool').allocate('node1')
+        self.assertTrue(allocation.compactor.is_alive())
+
+        deadline = time.time() + 5
+        while self.journal() and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(self.read_pool(), {'a': 'node1'})
+
+    def test_partial_record(self):
+        self.write_pool({'a': None, 'b': None})
+        key = self.pool().allocate('node1')
+        with open(os.path.join(self.data_root, allocation.JOURNAL_DIR,
+                               'pool'), 'a') as fhandler:
+            fhandler.write('["b", "no')
+
+        other = self.pool().allocate('node2')
+        self.assertNotEqual(other, key)
+        pool = self.pool()
+        self.assertEqual(pool.allocate('node1'), key)
+        self.assertEqual(pool.allocate('node2'), other)
+
+    def test_invalid_record(self):
+        self.write_pool({'a': None})
+        filename = os.path.join(self.data_root, allocation.JOURNAL_DIR,
+                                'pool')
+        os.mkdir(os.path.dirname(filename))
+        with open(filename, 'w') as fhandler:
+            fhandler.write('foo\n{}\n["missing", "node1"]\n')
+        self.assertEqual(self.pool().allocate('node1'), 'a')
+
+    def test_non_string_resources(self):
+        self.write_pool({1: None, 2: None})
+        key = self.pool().allocate('node1')
+        self.assertEqual(self.journal(), [[str(key), 'node1']])
+        pool = self.pool()
+        self.assertEqual(pool.allocate('node1'), key)
+        self.assertEqual(pool.allocate('node2'), 3 - key)
+
+    def test_empty_pool(self):
+        self.write_pool({})
+        self.assertRaises(allocation.ResourcePoolError,
+                          self.pool().allocate, 'node1')
+
+    def test_missing_pool(self):
+        self.assertRaises(Exception, self.pool().allocate, 'node1')
+
+    def test_write_failure(self):
+        self.write_pool({'a': None})
+        pool = self.pool()
+        with patch.object(pool, '_append', side_effect=OSError):
+            self.assertRaises(OSError, pool.allocate, 'node1')
+        self.assertEqual(pool.allocate('node2'), 'a')
+
+    def test_resource_pool(self):
+        pool = allocation.resource_pool(self.data_root, 'pool')
+        self.assertIs(allocation.resource_pool(self.data_root, 'pool'), pool)
+        self.assertIsNot(allocation.resource_pool(self.data_root, 'other'),
+                         pool)
+
+    def test_clear_journals(self):
+        self.write_pool({'a': None})
+        self.pool().allocate('node1')
+        allocation.clear_journals(self.data_root)
+        self.assertEqual(self.journal(), [])
+        allocation.clear_journals(self.data_root)
+
+
+class AllocationStressTests(ResourcePoolTestCase):
+
+    PROCESSES = 4
+    THREADS = 4
+    ALLOCATIONS = 15
+
+    SCRIPT = '''if True:
+        import json
+        import threading
+        from ztpserver.allocation import ResourcePool, resource_pool
+        from ztpserver.config import runtime
+        runtime.set_value('data_root', %(data_root)r, 'default')
+        runtime.set_value('resource_journal_size', 20, 'default')
+
+        results = dict()
+        def allocate(thread):
+            # half of the threads share the pool of the process, the
+            # others only synchronize through the journal lock
+            if thread %% 2:
+                pool = ResourcePool(%(data_root)r, 'pool')
+            else:
+                pool = resource_pool(%(data_root)r, 'pool')
+            for index in range(%(allocations)d):
+                node_id = 'node-%(process)d-%%d-%%d' %% (thread, index)
+                results[node_id] = pool.allocate(node_id)
+                # the second allocation must return the same resource
+                assert pool.allocate(node_id) == results[node_id]
+
+        threads = [threading.Thread(target=allocate, args=(thread,))
+                   for thread in range(%(threads)d)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print json.dumps(results)
+    '''
+
+    def test_no_duplicates(self):
+        # one resource more than the number of allocations
+        size = self.PROCESSES * self.THREADS * self.ALLOCATIONS + 1
+        self.write_pool(dict(('10.0.%d.%d/32' % (index / 256, index % 256),
+                              None) for index in range(size)))
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        processes = []
+        for process in range(self.PROCESSES):
+            script = self.SCRIPT % dict(data_root=self.data_root,
+                                        process=process,
+                                        threads=self.THREADS,
+                                        allocations=self.ALLOCATIONS)
+            processes.append(subprocess.Popen([sys.executable, '-c', script],
+                                              env=env,
+                                              stdout=subprocess.PIPE))
+
+        results = dict()
+        for process in processes:
+            (output, _) = process.communicate()
+            self.assertEqual(process.returncode, 0)
+            results.update(json.loads(output))
+
+        self.assertEqual(len(results), size - 1)
+        self.assertNotIn(None, results.values())
+        self.assertEqual(len(set(results.values())), size - 1)
+
+        # the pool file and the journal agree with what was returned
+        pool = self.pool()
+        for node_id, key in results.items():
+            self.assertEqual(pool.allocate(node_id), key)
+        self.assertEqual(pool.stats()['allocations'], 0)
+        self.assertIsNotNone(pool.allocate('last'))
+        self.assertIsNone(pool.allocate('full'))
+
+    def test_threads(self):
+        size = self.THREADS * self.ALLOCATIONS
+        self.write_pool(dict(('r%d' % index, None) for index in range(size)))
+        self.set_journal_size(7)
+
+        results = dict()
+        def allocate(thread):
+            pool = allocation.ResourcePool(self.data_root, 'pool')
+            for index in range(self.ALLOCATIONS):
+                node_id = 'node-%d-%d' % (thread, index)
+                results[node_id] = pool.allocate(node_id)
+
+        threads = [threading.Thread(target=allocate, args=(thread,))
+                   for thread in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(results.values())), size)
+        self.assertNotIn(None, results.values())
+
+
+class AllocatePluginUnitTests(ResourcePoolTestCase):
+
+    def setUp(self):
+        super(AllocatePluginUnitTests, self).setUp()
+        self.plugin = imp.load_source('allocate',
+                                      os.path.join(PLUGINS_DIR, 'allocate'))
+
+    def test_allocate(self):
+        self.write_pool({'10.0.0.1/24': None})
+        self.assertEqual(self.plugin.main('node1', 'pool', None),
+                         '10.0.0.1/24')
+        self.assertEqual(self.plugin.main('node1', 'pool', None),
+                         '10.0.0.1/24')
+
+    def test_no_resource_free(self):
+        self.write_pool({'10.0.0.1/24': 'node1'})
+        try:
+            self.plugin.main('node2', 'pool', None)
+            self.fail('allocated a resource from a full pool')
+        except Exception as exc:        #pylint: disable=W0703
+            self.assertEqual(str(exc), "node2: no resource free in 'pool'")
+
+    def test_failure(self):
+        try:
+            self.plugin.main('node1', 'missing', None)
+            self.fail('allocated a resource from a missing pool')
+        except Exception as exc:        #pylint: disable=W0703
+            self.assertIn("node1: failed to allocate resource from "
+                          "'missing'", str(exc))
+
+
+if __name__ == '__main__':
+    unittest.main()
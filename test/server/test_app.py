@@ -36,6 +36,7 @@ import unittest
 from mock import patch
 
 import ztpserver.app
+import ztpserver.metrics
 
 class TestApp(unittest.TestCase):
     #pylint: disable=R0904,C0103
@@ -46,5 +47,15 @@ class TestApp(unittest.TestCase):
         obj = ztpserver.app.start_wsgiapp()
         self.assertIsInstance(obj, ztpserver.controller.Router)
 
+    @patch('ztpserver.topology.load')
+    @patch('ztpserver.controller.create_repository')
+    def test_application_metrics(self, m_repository, m_load):
+        ztpserver.app.config.runtime.set_value('enabled', True, 'metrics')
+        self.addCleanup(ztpserver.app.config.runtime.clear_value,
+                        'enabled', 'metrics')
+        obj = ztpserver.app.start_wsgiapp()
+        self.assertIsInstance(obj, ztpserver.metrics.MetricsMiddleware)
+        self.assertIsInstance(obj.app, ztpserver.controller.Router)
+
 if __name__ == '__main__':
     unittest.main()
@@ -32,8 +32,13 @@
 # pylint: disable=C0102,C0103,E1103,W0142,W0613,C0302,E1120
 #
 
+import hashlib
 import json
+import os
 import random
+import shutil
+import tempfile
+import threading
 import unittest
 
 from webob import Request
@@ -45,6 +50,7 @@ import ztpserver.config
 import ztpserver.repository
 
 from ztpserver.controller import DEFINITION_FN, PATTERN_FN
+from ztpserver.definitions import definition_cache
 
 from ztpserver.repository import FileObjectNotFound, FileObjectError
 
@@ -67,8 +73,10 @@ class RouterUnitTests(unittest.TestCase):
             for method in valid.split(','):
                 request.method = method
                 msg = 'method %s failed for url %s' % (method, url)
-                self.assertIsNotNone(router.map.match(environ=request.environ),
-                                     msg)
+                match = router.map.match(environ=request.environ)
+                self.assertIsNotNone(match, msg)
+                self.assertEqual(router.trie.match(request.environ)[0],
+                                 match, msg)
 
         if invalid:
             for method in invalid.split(','):
@@ -76,6 +84,11 @@ class RouterUnitTests(unittest.TestCase):
                 msg = 'method %s failed for url %s' % (method, url)
                 self.assertIsNone(router.map.match(environ=request.environ),
                                   msg)
+                self.assertIsNone(router.trie.match(request.environ), msg)
+
+    def test_all_routes_compiled(self):
+        router = ztpserver.controller.Router()
+        self.assertEqual(len(router.trie), len(router.map.matchlist))
 
     def test_bootstrap_collection(self):
         url = '/bootstrap'
@@ -155,11 +168,7 @@ class MetaControllerUnitTests(unittest.TestCase):
 
     @patch('ztpserver.controller.create_repository')
     def test_bad_request_io_error(self, m_repository):
-        cfg = random.choice([
-                {'return_value.get_file.return_value.hash.side_effect':
-                 IOError},
-                {'return_value.get_file.return_value.size.side_effect':
-                 IOError}])
+        cfg = {'return_value.digests.side_effect': IOError}
         m_repository.configure_mock(**cfg)
 
         controller = ztpserver.controller.MetaController()
@@ -174,12 +183,11 @@ class MetaControllerUnitTests(unittest.TestCase):
 
     @patch('ztpserver.controller.create_repository')
     def test_success(self, m_repository):
-        sha1 = random_string()
-        size = random.randint(1, 1000000)
-        cfg = {'return_value.get_file.return_value.hash.return_value':
-               sha1,
-               'return_value.get_file.return_value.size.return_value':
-               size}
+        body = {'sha1': random_string(),
+                'sha256': random_string(),
+                'md5': random_string(),
+                'size': random.randint(1, 1000000)}
+        cfg = {'return_value.digests.return_value': body}
         m_repository.configure_mock(**cfg)
 
         controller = ztpserver.controller.MetaController()
@@ -187,8 +195,28 @@ class MetaControllerUnitTests(unittest.TestCase):
                                    type=random.choice(['files', 'actions']),
                                    path_info=random_string())
 
-        self.assertEqual(resp['body'], {'sha1': sha1, 'size': size})
+        self.assertEqual(resp['body'], body)
         self.assertEqual(resp['content_type'], constants.CONTENT_TYPE_JSON)
+        self.assertFalse(m_repository.return_value.schedule_digests.called)
+
+    @patch('ztpserver.controller.create_repository')
+    def test_only_sha1_computed(self, m_repository):
+        body = {'sha1': random_string(),
+                'size': random.randint(1, 1000000)}
+        cfg = {'return_value.digests.return_value': body}
+        m_repository.configure_mock(**cfg)
+        filename = m_repository.return_value.get_file.return_value.name
+
+        controller = ztpserver.controller.MetaController()
+        resp = controller.metadata(None,
+                                   type=random.choice(['files', 'actions']),
+                                   path_info=random_string())
+
+        self.assertEqual(resp['body'], body)
+        m_repository.return_value.digests.assert_called_once_with(
+            filename, ('sha1',))
+        m_repository.return_value.schedule_digests.assert_called_once_with(
+            filename, ('sha256', 'md5'))
 
 
 class BootstrapConfigUnitTests(unittest.TestCase):
@@ -480,10 +508,14 @@ class FilesControllerIntegrationTests(unittest.TestCase):
 
 class ActionsControllerIntegrationTests(unittest.TestCase):
 
+    def tearDown(self):
+        remove_all()
+
     @patch('ztpserver.controller.create_repository')
     def test_get_action_success(self, m_repository):
         contents = random_string()
-        cfg = {'return_value.read.return_value': contents}
+        cfg = {'return_value.read.return_value': contents,
+               'return_value.name': write_file(contents)}
         m_repository.return_value.get_file.configure_mock(**cfg)
 
         filename = random_string()
@@ -511,6 +543,260 @@ class ActionsControllerIntegrationTests(unittest.TestCase):
         self.assertEqual(resp.status_code, constants.HTTP_STATUS_NOT_FOUND)
 
 
+class AppContextUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_root)
+        ztpserver.config.runtime.set_value('data_root', self.data_root,
+                                           'default')
+        self.addCleanup(ztpserver.config.runtime.clear_value, 'data_root',
+                        'default')
+
+        patcher = patch('ztpserver.controller.create_repository',
+                        wraps=ztpserver.repository.create_repository)
+        self.m_create_repository = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_controller_reused(self):
+        router = ztpserver.controller.Router()
+        for _ in range(3):
+            resp = Request.blank('/bootstrap/config').get_response(router)
+            self.assertEqual(resp.status_code, constants.HTTP_STATUS_OK)
+
+        context = router.context
+        controller = context.controller(
+            ztpserver.controller.BootstrapController)
+        self.assertEqual(context.controllers.values(), [controller])
+        self.assertTrue(controller.repository is context.repository)
+        self.assertEqual(controller.data_root, self.data_root)
+        self.m_create_repository.assert_called_once_with(self.data_root)
+
+    def test_data_root_changed(self):
+        context = ztpserver.controller.AppContext()
+        cls = ztpserver.controller.NodesController
+        controller = context.controller(cls)
+
+        data_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_root)
+        ztpserver.config.runtime.set_value('data_root', data_root, 'default')
+
+        new_controller = context.controller(cls)
+        self.assertFalse(new_controller is controller)
+        self.assertEqual(new_controller.data_root, data_root)
+        self.assertEqual(context.repository.path, data_root)
+
+    def test_missing_data_root(self):
+        ztpserver.config.runtime.set_value('data_root', '/does/not/exist',
+                                           'default')
+        context = ztpserver.controller.AppContext()
+        cls = ztpserver.controller.NodesController
+        self.assertRaises(ztpserver.repository.RepositoryError,
+                          context.controller, cls)
+        self.assertEqual(context.controllers, {})
+
+        ztpserver.config.runtime.set_value('data_root', self.data_root,
+                                           'default')
+        self.assertEqual(context.controller(cls).data_root, self.data_root)
+
+    def test_concurrent(self):
+        context = ztpserver.controller.AppContext()
+        cls = ztpserver.controller.FilesController
+        start = threading.Event()
+        controllers = []
+
+        def get_controller():
+            start.wait()
+            controllers.append(context.controller(cls))
+
+        threads = [threading.Thread(target=get_controller)
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(controllers), 10)
+        self.assertEqual(len(set(id(x) for x in controllers)), 1)
+        self.assertEqual(self.m_create_repository.call_count, 1)
+
+
+class FileResponseIntegrationTests(unittest.TestCase):
+    ''' Validators, conditional and ranged GETs for /files, /actions and
+    /nodes/{id}/startup-config
+    '''
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_root)
+        ztpserver.config.runtime.set_value('data_root', self.data_root,
+                                           'default')
+        self.addCleanup(ztpserver.config.runtime.clear_value, 'data_root',
+                        'default')
+
+        # other tests replace create_repository without restoring it
+        patcher = patch('ztpserver.controller.create_repository',
+                        ztpserver.repository.create_repository)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.contents = random_string() * 100
+        self.urls = []
+        for (url, path) in [('/files/images/EOS.swi',
+                             'files/images/EOS.swi'),
+                            ('/actions/install_image',
+                             'actions/install_image'),
+                            ('/nodes/node1/startup-config',
+                             'nodes/node1/startup-config')]:
+            self.write(path, self.contents)
+            self.urls.append(url)
+        self.index = ztpserver.repository.digest_index(self.data_root)
+        # wait for the background hashing before removing data_root
+        self.addCleanup(self.index.queue.join)
+
+    def write(self, path, contents):
+        filename = os.path.join(self.data_root, path)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as fhandler:
+            fhandler.write(contents)
+
+    def index_files(self):
+        for url in self.urls:
+            self.index.digests(os.path.join(self.data_root, url[1:]))
+
+    @classmethod
+    def get(cls, url, **headers):
+        request = Request.blank(url, headers=headers)
+        return request.get_response(ztpserver.controller.Router())
+
+    def test_validators(self):
+        self.index_files()
+        etag = hashlib.sha1(self.contents).hexdigest()
+        for url in self.urls:
+            resp = self.get(url)
+            self.assertEqual(resp.status_code, constants.HTTP_STATUS_OK)
+            self.assertEqual(resp.body, self.contents)
+            self.assertEqual(resp.headers['ETag'], '"%s"' % etag)
+            self.assertTrue(resp.last_modified)
+            self.assertEqual(resp.accept_ranges, 'bytes')
+
+    def test_if_none_match(self):
+        self.index_files()
+        etag = hashlib.sha1(self.contents).hexdigest()
+        for url in self.urls:
+            resp = self.get(url, **{'If-None-Match': '"%s"' % etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.body, '')
+
+            resp = self.get(url, **{'If-None-Match': '"%s"' %
+                                    random_string()})
+            self.assertEqual(resp.status_code, constants.HTTP_STATUS_OK)
+            self.assertEqual(resp.body, self.contents)
+
+    def test_if_modified_since(self):
+        for url in self.urls:
+            last_modified = self.get(url).headers['Last-Modified']
+            resp = self.get(url, **{'If-Modified-Since': last_modified})
+            self.assertEqual(resp.status_code, 304)
+
+            resp = self.get(url, **{'If-Modified-Since':
+                                    'Thu, 01 Jan 2015 00:00:00 GMT'})
+            self.assertEqual(resp.status_code, constants.HTTP_STATUS_OK)
+
+    def test_range(self):
+        for url in self.urls:
+            resp = self.get(url, Range='bytes=10-19')
+            self.assertEqual(resp.status_code, 206)
+            self.assertEqual(resp.body, self.contents[10:20])
+            self.assertEqual(resp.headers['Content-Range'],
+                             'bytes 10-19/%d' % len(self.contents))
+
+            resp = self.get(url, Range='bytes=%d-' % len(self.contents))
+            self.assertEqual(resp.status_code, 416)
+
+    def test_if_range(self):
+        self.index_files()
+        etag = hashlib.sha1(self.contents).hexdigest()
+        for url in self.urls:
+            resp = self.get(url, Range='bytes=10-', **{'If-Range':
+                                                       '"%s"' % etag})
+            self.assertEqual(resp.status_code, 206)
+            self.assertEqual(resp.body, self.contents[10:])
+
+            # the file changed - the full file is returned
+            resp = self.get(url, Range='bytes=10-', **{'If-Range':
+                                                       '"%s"' %
+                                                       random_string()})
+            self.assertEqual(resp.status_code, constants.HTTP_STATUS_OK)
+            self.assertEqual(resp.body, self.contents)
+
+    def test_modified_file(self):
+        self.index_files()
+        for url in self.urls:
+            etag = self.get(url).headers['ETag']
+
+        contents = random_string()
+        for url in self.urls:
+            self.write(url[1:], contents)
+            resp = self.get(url, **{'If-None-Match': etag})
+            self.assertEqual(resp.status_code, constants.HTTP_STATUS_OK)
+            self.assertEqual(resp.body, contents)
+
+        self.index.queue.join()
+        for url in self.urls:
+            self.assertEqual(self.get(url).headers['ETag'], '"%s"' %
+                             hashlib.sha1(contents).hexdigest())
+
+    @patch('ztpserver.repository.file_digests',
+           wraps=ztpserver.repository.file_digests)
+    def test_not_indexed(self, m_digests):
+        with patch.object(self.index, 'schedule') as m_schedule:
+            for url in self.urls:
+                resp = self.get(url)
+                self.assertEqual(resp.status_code, constants.HTTP_STATUS_OK)
+                self.assertEqual(resp.body, self.contents)
+                self.assertNotIn('ETag', resp.headers)
+                self.assertTrue(resp.last_modified)
+
+        # the files are hashed in the background, not by the requests
+        self.assertFalse(m_digests.called)
+        self.assertEqual(m_schedule.call_count, len(self.urls))
+
+        for (args, _) in m_schedule.call_args_list:
+            self.index.schedule(*args)
+        self.index.queue.join()
+        etag = hashlib.sha1(self.contents).hexdigest()
+        for url in self.urls:
+            self.assertEqual(self.get(url).headers['ETag'], '"%s"' % etag)
+
+    def test_digests_failure_closes_file(self):
+        controller = ztpserver.controller.FilesController()
+        fobj = controller.repository.get_file('files/images/EOS.swi')
+        handlers = []
+        def tracked_open(*args):
+            handlers.append(open(*args))
+            return handlers[-1]
+
+        with patch('ztpserver.controller.open', create=True,
+                   side_effect=tracked_open):
+            with patch.object(controller.repository, 'cached_digests',
+                              side_effect=ValueError):
+                self.assertRaises(ValueError, controller.file_response,
+                                  Request.blank('/files/images/EOS.swi'),
+                                  fobj, constants.CONTENT_TYPE_OTHER)
+        self.assertEqual(len(handlers), 1)
+        self.assertTrue(handlers[0].closed)
+
+    def test_digests_os_error(self):
+        with patch.object(ztpserver.repository.Repository, 'cached_digests',
+                          side_effect=OSError):
+            resp = self.get(self.urls[0])
+        self.assertEqual(resp.status_code, constants.HTTP_STATUS_OK)
+        self.assertEqual(resp.body, self.contents)
+        self.assertNotIn('ETag', resp.headers)
+
 class NodesControllerUnitTests(unittest.TestCase):
 
 
@@ -1047,14 +1333,14 @@ class NodesControllerUnitTests(unittest.TestCase):
         self.assertEqual(state, 'do_resources')
         self.assertIsInstance(resp, dict)
 
-    def test_do_resources_success(self):
+    @patch('ztpserver.topology.run_plugin')
+    def test_do_resources_success(self, m_run_plugin):
         var_foo = random_string()
-        ztpserver.controller.load_resources = \
-            Mock(return_value=dict(foo=var_foo))
+        m_run_plugin.return_value = var_foo
 
         definition = create_definition()
         definition.add_action(name='dummy action',
-                              attributes=dict(foo=random_string()))
+                              attributes=dict(foo="allocate('pool')"))
 
         response = dict(definition=definition.as_dict())
 
@@ -1067,6 +1353,46 @@ class NodesControllerUnitTests(unittest.TestCase):
         foo = resp['definition']['actions'][0]['attributes']['foo']
         self.assertEqual(foo, var_foo)
 
+    def test_do_substitution_nested(self):
+        definition = create_definition()
+        definition.add_attribute('foo', 'bar')
+        definition.add_action(name='dummy action',
+                              attributes={'variables': {'a': {'b': '$foo'}},
+                                          'list': ['$foo', {'c': '$foo'}],
+                                          'other': 'foo'})
+        response = dict(definition=definition.as_dict())
+
+        controller = ztpserver.controller.NodesController()
+        (resp, _) = controller.do_substitution(response,
+                                               resource=random_string())
+
+        attributes = resp['definition']['actions'][0]['attributes']
+        self.assertEqual(attributes,
+                         {'variables': {'a': {'b': 'bar'}},
+                          'list': ['bar', {'c': 'bar'}],
+                          'other': 'foo'})
+
+    @patch('ztpserver.topology.run_plugin')
+    def test_do_resources_list(self, m_run_plugin):
+        m_run_plugin.side_effect = lambda plugin, node_id, pool, node: \
+            '%s:%s' % (plugin, pool)
+
+        definition = create_definition()
+        definition.add_action(name='dummy action',
+                              attributes={'list': ["allocate('a')", 'b',
+                                                   {'c': "test('c')"}]})
+        response = dict(definition=definition.as_dict())
+
+        node = Mock()
+        controller = ztpserver.controller.NodesController()
+        (resp, _) = controller.do_resources(response, node=node,
+                                            resource='node1')
+
+        attributes = resp['definition']['actions'][0]['attributes']
+        self.assertEqual(attributes,
+                         {'list': ['allocate:a', 'b', {'c': 'test:c'}]})
+        m_run_plugin.assert_any_call('allocate', 'node1', 'a', node)
+
     @patch('os.path.isfile')
     def test_put_config_success(self, m_is_file):
         m_is_file.return_value = False
@@ -1496,6 +1822,147 @@ class DefinitionStartupConfigTests(unittest.TestCase):
                                    action_name_2])
 
 
+class DefinitionCacheIntegrationTests(unittest.TestCase):
+    ''' GET /nodes/{id} served from the definition cache '''
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_root)
+        ztpserver.config.runtime.set_value('data_root', self.data_root,
+                                           'default')
+        self.addCleanup(ztpserver.config.runtime.clear_value, 'data_root',
+                        'default')
+        ztpserver.config.runtime.set_value('disable_topology_validation',
+                                           True, 'default')
+        self.addCleanup(ztpserver.config.runtime.clear_value,
+                        'disable_topology_validation', 'default')
+
+        # other tests replace create_repository without restoring it
+        patcher = patch('ztpserver.controller.create_repository',
+                        ztpserver.repository.create_repository)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        definition_cache.clear()
+        self.addCleanup(definition_cache.clear)
+
+        self.node = create_node()
+        self.node_id = self.node.serialnumber
+        self.write(os.path.join('nodes', self.node_id, '.node'),
+                   json.dumps(self.node.as_dict()))
+        self.write_definition('$value')
+        self.write(os.path.join('nodes', self.node_id, 'attributes'),
+                   'value: foo\n')
+
+        self.router = ztpserver.controller.Router()
+        self.fsm = patch.object(ztpserver.controller.NodesController, 'fsm',
+                                autospec=True,
+                                side_effect=ztpserver.controller.
+                                NodesController.fsm)
+        self.m_fsm = self.fsm.start()
+        self.addCleanup(self.fsm.stop)
+
+    def write(self, path, contents):
+        filename = os.path.join(self.data_root, path)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as fhandler:
+            fhandler.write(contents)
+        # make sure the signature of the file changes
+        stat = os.stat(filename)
+        os.utime(filename, (stat.st_atime, stat.st_mtime + random.random()))
+
+    def write_definition(self, value):
+        self.write(os.path.join('nodes', self.node_id, 'definition'),
+                   'name: test\n'
+                   'actions:\n'
+                   '  - name: test\n'
+                   '    action: test\n'
+                   '    attributes:\n'
+                   '      value: %s\n' % value)
+
+    def write_plugin(self, name, idempotent, pool=None):
+        contents = ['IDEMPOTENT = %s' % idempotent]
+        if pool:
+            contents += ['def dependencies(node_id, pool):',
+                         '    return [%r]' % pool]
+        contents += ['def main(node_id, pool, node):',
+                     '    return open(%r).read()' % pool if pool else
+                     '    return pool']
+        self.write(os.path.join('plugins', name), '\n'.join(contents))
+
+    def get(self):
+        response = Request.blank('/nodes/%s' % self.node_id). \
+            get_response(self.router)
+        self.assertEqual(response.status_code, constants.HTTP_STATUS_OK)
+        self.assertEqual(response.content_type, constants.CONTENT_TYPE_JSON)
+        return json.loads(response.body)['actions'][-1]['attributes'] \
+            .get('value')
+
+    def test_cache_hit(self):
+        self.assertEqual(self.get(), 'foo')
+        self.assertEqual(self.get(), 'foo')
+        self.assertEqual(self.m_fsm.call_count, 1)
+        self.assertEqual(definition_cache.stats()['hits'], 1)
+
+    def test_node_file_changed(self):
+        self.assertEqual(self.get(), 'foo')
+
+        self.write(os.path.join('nodes', self.node_id, 'attributes'),
+                   'value: bar\n')
+        self.assertEqual(self.get(), 'bar')
+
+        self.write_definition('baz')
+        self.assertEqual(self.get(), 'baz')
+
+        self.write(os.path.join('nodes', self.node_id, 'startup-config'),
+                   random_string())
+        self.assertEqual(self.get(), None)
+        self.assertEqual(self.m_fsm.call_count, 4)
+
+    def test_idempotent_plugin(self):
+        pool = os.path.join(self.data_root, 'resources', 'pool')
+        self.write(pool, 'one')
+        self.write_plugin('idempotent', True, pool)
+        self.write_definition("idempotent('pool')")
+
+        self.assertEqual(self.get(), 'one')
+        self.assertEqual(self.get(), 'one')
+        self.assertEqual(self.m_fsm.call_count, 1)
+
+        self.write(pool, 'two')
+        self.assertEqual(self.get(), 'two')
+        self.assertEqual(self.m_fsm.call_count, 2)
+
+    def test_plugin_not_idempotent(self):
+        self.write_plugin('volatile', False)
+        self.write_definition("volatile('pool')")
+
+        self.assertEqual(self.get(), 'pool')
+        self.assertEqual(self.get(), 'pool')
+        self.assertEqual(self.m_fsm.call_count, 2)
+        self.assertEqual(definition_cache.stats()['entries'], 0)
+
+    def test_cache_disabled(self):
+        ztpserver.config.runtime.set_value('definition_cache_size', 0,
+                                           'default')
+        self.addCleanup(ztpserver.config.runtime.clear_value,
+                        'definition_cache_size', 'default')
+        self.get()
+        self.get()
+        self.assertEqual(self.m_fsm.call_count, 2)
+
+    def test_error_not_cached(self):
+        os.remove(os.path.join(self.data_root, 'nodes', self.node_id,
+                               'definition'))
+        for _ in range(2):
+            response = Request.blank('/nodes/%s' % self.node_id). \
+                get_response(self.router)
+            self.assertEqual(response.status_code,
+                             constants.HTTP_STATUS_BAD_REQUEST)
+        self.assertEqual(definition_cache.stats()['entries'], 0)
+
+
 if __name__ == '__main__':
     enable_logging()
     unittest.main()
@@ -0,0 +1,136 @@
+#
+# Copyright (c) 2018, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+# pylint: disable=C0102,C0103,E1103,W0142,W0613,C0302,E1120
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ztpserver import definitions
+from ztpserver.config import runtime
+
+
+class DefinitionCacheUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.cache = definitions.DefinitionCache()
+
+    def write(self, name, contents):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, 'w') as fhandler:
+            fhandler.write(contents)
+        return filename
+
+    def dependencies(self, *filenames):
+        dependencies = definitions.Dependencies()
+        for filename in filenames:
+            dependencies.add(filename)
+        return dependencies
+
+    def test_get_put(self):
+        filename = self.write('definition', 'foo')
+        self.cache.put('node', self.dependencies(filename), 'response')
+        self.assertEqual(self.cache.get('node'), 'response')
+        self.assertIsNone(self.cache.get('other'))
+        self.assertEqual(self.cache.stats(),
+                         dict(entries=1, hits=1, misses=1, evictions=0))
+
+    def test_dependency_changed(self):
+        filename = self.write('definition', 'foo')
+        self.cache.put('node', self.dependencies(filename), 'response')
+        self.write('definition', 'foobar')
+        self.assertIsNone(self.cache.get('node'))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_missing_dependency_created(self):
+        filename = os.path.join(self.tmpdir, 'startup-config')
+        self.cache.put('node', self.dependencies(filename), 'response')
+        self.assertEqual(self.cache.get('node'), 'response')
+        self.write('startup-config', 'foo')
+        self.assertIsNone(self.cache.get('node'))
+
+    def test_uncacheable(self):
+        dependencies = self.dependencies()
+        dependencies.uncacheable('plugin foo is not idempotent')
+        dependencies.uncacheable('plugin bar is not idempotent')
+        self.assertEqual(dependencies.reason,
+                         'plugin foo is not idempotent')
+        self.cache.put('node', dependencies, 'response')
+        self.assertIsNone(self.cache.get('node'))
+
+    def test_evict_lru(self):
+        runtime.set_value('definition_cache_size', 2, 'default')
+        self.addCleanup(runtime.clear_value, 'definition_cache_size',
+                        'default')
+        for key in ['node1', 'node2']:
+            self.cache.put(key, self.dependencies(), key)
+        self.cache.get('node1')
+        self.cache.put('node3', self.dependencies(), 'node3')
+
+        self.assertIsNone(self.cache.get('node2'))
+        self.assertEqual(self.cache.get('node1'), 'node1')
+        self.assertEqual(self.cache.get('node3'), 'node3')
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_disabled_at_runtime(self):
+        self.cache.put('node', self.dependencies(), 'response')
+        runtime.set_value('definition_cache_size', 0, 'default')
+        self.addCleanup(runtime.clear_value, 'definition_cache_size',
+                        'default')
+        self.assertIsNone(self.cache.get('node'))
+        self.assertEqual(self.cache.stats(),
+                         dict(entries=0, hits=0, misses=1, evictions=0))
+
+    def test_record_dependencies(self):
+        filename = self.write('pool', 'foo')
+        definitions.add_dependency(filename)
+
+        dependencies = definitions.definition_cache.start()
+        try:
+            definitions.add_dependency(filename)
+            definitions.uncacheable('reason')
+        finally:
+            definitions.definition_cache.stop()
+        definitions.uncacheable('other')
+
+        self.assertEqual(list(dependencies.files), [filename])
+        self.assertEqual(dependencies.reason, 'reason')
+        self.assertIsNone(definitions.definition_cache.current())
+
+
+if __name__ == '__main__':
+    unittest.main()
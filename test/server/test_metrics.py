@@ -0,0 +1,365 @@
+#
+# Copyright (c) 2018, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+# pylint: disable=C0102,C0103,E1103,W0142,W0613,C0302,E1120
+#
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from wsgiref.util import FileWrapper
+
+from mock import Mock, patch
+from webob import Request, Response
+
+import ztpserver.controller
+import ztpserver.repository
+
+from ztpserver import metrics
+from ztpserver.config import runtime
+
+from server_test_lib import random_string
+
+
+def route_app(routepath, status='200 OK', body='hello'):
+    ''' Returns a WSGI app which matches routepath '''
+    def app(environ, start_response):
+        if routepath is not None:
+            environ['routes.route'] = Mock(routepath=routepath)
+        start_response(status, [('Content-Type', 'text/plain')])
+        return [body]
+    return app
+
+def parse(text):
+    ''' Returns the samples of a Prometheus text exposition '''
+    samples = dict()
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            (name, value) = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_root)
+        runtime.set_value('data_root', self.data_root, 'default')
+        self.addCleanup(runtime.clear_value, 'data_root', 'default')
+
+        self.metrics = metrics.Metrics()
+        self.addCleanup(self.metrics.stop)
+
+    def get(self, app, url, method='GET'):
+        ''' Runs the request through app, like a WSGI server would '''
+        request = Request.blank(url, method=method)
+        (status, headers, app_iter) = request.call_application(app)
+        try:
+            body = ''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        return Response(body=body, status=status, headerlist=headers)
+
+    def scrape(self, app):
+        response = self.get(app, '/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, 'text/plain')
+        return parse(response.body)
+
+
+class MetricsMiddlewareUnitTests(MetricsTestCase):
+
+    def test_requests_by_route(self):
+        app = metrics.MetricsMiddleware(route_app('/nodes/{resource}'),
+                                        self.metrics)
+        for _ in range(3):
+            self.get(app, '/nodes/%s' % random_string())
+
+        samples = self.scrape(app)
+        labels = '{route="/nodes/{resource}",method="GET"'
+        self.assertEqual(samples['ztpserver_requests_total%s,'
+                                 'status="200"}' % labels], 3)
+        self.assertEqual(samples['ztpserver_response_bytes_total%s}' %
+                                 labels], 15)
+        self.assertEqual(samples['ztpserver_request_duration_seconds_count'
+                                 '%s}' % labels], 3)
+        self.assertEqual(samples['ztpserver_request_duration_seconds_bucket'
+                                 '%s,le="+Inf"}' % labels], 3)
+        self.assertEqual(samples['ztpserver_requests_in_flight'], 0)
+        self.assertFalse([x for x in samples if 'node_id' in x])
+
+    def test_unmatched_route(self):
+        app = metrics.MetricsMiddleware(route_app(None, '404 Not Found'),
+                                        self.metrics)
+        self.get(app, '/%s' % random_string())
+
+        samples = self.scrape(app)
+        self.assertEqual(samples['ztpserver_requests_total{route="unmatched",'
+                                 'method="GET",status="404"}'], 1)
+
+    def test_application_error(self):
+        def app(environ, start_response):
+            raise ValueError('boom')
+        app = metrics.MetricsMiddleware(app, self.metrics)
+        self.assertRaises(ValueError, self.get, app, '/bootstrap')
+
+        samples = self.scrape(app)
+        self.assertEqual(samples['ztpserver_requests_total{route="unmatched",'
+                                 'method="GET",status="500"}'], 1)
+        self.assertEqual(samples['ztpserver_requests_in_flight'], 0)
+
+    def test_in_flight(self):
+        app = metrics.MetricsMiddleware(route_app('/bootstrap'),
+                                        self.metrics)
+        environ = Request.blank('/bootstrap').environ
+        app_iter = app(environ, Mock())
+        self.assertEqual(parse(self.metrics.render())
+                         ['ztpserver_requests_in_flight'], 1)
+
+        list(app_iter)
+        app_iter.close()
+        self.assertEqual(parse(self.metrics.render())
+                         ['ztpserver_requests_in_flight'], 0)
+
+    def test_file_wrapper(self):
+        def app(environ, start_response):
+            environ['routes.route'] = Mock(routepath='/files/{resource:.*}')
+            start_response('200 OK', [('Content-Length', '1024')])
+            return environ['wsgi.file_wrapper'](Mock())
+
+        app = metrics.MetricsMiddleware(app, self.metrics)
+        environ = Request.blank('/files/EOS.swi').environ
+        environ['wsgi.file_wrapper'] = FileWrapper
+
+        # the server must still be able to send the file with sendfile(2)
+        self.assertIsInstance(app(environ, Mock()), FileWrapper)
+        samples = parse(self.metrics.render())
+        self.assertEqual(samples['ztpserver_response_bytes_total'
+                                 '{route="/files/{resource:.*}",'
+                                 'method="GET"}'], 1024)
+
+    def test_histogram_buckets(self):
+        store = self.metrics.store
+        labels = (('route', '/bootstrap'), ('method', 'GET'))
+        for duration in [0.001, 0.005, 0.2, 20]:
+            store.request_done('/bootstrap', 'GET', '200', duration, 0)
+        samples = parse(metrics.render(store.values, store.histograms))
+
+        name = 'ztpserver_request_duration_seconds'
+        labels = metrics.format_labels(labels)[:-1]
+        self.assertEqual(samples['%s_bucket%s,le="0.005"}' %
+                                 (name, labels)], 2)
+        self.assertEqual(samples['%s_bucket%s,le="0.25"}' %
+                                 (name, labels)], 3)
+        self.assertEqual(samples['%s_bucket%s,le="10.0"}' %
+                                 (name, labels)], 3)
+        self.assertEqual(samples['%s_bucket%s,le="+Inf"}' %
+                                 (name, labels)], 4)
+        self.assertAlmostEqual(samples['%s_sum%s}' % (name, labels)],
+                               20.206)
+
+    def test_cache_gauges(self):
+        stats = dict(hits=3, misses=1, entries=2)
+        with patch('ztpserver.metrics.file_cache') as m_file_cache:
+            m_file_cache.stats.return_value = stats
+            samples = parse(self.metrics.render())
+
+        self.assertEqual(samples['ztpserver_cache_hits_total'
+                                 '{cache="file"}'], 3)
+        self.assertEqual(samples['ztpserver_cache_hit_ratio'
+                                 '{cache="file"}'], 0.75)
+        self.assertEqual(samples['ztpserver_cache_entries{cache="file"}'], 2)
+        self.assertIn('ztpserver_cache_hits_total{cache="neighbordb"}',
+                      samples)
+        self.assertIn('ztpserver_cache_hits_total{cache="digest"}', samples)
+
+    def test_plugin_loads(self):
+        stats = dict(allocate=dict(loads=2, load_time=0.25))
+        with patch('ztpserver.metrics.plugin_registry') as m_registry:
+            m_registry.stats.return_value = stats
+            samples = parse(self.metrics.render())
+
+        self.assertEqual(samples['ztpserver_plugin_loads_total'
+                                 '{plugin="allocate"}'], 2)
+        self.assertEqual(samples['ztpserver_plugin_load_seconds'
+                                 '{plugin="allocate"}'], 0.25)
+
+    def test_digest_queue_depth(self):
+        warmup = Mock()
+        warmup.status.return_value = dict(pending=42)
+        with patch('ztpserver.warmup.warmup', warmup):
+            samples = parse(self.metrics.render())
+        self.assertEqual(samples['ztpserver_digest_queue_depth'], 42)
+
+    def test_threads(self):
+        app = metrics.MetricsMiddleware(route_app('/bootstrap'),
+                                        self.metrics)
+
+        def run():
+            for _ in range(100):
+                app_iter = app(Request.blank('/bootstrap').environ, Mock())
+                list(app_iter)
+                app_iter.close()
+
+        threads = [threading.Thread(target=run) for _ in range(30)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        samples = parse(self.metrics.render())
+        self.assertEqual(samples['ztpserver_requests_total{route="/bootstrap",'
+                                 'method="GET",status="200"}'], 3000)
+        self.assertEqual(samples['ztpserver_response_bytes_total'
+                                 '{route="/bootstrap",method="GET"}'], 15000)
+
+
+class MetricsDirectoryTests(MetricsTestCase):
+
+    def setUp(self):
+        super(MetricsDirectoryTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        runtime.set_value('directory', self.directory, 'metrics')
+        self.addCleanup(runtime.clear_value, 'directory', 'metrics')
+
+    def run_process(self, requests, in_flight=0):
+        ''' Records requests in another server process, which exits '''
+        script = '''if True:
+            from ztpserver.config import runtime
+            from ztpserver.metrics import metrics
+            runtime.set_value('directory', %r, 'metrics')
+            runtime.set_value('data_root', %r, 'default')
+            for _ in range(%d):
+                metrics.store.request_started()
+                metrics.store.request_done('/bootstrap', 'GET', '200',
+                                           0.01, 10)
+            for _ in range(%d):
+                metrics.store.request_started()
+            metrics.write()
+        ''' % (self.directory, self.data_root, requests, in_flight)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        subprocess.check_call([sys.executable, '-c', script], env=env)
+
+    def test_aggregate_processes(self):
+        self.run_process(3)
+        self.run_process(4, in_flight=2)
+
+        app = metrics.MetricsMiddleware(route_app('/bootstrap'),
+                                        self.metrics)
+        self.get(app, '/bootstrap')
+
+        samples = self.scrape(app)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+        self.assertEqual(samples['ztpserver_requests_total{route="/bootstrap",'
+                                 'method="GET",status="200"}'], 8)
+        self.assertEqual(samples['ztpserver_request_duration_seconds_count'
+                                 '{route="/bootstrap",method="GET"}'], 8)
+        # the in-flight requests of exited processes are not reported
+        self.assertEqual(samples['ztpserver_requests_in_flight'], 0)
+
+    def test_background_write(self):
+        app = metrics.MetricsMiddleware(route_app('/bootstrap'),
+                                        self.metrics)
+        self.get(app, '/bootstrap')
+        self.metrics.stop()
+
+        filename = os.path.join(self.directory, 'metrics-%d.json' %
+                                os.getpid())
+        with open(filename) as fhandler:
+            snapshot = json.load(fhandler)
+        self.assertEqual(snapshot['pid'], os.getpid())
+        self.assertIn(['ztpserver_requests_total',
+                       [['route', '/bootstrap'], ['method', 'GET'],
+                        ['status', '200']], 1], snapshot['values'])
+
+    def test_clear_directory(self):
+        self.run_process(1)
+        self.metrics.clear_directory()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_write_failure(self):
+        shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+        runtime.set_value('directory', os.path.join(self.directory, 'x'),
+                          'metrics')
+        with patch('ztpserver.metrics.log') as m_log:
+            self.metrics.write()
+            self.assertTrue(m_log.warning.called)
+
+
+class RouterMetricsIntegrationTests(MetricsTestCase):
+
+    def setUp(self):
+        super(RouterMetricsIntegrationTests, self).setUp()
+
+        # other tests replace create_repository without restoring it
+        patcher = patch('ztpserver.controller.create_repository',
+                        ztpserver.repository.create_repository)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        os.makedirs(os.path.join(self.data_root, 'files'))
+        self.contents = random_string()
+        with open(os.path.join(self.data_root, 'files', 'EOS.swi'),
+                  'w') as fhandler:
+            fhandler.write(self.contents)
+
+    def test_route_templates(self):
+        app = metrics.MetricsMiddleware(ztpserver.controller.Router(),
+                                        self.metrics)
+
+        response = self.get(app, '/files/EOS.swi')
+        self.assertEqual(response.body, self.contents)
+        response = self.get(app, '/nodes/%s' % random_string())
+        self.assertEqual(response.status_code, 400)
+
+        samples = self.scrape(app)
+        self.assertEqual(samples['ztpserver_response_bytes_total'
+                                 '{route="/files/{resource:.*}{.format}",'
+                                 'method="GET"}'], len(self.contents))
+        self.assertEqual(samples['ztpserver_requests_total'
+                                 '{route="/nodes/{resource}{.format}",'
+                                 'method="GET",status="400"}'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -32,15 +32,28 @@
 # vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
 # pylint: disable=R0904,C0103
 #
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
 from mock import patch
 
+import ztpserver.serializers
+
+from ztpserver.config import runtime
+from ztpserver.constants import CONTENT_TYPE_YAML
 from ztpserver.serializers import SerializerError
 
 from ztpserver.repository import FileObject, FileObjectError
 from ztpserver.repository import Repository, RepositoryError
 from ztpserver.repository import FileObjectNotFound
+from ztpserver.repository import file_cache, file_digests
+from ztpserver.repository import DigestIndex, DIGEST_INDEX_FN
 
 from server_test_lib import enable_logging, random_string
 
@@ -73,6 +86,281 @@ class FileObjectUnitTests(unittest.TestCase):
         self.assertRaises(FileObjectError, obj.write, random_string())
 
 
+class FileCacheUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        file_cache.clear()
+        self.addCleanup(file_cache.clear)
+
+    def write(self, name, contents):
+        filename = os.path.join(self.path, name)
+        with open(filename, 'w') as fhandler:
+            fhandler.write(contents)
+        return FileObject(filename)
+
+    @patch('ztpserver.serializers.load', wraps=ztpserver.serializers.load)
+    def test_read_cached(self, m_load):
+        obj = self.write('file', 'key: value\n')
+        self.assertEqual(obj.read(CONTENT_TYPE_YAML), {'key': 'value'})
+        self.assertEqual(obj.read(CONTENT_TYPE_YAML), {'key': 'value'})
+        self.assertEqual(m_load.call_count, 1)
+
+        # a different content_type is read again
+        self.assertEqual(obj.read(), 'key: value\n')
+        self.assertEqual(m_load.call_count, 2)
+
+    def test_read_modified(self):
+        obj = self.write('file', 'key: value\n')
+        self.assertEqual(obj.read(CONTENT_TYPE_YAML), {'key': 'value'})
+
+        self.write('file', 'key: other value\n')
+        self.assertEqual(obj.read(CONTENT_TYPE_YAML), {'key': 'other value'})
+
+    def test_read_copy(self):
+        obj = self.write('file', 'key: [1, {a: 2}]\n')
+        contents = obj.read(CONTENT_TYPE_YAML)
+        contents['key'][1]['a'] = 3
+        contents['key'].append(4)
+        contents['new'] = 5
+
+        self.assertEqual(obj.read(CONTENT_TYPE_YAML), {'key': [1, {'a': 2}]})
+        self.assertFalse(obj.read(CONTENT_TYPE_YAML) is
+                         obj.read(CONTENT_TYPE_YAML))
+
+    def test_write_invalidates(self):
+        obj = self.write('file', 'key: value\n')
+        self.assertEqual(obj.read(CONTENT_TYPE_YAML), {'key': 'value'})
+        obj.write({'key': 'other'}, CONTENT_TYPE_YAML)
+        self.assertEqual(obj.read(CONTENT_TYPE_YAML), {'key': 'other'})
+
+    def test_size_limit(self):
+        runtime.set_value('file_cache_size', 20, 'default')
+        self.addCleanup(runtime.clear_value, 'file_cache_size',
+                        'default')
+
+        first = self.write('first', 'a' * 8)
+        second = self.write('second', 'b' * 8)
+        third = self.write('third', 'c' * 8)
+        large = self.write('large', 'd' * 21)
+
+        first.read()
+        second.read()
+        first.read()
+        third.read()
+        large.read()
+
+        stats = file_cache.stats()
+        self.assertEqual(stats['size'], 16)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(list(file_cache.entries),
+                         [first.name, third.name])
+
+    @patch('ztpserver.serializers.load', wraps=ztpserver.serializers.load)
+    def test_disabled(self, m_load):
+        runtime.set_value('file_cache_size', 0, 'default')
+        self.addCleanup(runtime.clear_value, 'file_cache_size',
+                        'default')
+
+        obj = self.write('file', 'key: value\n')
+        obj.read(CONTENT_TYPE_YAML)
+        obj.read(CONTENT_TYPE_YAML)
+        self.assertEqual(m_load.call_count, 2)
+        self.assertEqual(file_cache.stats()['entries'], 0)
+
+
+class DigestIndexUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def write(self, name, contents):
+        filename = os.path.join(self.path, name)
+        with open(filename, 'w') as fhandler:
+            fhandler.write(contents)
+        return filename
+
+    def test_file_digests(self):
+        contents = random_string() * 1000
+        filename = self.write('file', contents)
+        self.assertEqual(file_digests(filename),
+                         {'sha1': hashlib.sha1(contents).hexdigest(),
+                          'sha256': hashlib.sha256(contents).hexdigest(),
+                          'md5': hashlib.md5(contents).hexdigest()})
+
+    @patch('ztpserver.repository.file_digests', wraps=file_digests)
+    def test_digests_indexed(self, m_digests):
+        contents = random_string()
+        filename = self.write('file', contents)
+
+        result = DigestIndex(self.path).digests(filename)
+        self.assertEqual(result['size'], len(contents))
+        self.assertEqual(result['sha1'], hashlib.sha1(contents).hexdigest())
+        self.assertEqual(m_digests.call_count, 1)
+
+        # served from the persisted index by a new instance
+        self.assertTrue(os.path.exists(os.path.join(self.path,
+                                                    DIGEST_INDEX_FN)))
+        self.assertEqual(DigestIndex(self.path).digests(filename), result)
+        self.assertEqual(m_digests.call_count, 1)
+
+    def test_digests_modified(self):
+        index = DigestIndex(self.path)
+        filename = self.write('file', 'a' * 10)
+        index.digests(filename)
+
+        self.write('file', 'b' * 20)
+        result = index.digests(filename)
+        self.assertEqual(result['size'], 20)
+        self.assertEqual(result['md5'], hashlib.md5('b' * 20).hexdigest())
+        self.assertEqual(index.stats()['misses'], 2)
+
+    @patch('ztpserver.repository.file_digests', wraps=file_digests)
+    def test_digests_algorithms(self, m_digests):
+        contents = random_string()
+        filename = self.write('file', contents)
+        index = DigestIndex(self.path)
+
+        result = index.digests(filename, ('sha1',))
+        self.assertEqual(result, {'sha1': hashlib.sha1(contents).hexdigest(),
+                                  'size': len(contents)})
+        m_digests.assert_called_once_with(filename, ['sha1'])
+
+        # only the missing digests are computed
+        result = index.digests(filename)
+        m_digests.assert_called_with(filename, ['sha256', 'md5'])
+        self.assertEqual(result['sha1'], hashlib.sha1(contents).hexdigest())
+        self.assertEqual(result['md5'], hashlib.md5(contents).hexdigest())
+
+        self.assertEqual(DigestIndex(self.path).digests(filename), result)
+        self.assertEqual(m_digests.call_count, 2)
+
+    def test_cached(self):
+        filename = self.write('file', random_string())
+        index = DigestIndex(self.path)
+        self.assertIsNone(index.cached(filename))
+
+        result = index.digests(filename, ('sha1',))
+        self.assertIsNone(index.cached(filename))
+        self.assertEqual(index.cached(filename, ('sha1',)), result)
+        self.assertIsNone(index.cached(os.path.join(self.path,
+                                                    random_string())))
+        self.assertEqual(index.stats()['misses'], 1)
+
+    def test_schedule(self):
+        contents = random_string()
+        filename = self.write('file', contents)
+        index = DigestIndex(self.path)
+        index.schedule(filename)
+        index.queue.join()
+
+        self.assertEqual(index.cached(filename)['sha256'],
+                         hashlib.sha256(contents).hexdigest())
+        self.assertEqual(index.stats()['queued'], 0)
+
+    def test_digests_missing_file(self):
+        index = DigestIndex(self.path)
+        self.assertRaises(IOError, index.digests,
+                          os.path.join(self.path, random_string()))
+
+    def test_digests_invalid_index(self):
+        self.write(DIGEST_INDEX_FN, random_string())
+        filename = self.write('file', random_string())
+        result = DigestIndex(self.path).digests(filename)
+        self.assertEqual(result['sha1'], file_digests(filename)['sha1'])
+
+    @patch('ztpserver.repository.file_digests')
+    def test_digests_coalesced(self, m_digests):
+        def slow_digests(filename, *args):
+            time.sleep(0.1)
+            return file_digests(filename, *args)
+        m_digests.side_effect = slow_digests
+
+        index = DigestIndex(self.path)
+        filename = self.write('file', random_string())
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(index.digests(filename)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(m_digests.call_count, 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result == results[0] for result in results))
+
+
+    def index_file_entries(self):
+        with open(os.path.join(self.path, DIGEST_INDEX_FN)) as fhandler:
+            return json.load(fhandler)
+
+    def test_batch(self):
+        index = DigestIndex(self.path)
+        filenames = [self.write('file%d' % x, random_string())
+                     for x in range(10)]
+        with patch.object(index, '_save', wraps=index._save) as m_save:
+            index.begin_batch()
+            for filename in filenames:
+                index.digests(filename)
+            self.assertFalse(os.path.exists(os.path.join(self.path,
+                                                         DIGEST_INDEX_FN)))
+            self.assertEqual(index.stats()['unsaved'], 10)
+            index.end_batch()
+            self.assertEqual(m_save.call_count, 1)
+
+        self.assertEqual(len(self.index_file_entries()), 10)
+        self.assertEqual(index.stats()['unsaved'], 0)
+
+    @patch('ztpserver.repository.DIGEST_SAVE_INTERVAL', 0)
+    def test_batch_save_interval(self):
+        index = DigestIndex(self.path)
+        index.begin_batch()
+        index.digests(self.write('file', random_string()))
+        self.assertEqual(len(self.index_file_entries()), 1)
+        index.end_batch()
+
+    def test_unsaved_kept_on_reload(self):
+        index = DigestIndex(self.path)
+        other = DigestIndex(self.path)
+        index.begin_batch()
+        index.digests(self.write('file1', random_string()))
+
+        # written by another process
+        other.digests(self.write('file2', random_string()))
+        index.end_batch()
+        self.assertEqual(sorted(self.index_file_entries()),
+                         ['file1', 'file2'])
+
+    def test_stale_entries_pruned_on_load(self):
+        filename = self.write('file1', random_string())
+        DigestIndex(self.path).digests(filename)
+        os.remove(filename)
+
+        index = DigestIndex(self.path)
+        index.digests(self.write('file2', random_string()))
+        self.assertEqual(index.stats()['entries'], 1)
+        self.assertEqual(list(self.index_file_entries()), ['file2'])
+
+    def test_index_parsed_once(self):
+        filenames = [self.write('file%d' % x, random_string())
+                     for x in range(2)]
+        index = DigestIndex(self.path)
+        for filename in filenames:
+            index.digests(filename)
+
+        index = DigestIndex(self.path)
+        with patch('ztpserver.serializers.load',
+                   wraps=ztpserver.serializers.load) as m_load:
+            for filename in filenames:
+                index.digests(filename)
+        self.assertEqual(m_load.call_count, 1)
+        self.assertEqual(index.stats()['hits'], 2)
+
+
 class RepositoryUnitTests(unittest.TestCase):
 
     @classmethod
@@ -0,0 +1,139 @@
+#
+# Copyright (c) 2018, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+# pylint: disable=C0102,C0103,E1103,W0142,W0613,C0302,E1120
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ztpserver import resources
+from ztpserver.config import runtime
+
+
+PLUGIN = '''
+IDEMPOTENT = True
+LOADS = globals().get('LOADS', 0) + 1
+
+def main(node_id, pool, node):
+    return '%s:%s:%s' % (VALUE, node_id, pool)
+'''
+
+class PluginRegistryUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        os.mkdir(os.path.join(self.tmpdir, 'plugins'))
+        runtime.set_value('data_root', self.tmpdir, 'default')
+        self.addCleanup(runtime.clear_value, 'data_root', 'default')
+        self.registry = resources.PluginRegistry()
+
+    def write(self, name, value, mtime=None):
+        filename = os.path.join(self.tmpdir, 'plugins', name)
+        with open(filename, 'w') as fhandler:
+            fhandler.write('VALUE = %r\n' % value + PLUGIN)
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+        return filename
+
+    def test_loaded_once(self):
+        filename = self.write('plugin', 'foo')
+        (name, module) = self.registry.get('plugin')
+        self.assertEqual(name, filename)
+        self.assertEqual(module.main('node', 'pool', None), 'foo:node:pool')
+        self.assertIs(self.registry.get('plugin')[1], module)
+        self.assertEqual(self.registry.stats()['plugin']['loads'], 1)
+        self.assertGreaterEqual(
+            self.registry.stats()['plugin']['load_time'], 0)
+
+    def test_reloaded_when_changed(self):
+        self.write('plugin', 'foo', mtime=1000)
+        module = self.registry.get('plugin')[1]
+        self.write('plugin', 'bar', mtime=2000)
+        reloaded = self.registry.get('plugin')[1]
+        self.assertIsNot(reloaded, module)
+        self.assertEqual(reloaded.main('node', 'pool', None), 'bar:node:pool')
+        # the new version is loaded in a new module
+        self.assertEqual(reloaded.LOADS, 1)
+        self.assertEqual(module.main('node', 'pool', None), 'foo:node:pool')
+        self.assertEqual(self.registry.stats()['plugin']['loads'], 2)
+
+    def test_same_name_in_other_data_root(self):
+        self.write('plugin', 'foo')
+        module = self.registry.get('plugin')[1]
+
+        other = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other)
+        os.mkdir(os.path.join(other, 'plugins'))
+        with open(os.path.join(other, 'plugins', 'plugin'), 'w') as fhandler:
+            fhandler.write('VALUE = "bar"\n' + PLUGIN)
+        runtime.set_value('data_root', other, 'default')
+
+        self.assertEqual(self.registry.get('plugin')[1].main('n', 'p', None),
+                         'bar:n:p')
+        self.assertEqual(module.main('n', 'p', None), 'foo:n:p')
+
+    def test_missing_plugin(self):
+        self.assertRaises(IOError, self.registry.get, 'missing')
+        self.assertEqual(self.registry.stats(), dict())
+
+    def test_names(self):
+        self.write('foo', 'foo', mtime=1000)
+        os.utime(os.path.join(self.tmpdir, 'plugins'), (1000, 1000))
+        self.assertEqual(self.registry.names(), ['foo'])
+
+        self.write('bar', 'bar')
+        self.assertEqual(sorted(self.registry.names()), ['bar', 'foo'])
+
+    def test_resource_plugins(self):
+        self.write('foo', 'foo')
+        self.assertIn('foo', resources.resource_plugins())
+
+    def test_run_plugin(self):
+        self.write('plugin_test_run', 'foo')
+        self.addCleanup(resources.plugin_registry.clear)
+        self.assertEqual(resources.run_plugin('plugin_test_run', 'node',
+                                              'pool', None),
+                         'foo:node:pool')
+        self.assertEqual(
+            resources.plugin_registry.stats()['plugin_test_run']['loads'], 1)
+
+    def test_run_plugin_failure(self):
+        self.assertRaises(Exception, resources.run_plugin, 'missing',
+                          'node', 'pool', None)
+
+
+if __name__ == '__main__':
+    unittest.main()
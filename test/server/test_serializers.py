@@ -33,6 +33,9 @@
 import os
 import random
 import unittest
+import yaml
+
+from collections import OrderedDict
 
 import ztpserver.serializers as serializers
 
@@ -77,5 +80,96 @@ class SerializersUnitTest(unittest.TestCase):
             assert serializers.load(TMP_FILE, 
                                     CONTENT_TYPE_JSON) == data
 
+
+class YAMLSerializerUnitTest(unittest.TestCase):
+
+    DATA = [
+        dict(name='node', interfaces=[{'Ethernet1': 'spine1:Ethernet1'},
+                                      {'any': 'none'}]),
+        OrderedDict([('z', 1), ('a', [1, 2.5, None, True]), ('m', 'x')]),
+        dict(config='hostname leaf1\ninterface Ethernet1\n   shutdown\n'),
+        dict(description='x' * 200 + ' ' + 'y' * 200),
+        dict(name=u'\u00e9t\u00e9', key='x' * 100),
+        ['  leading and trailing spaces  ', '', 'yes', '0x10', "'q'"],
+        dict(),
+        'scalar',
+        None,
+    ]
+
+    def test_serialize_matches_pure_python(self):
+        serializer = serializers.YAMLSerializer(None)
+        for data in self.DATA:
+            expected = yaml.dump(data, Dumper=yaml.SafeDumper,
+                                 default_flow_style=False)
+            self.assertEqual(serializer.serialize(data), expected)
+
+    def test_serialize_odict(self):
+        serializer = serializers.YAMLSerializer(None)
+        data = OrderedDict([('z', 1), ('a', 2)])
+        self.assertEqual(serializer.serialize(data), 'z: 1\na: 2\n')
+
+    def test_deserialize(self):
+        serializer = serializers.YAMLSerializer(None)
+        for data in self.DATA:
+            text = yaml.safe_dump(data, default_flow_style=False)
+            self.assertEqual(serializer.deserialize(text),
+                             yaml.safe_load(text))
+
+    def test_deserialize_failure(self):
+        serializer = serializers.YAMLSerializer(None)
+        self.assertRaises(serializers.SerializerError,
+                          serializer.deserialize, 'key: [value')
+
+    def test_libyaml_compatible(self):
+        self.assertTrue(serializers.libyaml_compatible(
+            dict(a=['b', 1, None, {'c': 'd e'}])))
+        self.assertFalse(serializers.libyaml_compatible('scalar'))
+        self.assertFalse(serializers.libyaml_compatible(
+            dict(a=['multi\nline'])))
+        self.assertFalse(serializers.libyaml_compatible(
+            dict(a=u'\u00e9')))
+        self.assertFalse(serializers.libyaml_compatible({'x' * 100: 1}))
+        self.assertFalse(serializers.libyaml_compatible({'': 1}))
+        self.assertFalse(serializers.libyaml_compatible({'a': {'': 1}}))
+
+    def test_serialize_empty_key(self):
+        serializer = serializers.YAMLSerializer(None)
+        for data in [{'': 1}, {'a': {'': 2}}]:
+            expected = yaml.dump(data, Dumper=yaml.SafeDumper,
+                                 default_flow_style=False)
+            self.assertEqual(serializer.serialize(data), expected)
+            if hasattr(yaml, 'CSafeDumper'):
+                # libyaml emits the empty key differently
+                self.assertNotEqual(yaml.dump(data, Dumper=yaml.CSafeDumper,
+                                              default_flow_style=False),
+                                    expected)
+
+
+class JSONSerializerUnitTest(unittest.TestCase):
+
+    def test_deserialize_str(self):
+        serializer = serializers.JSONSerializer(None)
+        result = serializer.deserialize('{"a": ["b", [{"c": "d"}], 1], '
+                                        '"e": null}')
+        self.assertEqual(result, {'a': ['b', [{'c': 'd'}], 1], 'e': None})
+        self.assertEqual([type(x) for x in result], [str, str])
+        self.assertIsInstance(result['a'][0], str)
+        self.assertIsInstance(result['a'][1][0].keys()[0], str)
+        self.assertIsInstance(result['a'][1][0]['c'], str)
+
+        self.assertIsInstance(serializer.deserialize('"a"'), str)
+        self.assertIsInstance(serializer.deserialize('["a"]')[0], str)
+
+    def test_deserialize_non_ascii(self):
+        serializer = serializers.JSONSerializer(None)
+        result = serializer.deserialize('{"a": "\\u00e9"}')
+        self.assertEqual(result, {'a': u'\u00e9'})
+        self.assertIsInstance(result['a'], unicode)
+
+    def test_deserialize_failure(self):
+        serializer = serializers.JSONSerializer(None)
+        self.assertRaises(serializers.SerializerError,
+                          serializer.deserialize, '{"a": ')
+
 if __name__ == '__main__':
     unittest.main()
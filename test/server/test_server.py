@@ -0,0 +1,325 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+# pylint: disable=R0904,C0103
+import httplib
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from StringIO import StringIO
+
+from mock import patch
+
+import ztpserver.controller
+import ztpserver.repository
+import ztpserver.server
+
+from ztpserver.config import runtime
+from ztpserver.server import make_server, ThreadedZTPServer, RequestInput
+
+from server_test_lib import enable_logging, random_string
+
+class ServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_root)
+        runtime.set_value('data_root', self.data_root, 'default')
+        self.addCleanup(runtime.clear_value, 'data_root', 'default')
+
+        # other tests replace create_repository without restoring it
+        patcher = patch('ztpserver.controller.create_repository',
+                        ztpserver.repository.create_repository)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        os.makedirs(os.path.join(self.data_root, 'files'))
+        self.contents = os.urandom(3 * 1024 * 1024 + 17)
+        with open(os.path.join(self.data_root, 'files', 'image'),
+                  'wb') as fhandler:
+            fhandler.write(self.contents)
+
+        self.server = make_server('127.0.0.1', 0,
+                                  ztpserver.controller.Router())
+        self.addCleanup(self.server.server_close)
+
+    def get(self, url, **headers):
+        thread = threading.Thread(target=self.server.handle_request)
+        thread.start()
+        try:
+            connection = httplib.HTTPConnection('127.0.0.1',
+                                                self.server.server_port)
+            connection.request('GET', url, headers=headers)
+            response = connection.getresponse()
+            return (response.status, response.read())
+        finally:
+            thread.join()
+
+    @patch('ztpserver.server.sendfile', wraps=ztpserver.server.sendfile)
+    def test_sendfile(self, m_sendfile):
+        if ztpserver.server.LIBC_SENDFILE is None:
+            self.skipTest('sendfile(2) not available')
+
+        self.assertEqual(self.get('/files/image'), (200, self.contents))
+        self.assertTrue(m_sendfile.called)
+
+    @patch('ztpserver.server.sendfile')
+    def test_range(self, m_sendfile):
+        self.assertEqual(self.get('/files/image', Range='bytes=100-'),
+                         (206, self.contents[100:]))
+        self.assertFalse(m_sendfile.called)
+
+    @patch('ztpserver.server.LIBC_SENDFILE', None)
+    def test_no_sendfile(self):
+        self.assertEqual(self.get('/files/image'), (200, self.contents))
+
+    def test_not_found(self):
+        self.assertEqual(self.get('/files/%s' % random_string())[0], 404)
+
+
+class ThreadedServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.bodies = []
+
+    def app(self, environ, start_response):
+        if environ['PATH_INFO'] == '/slow':
+            self.release.wait(10)
+        elif environ['PATH_INFO'] == '/echo':
+            self.bodies.append(environ['wsgi.input'].read())
+        body = environ['PATH_INFO']
+        start_response('200 OK', [('Content-Type', 'text/plain'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+    def start(self, **kwargs):
+        server = ThreadedZTPServer(('127.0.0.1', 0), keepalive=True,
+                                   keepalive_timeout=5, **kwargs)
+        server.set_app(self.app)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.stop, 1)
+        self.addCleanup(self.release.set)
+        return server
+
+    @classmethod
+    def connect(cls, server):
+        return httplib.HTTPConnection('127.0.0.1', server.server_port,
+                                      timeout=10)
+
+    @classmethod
+    def get(cls, connection, url, method='GET', body=None):
+        connection.request(method, url, body=body)
+        response = connection.getresponse()
+        return (response.status, response.read())
+
+    def test_keepalive(self):
+        server = self.start()
+        connection = self.connect(server)
+        self.assertEqual(self.get(connection, '/first'), (200, '/first'))
+        sock = connection.sock
+        self.assertEqual(self.get(connection, '/second'), (200, '/second'))
+        self.assertTrue(connection.sock is sock)
+
+    def test_keepalive_unread_body(self):
+        server = self.start()
+        connection = self.connect(server)
+        body = random_string()
+        self.assertEqual(self.get(connection, '/post', 'POST', body),
+                         (200, '/post'))
+        self.assertEqual(self.get(connection, '/echo', 'POST', body),
+                         (200, '/echo'))
+        self.assertEqual(self.bodies, [body])
+
+    def test_concurrent_requests(self):
+        server = self.start(threads=2)
+        slow = self.connect(server)
+        slow.request('GET', '/slow')
+
+        # not serialized behind /slow
+        self.assertEqual(self.get(self.connect(server), '/fast'),
+                         (200, '/fast'))
+        self.release.set()
+        self.assertEqual(slow.getresponse().read(), '/slow')
+
+    def test_graceful_stop(self):
+        server = self.start()
+        slow = self.connect(server)
+        slow.request('GET', '/slow')
+        time.sleep(0.1)
+
+        # /slow is still being handled when the timeout expires
+        self.assertEqual(server.stop(0.1), 1)
+        self.release.set()
+        self.assertEqual(slow.getresponse().read(), '/slow')
+        self.assertEqual(server.stop(5), 0)
+
+    def test_stop_all_threads_busy(self):
+        server = self.start(threads=1)
+        slow = self.connect(server)
+        slow.request('GET', '/slow')
+        time.sleep(0.1)
+
+        # waits for a free thread
+        waiting = self.connect(server)
+        waiting.request('GET', '/waiting')
+        time.sleep(0.1)
+
+        result = []
+        thread = threading.Thread(target=lambda: result.append(
+            server.stop(0.1)))
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertEqual(result, [1])
+        # closed (reset if the request was not read)
+        self.assertRaises((httplib.HTTPException, socket.error),
+                          waiting.getresponse)
+
+        self.release.set()
+        self.assertEqual(slow.getresponse().read(), '/slow')
+
+
+class RequestInputTests(unittest.TestCase):
+
+    def test_read(self):
+        stream = RequestInput(StringIO('line1\nline2\nnext request'), 12)
+        self.assertEqual(stream.readline(), 'line1\n')
+        self.assertEqual(stream.read(), 'line2\n')
+        self.assertEqual(stream.read(), '')
+        self.assertTrue(stream.discard())
+
+    def test_discard(self):
+        rfile = StringIO('body' + 'next request')
+        self.assertTrue(RequestInput(rfile, 4).discard())
+        self.assertEqual(rfile.read(), 'next request')
+
+        stream = RequestInput(StringIO('x' * 10), 1024 * 1024)
+        self.assertFalse(stream.discard())
+
+
+
+class PreforkTests(unittest.TestCase):
+
+    SCRIPT = '''if True:
+        import os
+        import threading
+        from ztpserver import server
+
+        def record(name, threads=0):
+            filename = os.path.join(%(tmpdir)r, name)
+            with open(filename + '.tmp', 'w') as fhandler:
+                fhandler.write('%%d %%d' %% (os.getpid(), threads))
+            os.rename(filename + '.tmp', filename)
+
+        def on_ready():
+            # e.g. the digest warm-up thread
+            thread = threading.Thread(target=threading.Event().wait)
+            thread.daemon = True
+            thread.start()
+            record('ready')
+
+        def warm_up():
+            # threads of the parent process the worker was forked from
+            record('worker-%%d' %% os.getpid(),
+                   len(os.listdir('/proc/%%d/task' %% os.getppid())))
+
+        server.RESPAWN_DELAY = 0
+        httpd = server.ZTPServer(('127.0.0.1', 0))
+        server.run_prefork(httpd, 1, warm_up=warm_up, on_ready=on_ready,
+                           on_stop=lambda: record('stopped'),
+                           on_exit=lambda: record('exited'))
+    '''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def wait_for(self, predicate, timeout=10):
+        deadline = time.time() + timeout
+        while not predicate():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+
+    def read(self, name):
+        with open(os.path.join(self.tmpdir, name)) as fhandler:
+            return [int(x) for x in fhandler.read().split()]
+
+    def workers(self):
+        return [int(x.split('-')[1]) for x in os.listdir(self.tmpdir)
+                if x.startswith('worker-') and not x.endswith('.tmp')]
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/task'), 'requires /proc')
+    def test_helper(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        process = subprocess.Popen(
+            [sys.executable, '-c', self.SCRIPT % dict(tmpdir=self.tmpdir)],
+            env=env)
+        try:
+            self.wait_for(lambda: os.path.exists(
+                os.path.join(self.tmpdir, 'ready')) and self.workers())
+
+            # on_ready ran (and started its thread) in a helper process
+            (pid, _) = self.read('ready')
+            self.assertNotEqual(pid, process.pid)
+            self.assertNotIn(pid, self.workers())
+
+            # a restarted worker is forked from a parent with no thread
+            worker = self.workers()[0]
+            os.kill(worker, signal.SIGKILL)
+            self.wait_for(lambda: len(self.workers()) == 2)
+            restarted = [x for x in self.workers() if x != worker][0]
+            self.assertEqual(self.read('worker-%d' % restarted)[1], 1)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(self.read('stopped')[0], pid)
+        # on_exit ran in the worker which was stopped
+        self.assertEqual(self.read('exited')[0], restarted)
+
+if __name__ == '__main__':
+    enable_logging()
+    unittest.main()
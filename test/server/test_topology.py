@@ -30,6 +30,10 @@
 # IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+import cPickle
+import logging
+import os
+import threading
 import unittest
 import yaml
 
@@ -41,8 +45,15 @@ import ztpserver.topology
 from ztpserver.topology import Neighbordb, Pattern
 from ztpserver.topology import create_node, load_file, load_neighbordb
 from ztpserver.topology import neighbordb_path, replace_config_action
-from ztpserver.topology import load_pattern
-from server_test_lib import enable_logging, random_string
+from ztpserver.topology import load_pattern, NeighbordbCache
+from ztpserver.topology import compile_neighbordb, regex_prefix, Node
+from ztpserver.topology import load_compiled_neighbordb, file_digest
+from ztpserver.topology import create_neighbordb_snapshot
+from ztpserver.topology import neighbordb_snapshot_path, snapshot_header
+from ztpserver.topology import ActionPlan, DefinitionPlan, load_resources
+from ztpserver.config import runtime
+from server_test_lib import enable_logging, random_string, write_file
+from server_test_lib import remove_all
 
 class NeighbordbUnitTests(unittest.TestCase):
 
@@ -135,6 +146,384 @@ class NeighbordbUnitTests(unittest.TestCase):
                               attrs.systemmac})
         self.assertTrue('.' not in result.systemmac)
 
+NEIGHBORDB = '''
+patterns:
+    - name: dummy pattern
+      definition: dummy_definition
+      interfaces:
+        - any: any
+'''
+
+class NeighbordbCacheUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.filename = write_file(NEIGHBORDB)
+        self.cache = NeighbordbCache()
+
+        patcher = patch('ztpserver.topology.neighbordb_path')
+        self.addCleanup(patcher.stop)
+        m_path = patcher.start()
+        m_path.return_value = self.filename
+
+    def tearDown(self):
+        remove_all()
+
+    def test_hit(self):
+        first = self.cache.get(random_string())
+        second = self.cache.get(random_string())
+
+        self.assertIsInstance(first, Neighbordb)
+        self.assertIs(first, second)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['rebuilds'], 1)
+
+    def test_rebuild_on_change(self):
+        first = self.cache.get(random_string())
+
+        write_file(NEIGHBORDB + '''
+    - name: another pattern
+      definition: dummy_definition
+      interfaces:
+        - Ethernet1: any
+''', os.path.basename(self.filename))
+        second = self.cache.get(random_string())
+
+        self.assertIsNot(first, second)
+        self.assertEqual(len(second.patterns['globals']), 2)
+        self.assertEqual(self.cache.stats()['rebuilds'], 2)
+
+    def test_missing_file(self):
+        os.remove(self.filename)
+        self.assertIsNone(self.cache.get(random_string()))
+        self.assertIsNone(self.cache.entry)
+
+    def test_invalid_file_not_cached(self):
+        write_file('patterns: [', os.path.basename(self.filename))
+        self.assertIsNone(self.cache.get(random_string()))
+        self.assertIsNone(self.cache.entry)
+
+    @patch('ztpserver.topology.compile_neighbordb')
+    def test_concurrent_misses_single_rebuild(self, m_compile):
+        release = threading.Event()
+
+        def compile_neighbordb(node_id):
+            release.wait()
+            return Neighbordb(node_id)
+        m_compile.side_effect = compile_neighbordb
+
+        results = list()
+        threads = [threading.Thread(
+            target=lambda: results.append(self.cache.get(random_string())))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(m_compile.call_count, 1)
+        self.assertEqual(len(set(id(x) for x in results)), 1)
+        self.assertEqual(self.cache.stats()['hits'], 7)
+
+
+class NeighbordbSnapshotUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.filename = write_file(NEIGHBORDB)
+
+        patcher = patch('ztpserver.topology.neighbordb_path')
+        self.addCleanup(patcher.stop)
+        m_path = patcher.start()
+        m_path.return_value = self.filename
+
+        runtime.set_value('snapshot', True, 'neighbordb')
+        self.addCleanup(runtime.clear_value, 'snapshot', 'neighbordb')
+
+    def tearDown(self):
+        remove_all()
+
+    def test_disabled(self):
+        runtime.set_value('snapshot', False, 'neighbordb')
+        self.assertIsInstance(load_compiled_neighbordb(random_string()),
+                              Neighbordb)
+        self.assertFalse(os.path.exists(neighbordb_snapshot_path()))
+
+    def test_load_snapshot(self):
+        self.assertTrue(create_neighbordb_snapshot(random_string()))
+        header = open(neighbordb_snapshot_path()).readline()
+        self.assertEqual(header, snapshot_header(file_digest(self.filename)))
+
+        with patch('ztpserver.topology.compile_neighbordb') as m_compile:
+            m_compile.side_effect = AssertionError('snapshot not used')
+            neighbordb = load_compiled_neighbordb(random_string())
+        self.assertIsInstance(neighbordb, Neighbordb)
+        self.assertEqual([x.name for x in neighbordb.get_patterns()],
+                         ['dummy pattern'])
+
+    def test_write_snapshot_on_compile(self):
+        load_compiled_neighbordb(random_string())
+        header = open(neighbordb_snapshot_path()).readline()
+        self.assertEqual(header, snapshot_header(file_digest(self.filename)))
+
+    def test_stale_snapshot(self):
+        load_compiled_neighbordb(random_string())
+
+        write_file(NEIGHBORDB + '''
+    - name: another pattern
+      definition: dummy_definition
+      interfaces:
+        - Ethernet1: any
+''', os.path.basename(self.filename))
+        neighbordb = load_compiled_neighbordb(random_string())
+        self.assertEqual(len(neighbordb.patterns['globals']), 2)
+
+        header = open(neighbordb_snapshot_path()).readline()
+        self.assertEqual(header, snapshot_header(file_digest(self.filename)))
+
+    def test_corrupt_snapshot(self):
+        write_file(snapshot_header(file_digest(self.filename)) +
+                   random_string(),
+                   os.path.basename(neighbordb_snapshot_path()))
+        neighbordb = load_compiled_neighbordb(random_string())
+        self.assertIsInstance(neighbordb, Neighbordb)
+
+    def test_invalid_neighbordb(self):
+        write_file('patterns: [', os.path.basename(self.filename))
+        self.assertIsNone(load_compiled_neighbordb(random_string()))
+        self.assertFalse(create_neighbordb_snapshot(random_string()))
+        self.assertFalse(os.path.exists(neighbordb_snapshot_path()))
+
+    def test_pickle(self):
+        filename = os.path.join('test', 'neighbordb', 'large_pattern_test.yml')
+        contents = yaml.safe_load(open(filename))
+        neighbordb = compile_neighbordb(random_string(),
+                                        contents['neighbordb'])
+        copy = cPickle.loads(cPickle.dumps(neighbordb,
+                                           cPickle.HIGHEST_PROTOCOL))
+
+        node = Node(**contents['node_d27d'])
+        self.assertEqual([x.name for x in neighbordb.match_node(node)],
+                         [x.name for x in copy.match_node(node)])
+        self.assertEqual(len(copy.index), len(neighbordb.index))
+
+
+class PatternIndexUnitTests(unittest.TestCase):
+
+    NEIGHBORDB = {
+        'patterns': [
+            {'name': 'exact device',
+             'definition': 'test',
+             'interfaces': [{'Ethernet1': 'spine1:Ethernet1'}]},
+            {'name': 'regex device',
+             'definition': 'test',
+             'interfaces': [{'any': 'regex(\'spine\\d+\')'}]},
+            {'name': 'remote interface',
+             'definition': 'test',
+             'interfaces': [{'any': 'any:Ethernet49'}]},
+            {'name': 'local interface',
+             'definition': 'test',
+             'interfaces': [{'Ethernet2': 'any'}]},
+            {'name': 'catch all',
+             'definition': 'test',
+             'interfaces': [{'any': 'any'}]}]
+    }
+
+    @staticmethod
+    def node(neighbors):
+        return Node(serialnumber=random_string(),
+                    neighbors=dict((intf, [{'device': device,
+                                            'port': port}])
+                                   for (intf, device, port) in neighbors))
+
+    def candidates(self, neighbors):
+        neighbordb = compile_neighbordb(random_string(), self.NEIGHBORDB)
+        return [x.name for x in
+                neighbordb.index.candidates(self.node(neighbors))]
+
+    def test_regex_prefix(self):
+        self.assertEqual(regex_prefix(r'spine\d+'), 'spine')
+        self.assertEqual(regex_prefix('spines?'), 'spine')
+        self.assertEqual(regex_prefix('spine+1'), 'spine')
+        self.assertEqual(regex_prefix('.*spine'), '')
+        self.assertEqual(regex_prefix('spine|leaf'), '')
+        self.assertEqual(regex_prefix('(?i)spine'), '')
+
+    def test_unindexed_always_candidate(self):
+        self.assertEqual(self.candidates([]), ['catch all'])
+
+    def test_candidates_ordered(self):
+        result = self.candidates([('Ethernet2', 'leaf1', 'Ethernet49'),
+                                  ('Ethernet1', 'spine1', 'Ethernet1')])
+        self.assertEqual(result, ['exact device', 'regex device',
+                                  'remote interface', 'local interface',
+                                  'catch all'])
+
+    def test_candidates_pruned(self):
+        result = self.candidates([('Ethernet3', 'leaf1', 'Ethernet1')])
+        self.assertEqual(result, ['catch all'])
+
+        result = self.candidates([('Ethernet3', 'spine7', 'Ethernet1')])
+        self.assertEqual(result, ['regex device', 'catch all'])
+
+    def test_match_node_first_match(self):
+        neighbordb = compile_neighbordb(random_string(), self.NEIGHBORDB)
+        node = self.node([('Ethernet1', 'spine1', 'Ethernet1')])
+
+        result = neighbordb.match_node(node)
+        self.assertEqual([x.name for x in result],
+                         ['exact device', 'regex device', 'catch all'])
+
+        result = neighbordb.match_node(node, first_match=True)
+        self.assertEqual([x.name for x in result], ['exact device'])
+
+    def test_match_node_logging(self):
+        neighbordb = compile_neighbordb(random_string(), self.NEIGHBORDB)
+        node = self.node([('Ethernet1', 'spine1', 'Ethernet1')])
+
+        logger = logging.getLogger('ztpserver.topology')
+        self.addCleanup(logger.setLevel, logger.level)
+
+        # the node is only formatted if DEBUG is enabled
+        with patch.object(Node, '__repr__', return_value='node') as m_repr:
+            logger.setLevel(logging.INFO)
+            self.assertEqual(len(neighbordb.match_node(node)), 3)
+            self.assertFalse(m_repr.called)
+
+            logger.setLevel(logging.DEBUG)
+            with patch.object(logger, 'handle') as m_handle:
+                neighbordb.match_node(node)
+            messages = [x[0][0].getMessage() for x in m_handle.call_args_list]
+            self.assertTrue(any('attempting to match node (node)' in x
+                                for x in messages))
+
+
+class CompactTopologyUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        filename = os.path.join('test', 'neighbordb', 'large_pattern_test.yml')
+        contents = yaml.safe_load(open(filename))['neighbordb']
+        self.neighbordb = compile_neighbordb(random_string(), contents)
+
+    def test_no_instance_dict(self):
+        for pattern in self.neighbordb.get_patterns():
+            self.assertFalse(hasattr(pattern, '__dict__'))
+            for entry in pattern.interfaces:
+                item = entry.pattern
+                self.assertFalse(hasattr(item, '__dict__'))
+                self.assertFalse(hasattr(item.remote_device_re, '__dict__'))
+                self.assertFalse(hasattr(item.remote_interface_re,
+                                         '__dict__'))
+
+        node = Node(serialnumber=random_string())
+        self.assertFalse(hasattr(node, '__dict__'))
+
+    def test_interned_strings(self):
+        devices = [entry.pattern.remote_device
+                   for pattern in self.neighbordb.get_patterns()
+                   for entry in pattern.interfaces
+                   if entry.pattern.remote_device == 'localhost']
+        self.assertTrue(len(devices) > 1)
+        for device in devices:
+            self.assertIs(device, devices[0])
+
+    def test_shared_variables(self):
+        pattern = [x for x in self.neighbordb.get_patterns()
+                   if x.name == 'default catch all'][0]
+        self.assertIs(pattern.variables, self.neighbordb.variables)
+
+
+class ActionPlanUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.action = {'name': 'configure ma1',
+                       'action': 'add_config',
+                       'attributes': {'url': 'files/templates/ma1',
+                                      'variables': {'ip': "allocate('ip')",
+                                                    'hostname': '$hostname',
+                                                    'nested': {
+                                                        'list': [
+                                                            '$domain',
+                                                            "test('x')",
+                                                            'literal']}}}}
+
+    @staticmethod
+    def plugin(plugin, node_id, pool, node):
+        return '%s:%s:%s' % (plugin, node_id, pool)
+
+    def test_compile(self):
+        plan = ActionPlan(self.action)
+        self.assertEqual(sorted(plan.variables),
+                         [(('variables', 'hostname'), 'hostname'),
+                          (('variables', 'nested', 'list', 0), 'domain')])
+        self.assertEqual(sorted(plan.resources),
+                         [(('variables', 'ip'), 'allocate', 'ip'),
+                          (('variables', 'nested', 'list', 1), 'test',
+                           'x')])
+
+    def test_render(self):
+        plan = ActionPlan(self.action)
+        values = dict(hostname='leaf1', domain='example.com')
+
+        with patch('ztpserver.topology.run_plugin', self.plugin):
+            action = plan.resolve(plan.substitute(values.get), None, 'node')
+
+        variables = action['attributes']['variables']
+        self.assertEqual(variables['hostname'], 'leaf1')
+        self.assertEqual(variables['ip'], 'allocate:node:ip')
+        self.assertEqual(variables['nested']['list'],
+                         ['example.com', 'test:node:x', 'literal'])
+        self.assertEqual(action['attributes']['url'], 'files/templates/ma1')
+
+    def test_plan_not_modified(self):
+        plan = ActionPlan(self.action)
+        with patch('ztpserver.topology.run_plugin', self.plugin):
+            plan.resolve(plan.substitute(lambda name: name), None, 'node')
+            plan.resolve(plan.substitute(lambda name: name), None, 'node')
+
+        self.assertEqual(plan.action, self.action)
+        self.assertIsNot(plan.action, self.action)
+
+    def test_variable_resolved_to_plugin(self):
+        # the value of a variable can itself be a plugin reference
+        plan = ActionPlan(self.action)
+        values = dict(hostname="test('hostname')", domain=["test('a')"])
+
+        with patch('ztpserver.topology.run_plugin', self.plugin):
+            action = plan.resolve(plan.substitute(values.get), None, 'node')
+
+        variables = action['attributes']['variables']
+        self.assertEqual(variables['hostname'], 'test:node:hostname')
+        self.assertEqual(variables['nested']['list'][0], ['test:node:a'])
+
+    def test_action_without_attributes(self):
+        plan = ActionPlan({'name': 'foo'})
+        self.assertEqual(plan.substitute(lambda name: name),
+                         {'name': 'foo', 'attributes': {}})
+
+    def test_definition_plan(self):
+        definition = {'name': 'leaf', 'attributes': {'hostname': 'leaf1'},
+                      'actions': [self.action]}
+        plan = DefinitionPlan(definition)
+        self.assertEqual(len(plan.actions), 1)
+
+        template = plan.template()
+        self.assertEqual(template, definition)
+        template['actions'].append('foo')
+        self.assertEqual(len(plan.template()['actions']), 1)
+
+    def test_load_resources_list(self):
+        attributes = {'list': ["allocate('a')", 'b', ["test('c')"]],
+                      'dict': {'d': "test('d')"}}
+        with patch('ztpserver.topology.run_plugin', self.plugin):
+            result = load_resources(attributes, None, 'node')
+        self.assertEqual(result,
+                         {'list': ['allocate:node:a', 'b', ['test:node:c']],
+                          'dict': {'d': 'test:node:d'}})
+
+
 if __name__ == '__main__':
     enable_logging()
     unittest.main()
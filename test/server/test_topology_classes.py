@@ -38,6 +38,7 @@ from mock import Mock
 
 from ztpserver.app import enable_handler_console    # pylint: disable=W0611
 from ztpserver.topology import InterfacePattern, InterfacePatternError
+from ztpserver.topology import InterfaceRangePattern, split_interface
 from ztpserver.topology import Pattern, PatternError
 from ztpserver.topology import Node, NodeError, Neighbor
 
@@ -218,6 +219,14 @@ class FunctionsUnitTests(unittest.TestCase):
         func = RegexFunction(value)
         self.assertFalse(func.match(random_string()))
 
+    def test_predicate(self):
+        value = random_string()
+        for func in [ExactFunction(value), IncludesFunction(value),
+                     ExcludesFunction(value), RegexFunction(value)]:
+            predicate = func.predicate()
+            for arg in [value, random_string()]:
+                self.assertEqual(bool(predicate(arg)), func.match(arg))
+
 
 class TestPattern(unittest.TestCase):
 
@@ -241,6 +250,43 @@ class TestPattern(unittest.TestCase):
         obj = Pattern(interfaces=[{'Ethernet1': 'any'}])
         self.assertEqual(len(obj.interfaces), 1)
 
+    def test_add_interface_dispatch(self):
+        obj = Pattern(interfaces=[{'Ethernet1-3': 'any'},
+                                  {'any': 'spine1'},
+                                  {'none': 'spine2'}])
+        self.assertEqual(list(obj.dispatch), ['Ethernet'])
+        self.assertEqual(obj.dispatch['Ethernet'][0][1].ranges,
+                         {'Ethernet': ((1, 3),)})
+        self.assertEqual([x[1].interface for x in obj.wildcards],
+                         ['any', 'none'])
+        self.assertEqual(obj.positives, 4)
+
+    def test_match_node_dispatch(self):
+        neighbors = {'Ethernet1': [{'device': 'spine1', 'port': 'Ethernet1'}],
+                     'Ethernet2': [{'device': 'spine2', 'port': 'Ethernet1'}],
+                     'Ethernet3': [{'device': 'leaf1', 'port': 'Ethernet1'}]}
+        node = Node(serialnumber=random_string(), neighbors=neighbors)
+
+        obj = Pattern(interfaces=[{'Ethernet1': 'spine1'},
+                                  {'any': 'spine2'}])
+        self.assertTrue(obj.match_node(node))
+
+        # positive constraint not matched by any interface
+        obj = Pattern(interfaces=[{'Ethernet1': 'spine1'},
+                                  {'Ethernet4': 'any'}])
+        self.assertFalse(obj.match_node(node))
+
+        # wildcard consumed by the first interface it matches
+        obj = Pattern(interfaces=[{'any': 'regex(\'spine\\d\')'},
+                                  {'any': 'regex(\'spine\\d\')'},
+                                  {'any': 'regex(\'spine\\d\')'}])
+        self.assertFalse(obj.match_node(node))
+
+        # negative constraint
+        obj = Pattern(interfaces=[{'Ethernet1': 'spine1'},
+                                  {'none': 'leaf1'}])
+        self.assertFalse(obj.match_node(node))
+
 
 class PatternUnitTests(unittest.TestCase):
 
@@ -372,6 +418,40 @@ class TestInterfacePattern(unittest.TestCase):
                     result = pattern.match(interface, [neighbor])
                     self.assertFalse(result)
 
+    def test_match_bogus_patterns(self):
+        neighbor = Neighbor(random_string(), random_string())
+        for (intf, remote_d, remote_i) in [('any', 'any', 'none'),
+                                           ('any', 'none', 'any'),
+                                           ('any', 'none', random_string()),
+                                           ('none', 'none', 'none'),
+                                           ('none', 'any', 'any')]:
+            pattern = InterfacePattern(intf, remote_d, remote_i,
+                                       random_string())
+            self.assertIs(pattern.match(random_string(), [neighbor]),
+                          False)
+
+    def test_match_not_applicable(self):
+        interface = random_string()
+        neighbor = Neighbor(random_string(), random_string())
+        for (intf, remote_d, remote_i) in [(interface, 'any', 'any'),
+                                           ('any', random_string(), 'any'),
+                                           ('any', 'any', random_string()),
+                                           ('none', random_string(), 'any')]:
+            pattern = InterfacePattern(intf, remote_d, remote_i,
+                                       random_string())
+            self.assertIsNone(pattern.match(interface + 'dummy',
+                                            [neighbor]))
+
+    def test_refresh(self):
+        remote_device = random_string()
+        pattern = InterfacePattern('any', '$dummy', 'any', random_string())
+        neighbor = Neighbor(remote_device, random_string())
+        self.assertIsNone(pattern.match(random_string(), [neighbor]))
+
+        pattern.remote_device = remote_device
+        pattern.refresh()
+        self.assertTrue(pattern.match(random_string(), [neighbor]))
+
     def compile_known_function(self, interface, cls):
         pattern = InterfacePattern(random_string(),
                                    interface,
@@ -406,6 +486,39 @@ class TestInterfacePattern(unittest.TestCase):
                           random_string(), interface,
                           random_string(), random_string())
 
+
+class TestInterfaceRangePattern(unittest.TestCase):
+
+    def test_ranges(self):
+        obj = InterfaceRangePattern('Ethernet1-48,Ethernet40-52,'
+                                    'Ethernet49/1-49/4', 'any', 'any',
+                                    random_string())
+        self.assertEqual(obj.ranges, {'Ethernet': ((1, 52),),
+                                      'Ethernet49/': ((1, 4),)})
+        self.assertEqual(obj.interface_count, 56)
+        self.assertEqual(len(list(obj.members())), 56)
+
+    def test_includes(self):
+        obj = InterfaceRangePattern('Ethernet1-3,Ethernet49/1-49/4', 'any',
+                                    'any', random_string())
+        for interface in ['Ethernet1', 'Ethernet3', 'Ethernet49/4']:
+            self.assertTrue(obj.includes(*split_interface(interface)))
+        for interface in ['Ethernet4', 'Ethernet49/5', 'Management1',
+                          'Ethernet', random_string()]:
+            self.assertFalse(obj.includes(*split_interface(interface)))
+
+    def test_match(self):
+        neighbors = [Neighbor('spine1', 'Ethernet1')]
+        obj = InterfaceRangePattern('Ethernet1-3', 'spine1', 'Ethernet1',
+                                    random_string())
+        self.assertTrue(obj.match('Ethernet2', neighbors))
+        self.assertIsNone(obj.match('Ethernet4', neighbors))
+        self.assertFalse(obj.match('Ethernet2', neighbors) is False)
+
+    def test_invalid_range(self):
+        self.assertRaises(TypeError, InterfaceRangePattern,
+                          'Ethernet3-1', 'any', 'any', random_string())
+
 if __name__ == '__main__':
     enable_logging()
     unittest.main()
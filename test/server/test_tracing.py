@@ -0,0 +1,262 @@
+#
+# Copyright (c) 2018, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+# pylint: disable=C0102,C0103,E1103,W0142,W0613,C0302,E1120
+#
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock, patch
+from webob import Request
+
+import ztpserver.controller
+
+from ztpserver import tracing
+from ztpserver.config import runtime
+from ztpserver.constants import HTTP_STATUS_BAD_REQUEST, HTTP_STATUS_CREATED
+
+
+class TracingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.filename = os.path.join(self.tmpdir, 'trace.jsonl')
+
+        self.tracer = tracing.Tracer()
+        self.addCleanup(self.close_sink)
+
+    def close_sink(self):
+        if self.tracer.sink is not None:
+            self.tracer.sink.close()
+
+    def enable(self, filename=None, **kwargs):
+        filename = filename or self.filename
+        runtime.set_value('filename', filename, 'tracing')
+        self.addCleanup(runtime.clear_value, 'filename', 'tracing')
+        for name, value in kwargs.items():
+            runtime.set_value(name, value, 'tracing')
+            self.addCleanup(runtime.clear_value, name, 'tracing')
+
+    def records(self, filename=None):
+        filename = tracing.process_filename(filename or self.filename)
+        with open(filename) as fhandler:
+            return [json.loads(x) for x in fhandler]
+
+
+class TracerUnitTests(TracingTestCase):
+
+    def test_disabled(self):
+        self.assertIsNone(self.tracer.start('node'))
+        self.assertIs(self.tracer.span('state', 'node_exists'),
+                      tracing.NULL_SPAN)
+        with self.tracer.span('state', 'node_exists'):
+            pass
+        self.tracer.finish(200)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_span(self):
+        self.enable()
+        trace = self.tracer.start('node')
+
+        with self.tracer.span('state', 'node_exists') as span:
+            pass
+        self.assertEqual(trace.spans, [span])
+        self.assertGreaterEqual(span.duration, 0)
+
+        record = span.record()
+        self.assertEqual(record['type'], 'span')
+        self.assertEqual(record['trace'], trace.trace_id)
+        self.assertEqual(record['node_id'], 'node')
+        self.assertEqual(record['kind'], 'state')
+        self.assertEqual(record['name'], 'node_exists')
+        self.assertEqual(record['outcome'], 'ok')
+        self.assertNotIn('error', record)
+
+    def test_span_error(self):
+        self.enable()
+        trace = self.tracer.start('node')
+
+        def run():
+            with self.tracer.span('plugin', 'allocate'):
+                raise KeyError('pool')
+        self.assertRaises(KeyError, run)
+
+        record = trace.spans[0].record()
+        self.assertEqual(record['outcome'], 'error')
+        self.assertEqual(record['error'], "KeyError: 'pool'")
+
+    def test_summary(self):
+        self.enable()
+        trace = self.tracer.start('node', Request.blank('/nodes/node'))
+
+        for state in ['node_exists', 'get_definition', 'do_actions']:
+            with self.tracer.span('state', state):
+                pass
+        for _ in range(2):
+            with self.tracer.span('plugin', 'allocate'):
+                pass
+
+        summary = trace.summary(200)
+        self.assertEqual(summary['type'], 'request')
+        self.assertEqual(summary['method'], 'GET')
+        self.assertEqual(summary['path'], '/nodes/node')
+        self.assertEqual(summary['status'], 200)
+        self.assertEqual(summary['states'],
+                         ['node_exists', 'get_definition', 'do_actions'])
+        self.assertEqual(sorted(summary['times']),
+                         ['plugin:allocate', 'state:do_actions',
+                          'state:get_definition', 'state:node_exists'])
+        self.assertEqual(summary['errors'], [])
+
+    def test_finish_writes_json_lines(self):
+        self.enable()
+        for node_id in ['node1', 'node2']:
+            self.tracer.start(node_id)
+            with self.tracer.span('state', 'node_exists'):
+                pass
+            self.tracer.finish(201)
+        self.assertIsNone(self.tracer.current())
+
+        records = self.records()
+        self.assertEqual([x['type'] for x in records],
+                         ['span', 'request', 'span', 'request'])
+        self.assertEqual([x['node_id'] for x in records],
+                         ['node1', 'node1', 'node2', 'node2'])
+        self.assertEqual(records[0]['trace'], records[1]['trace'])
+        self.assertNotEqual(records[1]['trace'], records[3]['trace'])
+        self.assertEqual(records[1]['status'], 201)
+
+    def test_rotate(self):
+        self.enable(max_bytes=256, backup_count=2)
+        for _ in range(10):
+            self.tracer.start('node')
+            self.tracer.finish(200)
+
+        filename = tracing.process_filename(self.filename)
+        self.assertTrue(os.path.exists(filename + '.1'))
+        self.assertTrue(os.path.exists(filename + '.2'))
+        self.assertFalse(os.path.exists(filename + '.3'))
+
+    def test_filename_changed(self):
+        self.enable()
+        self.tracer.start('node')
+        self.tracer.finish(200)
+
+        filename = os.path.join(self.tmpdir, 'other.jsonl')
+        self.enable(filename)
+        self.tracer.start('node')
+        self.tracer.finish(200)
+
+        self.assertEqual(len(self.records()), 1)
+        self.assertEqual(len(self.records(filename)), 1)
+
+    def test_forked(self):
+        self.enable()
+        self.tracer.start('node')
+        self.tracer.finish(200)
+
+        # a worker forked from this process
+        with patch('os.getpid', return_value=os.getpid() + 1):
+            self.tracer.start('node')
+            self.tracer.finish(200)
+        self.assertEqual(len(self.records()), 1)
+        with open(tracing.process_filename(self.filename,
+                                           os.getpid() + 1)) as fhandler:
+            records = [json.loads(x) for x in fhandler]
+        self.assertEqual(len(records), 1)
+        self.assertTrue(records[0]['trace'].startswith(
+            '%d-' % (os.getpid() + 1)))
+
+    def test_write_failure(self):
+        self.enable(os.path.join(self.tmpdir, 'missing', 'trace.jsonl'))
+        self.tracer.start('node')
+        with patch('ztpserver.tracing.log') as m_log:
+            self.tracer.finish(200)
+            self.assertTrue(m_log.warning.called)
+
+
+class NodesControllerTracingTests(TracingTestCase):
+
+    def setUp(self):
+        super(NodesControllerTracingTests, self).setUp()
+        for patcher in [patch('ztpserver.controller.tracer', self.tracer),
+                        patch('ztpserver.controller.create_repository')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_fsm_states(self):
+        self.enable()
+        controller = ztpserver.controller.NodesController()
+
+        def state(next_state, status=None):
+            def method(response, **kwargs):
+                if status:
+                    response['status'] = status
+                return (response, next_state)
+            return Mock(side_effect=method)
+
+        controller.node_exists = state('post_node')
+        controller.post_node = state('dump_node', HTTP_STATUS_CREATED)
+        controller.dump_node = state(None)
+
+        request = Request.blank('/nodes', method='POST')
+        controller.fsm('node_exists', request=request, node_id='node')
+
+        records = self.records()
+        self.assertEqual([x['name'] for x in records[:-1]],
+                         ['node_exists', 'post_node', 'dump_node'])
+        self.assertEqual(records[-1]['states'],
+                         ['node_exists', 'post_node', 'dump_node'])
+        self.assertEqual(records[-1]['status'], HTTP_STATUS_CREATED)
+        self.assertEqual(records[-1]['method'], 'POST')
+
+    def test_fsm_error(self):
+        self.enable()
+        controller = ztpserver.controller.NodesController()
+        controller.node_exists = Mock(side_effect=ValueError('boom'))
+
+        controller.fsm('node_exists', node_id='node')
+
+        records = self.records()
+        self.assertEqual(records[0]['outcome'], 'error')
+        self.assertEqual(records[0]['error'], 'ValueError: boom')
+        self.assertEqual(records[-1]['errors'], ['state:node_exists'])
+        self.assertEqual(records[-1]['status'], HTTP_STATUS_BAD_REQUEST)
+
+
+if __name__ == '__main__':
+    unittest.main()
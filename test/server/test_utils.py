@@ -32,8 +32,10 @@
 
 import unittest
 
+from mock import Mock
 
 from ztpserver import utils
+from ztpserver.config import runtime
 
 
 class UtilsUnitTests(unittest.TestCase):
@@ -53,3 +55,41 @@ class UtilsUnitTests(unittest.TestCase):
                               ['Ethernet2/2',
                                'Ethernet2/3',
                                'Ethernet2/4'])
+
+    def test_parse_range(self):
+        result = utils.parse_range('Ethernet1-48,Ethernet49/1-49/4,e50,51')
+        self.assertEqual(result,
+                         [('Ethernet', '', 1, 48),
+                          ('Ethernet', '49/', 1, 4),
+                          ('Ethernet', '', 50, 50),
+                          ('Ethernet', '', 51, 51)])
+
+    def test_parse_range_invalid(self):
+        for interfaces in ['Ethernet0', 'Ethernet3-1', 'Ethernet1-2-3',
+                           'Ethernet1/1-2/3', 'bogus']:
+            self.assertRaises(TypeError, utils.parse_range, interfaces)
+
+
+class LogPayloadUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        runtime.set_value('log_payload_size', 10, 'default')
+        self.addCleanup(runtime.clear_value, 'log_payload_size', 'default')
+
+    def test_lazy(self):
+        formatter = Mock(return_value='payload')
+        payload = utils.LogPayload('value', formatter)
+        self.assertFalse(formatter.called)
+        self.assertEqual(str(payload), 'payload')
+        formatter.assert_called_once_with('value')
+
+    def test_truncated(self):
+        self.assertEqual(str(utils.LogPayload('x' * 10)), 'x' * 10)
+        self.assertEqual(str(utils.LogPayload('x' * 15)),
+                         'x' * 10 + '... (5 characters truncated)')
+        self.assertEqual(str(utils.LogPayload(range(10))),
+                         '[0, 1, 2, ... (20 characters truncated)')
+
+    def test_unlimited(self):
+        runtime.set_value('log_payload_size', 0, 'default')
+        self.assertEqual(str(utils.LogPayload('x' * 100000)), 'x' * 100000)
@@ -0,0 +1,117 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+import ztpserver.warmup
+
+from ztpserver.config import runtime
+from ztpserver.repository import digest_index, file_digests
+from ztpserver.warmup import DigestWarmup, start_warmup
+
+from server_test_lib import enable_logging, random_string
+
+class DigestWarmupUnitTests(unittest.TestCase):
+    #pylint: disable=R0904,C0103
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        self.expected = [self.write('files', 'images', 'EOS.swi'),
+                         self.write('files', 'file'),
+                         self.write('actions', 'install_image'),
+                         self.write('nodes', 'node1', 'startup-config')]
+        self.write('nodes', 'node1', 'definition')
+        self.write('resources', 'pool')
+
+    def write(self, *args):
+        filename = os.path.join(self.path, *args)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as fhandler:
+            fhandler.write(random_string())
+        return filename
+
+    def test_files(self):
+        warmup = DigestWarmup(self.path)
+        self.assertEqual(sorted(warmup.files()), sorted(self.expected))
+
+    @patch('os.nice')
+    def test_scan(self, m_nice):
+        warmup = DigestWarmup(self.path, workers=2, niceness=5)
+        warmup.scan()
+
+        self.assertTrue(m_nice.called)
+        m_nice.assert_called_with(5)
+
+        status = warmup.status()
+        self.assertEqual(status['total'], len(self.expected))
+        self.assertEqual(status['done'], len(self.expected))
+        self.assertEqual(status['pending'], 0)
+
+        index = digest_index(self.path)
+        self.assertEqual(index.stats()['entries'], len(self.expected))
+        for filename in self.expected:
+            self.assertEqual(index.digests(filename)['sha1'],
+                             file_digests(filename)['sha1'])
+        self.assertEqual(index.stats()['misses'], len(self.expected))
+
+    def test_start_disabled(self):
+        self.assertEqual(start_warmup(), None)
+
+    def test_start(self):
+        runtime.set_value('data_root', self.path, 'default')
+        self.addCleanup(runtime.clear_value, 'data_root', 'default')
+        runtime.set_value('enabled', True, 'warmup')
+        self.addCleanup(runtime.clear_value, 'enabled', 'warmup')
+        self.addCleanup(setattr, ztpserver.warmup, 'warmup', None)
+
+        warmup = start_warmup()
+        self.assertTrue(start_warmup() is warmup)
+        warmup.thread.join(10)
+
+        status = warmup.status()
+        self.assertFalse(status['running'])
+        self.assertEqual(status['scans'], 1)
+        self.assertEqual(status['done'], len(self.expected))
+
+
+if __name__ == '__main__':
+    enable_logging()
+    unittest.main()
@@ -38,7 +38,9 @@ import routes
 
 import webob
 
-from ztpserver.wsgiapp import WSGIController, WSGIRouter
+from mock import Mock
+
+from ztpserver.wsgiapp import WSGIController, WSGIRouter, RouteTrie
 
 class TestWsgiApp(unittest.TestCase):
 
@@ -108,6 +110,121 @@ class TestWsgiApp(unittest.TestCase):
     def test_delete_url_missing(self):
         self.delete_url('/missing', 404)
 
+class RouteTrieTests(unittest.TestCase):
+
+    def setUp(self):
+        self.mapper = routes.Mapper()
+        self.mapper.connect('index', '/index', controller='index',
+                            action='index', conditions=dict(method=['GET']))
+        self.mapper.connect('meta', '/meta/{type:files|nodes}/{path_info:.*}',
+                            controller='meta', action='metadata')
+        self.mapper.collection('items', 'item', controller='items',
+                               collection_actions=['create'],
+                               member_actions=['show'],
+                               member_prefix='/{resource}')
+        self.mapper.connect('item_config', '/items/{resource}/config',
+                            controller='items', action='config',
+                            conditions=dict(method=['PUT']))
+        self.mapper.collection('files', 'file', controller='files',
+                               collection_actions=[],
+                               member_actions=['show'],
+                               member_prefix='/{resource:.*}')
+
+    def match(self, url, method='GET', **kwargs):
+        environ = webob.Request.blank(url, method=method, **kwargs).environ
+        expected = self.mapper.match(environ=environ)
+        result = RouteTrie(self.mapper).match(environ)
+        if result is not None:
+            self.assertEqual(result[0], expected)
+        return result
+
+    def test_match(self):
+        self.assertEqual(len(RouteTrie(self.mapper)), 6)
+        for (url, method, name) in [('/index', 'GET', 'index'),
+                                    ('/meta/files/a/b', 'GET', 'meta'),
+                                    ('/meta/nodes/', 'GET', 'meta'),
+                                    ('/items', 'POST', 'create_item'),
+                                    ('/items/abc', 'GET', 'item'),
+                                    ('/items/abc/config', 'PUT',
+                                     'item_config'),
+                                    ('/files/a/b.c', 'GET', 'file'),
+                                    ('/files/', 'GET', 'file')]:
+            (_, route) = self.match(url, method)
+            self.assertEqual(route.name, name)
+
+    def test_no_match(self):
+        for (url, method) in [('/index', 'POST'),
+                              ('/index/', 'GET'),
+                              ('/meta/other/a', 'GET'),
+                              ('/meta/files', 'GET'),
+                              ('/items/', 'GET'),
+                              ('/items/abc/config', 'GET'),
+                              ('/missing', 'GET'),
+                              ('index', 'GET')]:
+            self.assertIsNone(self.match(url, method))
+
+    def test_unicode(self):
+        (match, _) = self.match('/items/%C3%A9t%C3%A9')
+        self.assertEqual(match['resource'], u'\xe9t\xe9')
+        (match, _) = self.match('/meta/files/%C3%A9')
+        self.assertEqual(match['path_info'], '\xc3\xa9')
+
+    def test_format_left_to_mapper(self):
+        self.assertIsNone(self.match('/items/abc.json'))
+        self.assertIsNotNone(self.match('/items/abc.json/config', 'PUT'))
+
+    def test_method_override_left_to_mapper(self):
+        self.assertIsNone(self.match('/items/abc?_method=PUT'))
+        self.assertIsNone(self.match('/items', 'POST',
+                                     POST={'_method': 'PUT'}))
+
+    def test_unsupported_route(self):
+        mapper = routes.Mapper()
+        mapper.connect('/a/{name}', controller='a')
+        mapper.connect('/b/{id:\\d+}', controller='b')
+        mapper.connect('/c', controller='c')
+        mapper.connect('/b/c/{name}', controller='d')
+
+        # /c is tried after /b/{id:\d+} by the mapper
+        trie = RouteTrie(mapper)
+        self.assertEqual(len(trie), 2)
+        self.assertIsNone(trie.match(webob.Request.blank('/c').environ))
+
+    def test_route_order(self):
+        mapper = routes.Mapper()
+        mapper.connect('/a/{name}', controller='first')
+        mapper.connect('/a/b', controller='second')
+        mapper.connect('/{path:.*}', controller='third')
+        mapper.connect('/a/{other}', controller='fourth')
+        trie = RouteTrie(mapper)
+        for url in ['/a/b', '/a/c', '/b', '/a']:
+            environ = webob.Request.blank(url).environ
+            self.assertEqual(trie.match(environ)[0],
+                             mapper.match(environ=environ))
+
+    def test_router_environ(self):
+        index = Mock(return_value=webob.Response())
+
+        class Controller(WSGIController):
+            def index(self, request, **kwargs):
+                return index(request, **kwargs)
+
+        self.mapper.connect('ctl', '/ctl/{type:files|nodes}/{path_info:.*}',
+                            controller=Controller, action='index')
+        router = WSGIRouter(self.mapper)
+        request = webob.Request.blank('/ctl/files/a/b',
+                                      environ=dict(SCRIPT_NAME='/ztp'))
+        request.get_response(router)
+
+        request = index.call_args[0][0]
+        self.assertEqual(request.urlvars,
+                         dict(controller=Controller, action=u'index',
+                              type=u'files', path_info='a/b'))
+        self.assertEqual(request.environ['PATH_INFO'], '/a/b')
+        self.assertEqual(request.environ['SCRIPT_NAME'], '/ztp/ctl/files')
+        self.assertEqual(request.environ['routes.route'].name, 'ctl')
+
+
 if __name__ == '__main__':
     unittest.main()
 
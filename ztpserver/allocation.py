@@ -0,0 +1,452 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.allocation
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The allocation module stores the resource pools of the allocate
+        plugin.  A pool (a YAML file under DATA_ROOT/resources which maps
+        each resource to the unique_id of the node it is allocated to, or
+        to null) is loaded once and indexed in memory.  Allocations are
+        appended to a journal (DATA_ROOT/.journals/<pool>), which is
+        compacted back into the pool file every resource_journal_size
+        allocations, every resource_compact_interval seconds and when the
+        server stops.  Allocations are atomic across threads and processes.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import collections
+import errno
+import fcntl
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+from ztpserver.config import runtime
+from ztpserver.constants import CONTENT_TYPE_YAML
+from ztpserver.repository import file_signature
+from ztpserver.serializers import load, dumps
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+JOURNAL_DIR = '.journals'
+READ_SIZE = 1024 * 1024
+
+
+class ResourcePoolError(Exception):
+    ''' Raised when a resource pool cannot be loaded '''
+    pass
+
+
+def normalize(value):
+    return str(value) if value else None
+
+def journal_name(key):
+    return key if isinstance(key, basestring) else str(key)
+
+
+class ResourcePool(object):
+    ''' Indexed resource pool.
+
+    The pool keeps the resources in the order they are loaded, a reverse
+    index (node_id to resource) and a free-list of the unallocated
+    resources, so that an allocation costs O(1) instead of O(pool).  Each
+    allocation is appended to the journal of the pool as a JSON
+    [resource, node_id] record; when the journal holds
+    resource_journal_size records, the pool is written back to its YAML
+    file and the journal is truncated (with resource_journal_size = 0, the
+    pool file is written on every allocation).  The journal is also
+    compacted every resource_compact_interval seconds and when the server
+    stops (see compact_pools), so that the pool file does not lag the
+    journal for long.
+
+    The pool is loaded again when its file changes (e.g. it was edited or
+    compacted by another process).  Journal records are replayed on top
+    of the pool file only if the resource is still free and the node has
+    no resource yet, so that replaying them is idempotent.  A record whose
+    resource was assigned to another node in the meantime (i.e. the pool
+    file was edited before the journal was compacted) is dropped with a
+    warning.
+
+    Allocations are serialized, across the threads of a process and across
+    processes, by an exclusive flock() on the journal which is held from
+    the refresh of the pool until the allocation is written.  The pool file
+    is replaced atomically (temporary file and rename), so that it can be
+    read at any time without the lock.
+    '''
+
+    def __init__(self, data_root, pool):
+        self.pool = pool
+        self.filename = os.path.join(data_root, 'resources', pool)
+        self.journal = os.path.join(data_root, JOURNAL_DIR, pool)
+        self.lock = threading.Lock()
+
+        # resource -> node_id (or None), in load order
+        self.entries = None
+        # node_id -> resource
+        self.index = None
+        # free resources, in load order (allocated ones are skipped lazily)
+        self.free = None
+        # str(resource) -> resource, for the resources which are not strings
+        self.names = None
+        self.signature = None
+
+        # (device, inode) of the journal, bytes and records replayed
+        self.journal_id = None
+        self.offset = 0
+        self.records = 0
+        self.partial = False
+
+        self.allocations = 0
+        self.hits = 0
+        self.loads = 0
+        self.compactions = 0
+
+    def __repr__(self):
+        return 'ResourcePool(filename=%s, allocations=%d, hits=%d)' % \
+               (self.filename, self.allocations, self.hits)
+
+    def stats(self):
+        ''' Returns the pool counters as a dict '''
+        with self.lock:
+            return dict(entries=len(self.entries or ()),
+                        allocated=len(self.index or ()),
+                        allocations=self.allocations,
+                        hits=self.hits,
+                        loads=self.loads,
+                        compactions=self.compactions,
+                        journal=self.records)
+
+    def _load(self, signature, fd):
+        contents = load(self.filename, CONTENT_TYPE_YAML, self.pool)
+        if not contents or not isinstance(contents, dict):
+            raise ResourcePoolError(contents or 'empty pool')
+
+        entries = collections.OrderedDict()
+        index = dict()
+        free = collections.deque()
+        for key, value in contents.iteritems():
+            value = normalize(value)
+            entries[key] = value
+            if value is None:
+                free.append(key)
+            elif value not in index:
+                index[value] = key
+
+        self.entries = entries
+        self.index = index
+        self.free = free
+        self.names = None
+        self.signature = signature
+        self.journal_id = None
+        self.offset = 0
+        self.records = 0
+        self.loads += 1
+        log.debug('%s: loaded resource pool with %d entries',
+                  self.pool, len(entries))
+        self._replay(fd)
+
+    def _key(self, name):
+        if name in self.entries:
+            return name
+        if self.names is None:
+            self.names = dict((journal_name(key), key)
+                              for key in self.entries
+                              if not isinstance(key, basestring))
+        return self.names.get(name)
+
+    def _apply(self, line):
+        try:
+            (name, node_id) = json.loads(line)
+            node_id = str(node_id)
+        except (ValueError, TypeError):
+            log.warning('%s: ignoring invalid journal record %r',
+                        self.pool, line)
+            return
+
+        key = self._key(name)
+        if key is None or node_id in self.index:
+            return
+        if self.entries[key] is not None:
+            if self.entries[key] != node_id:
+                log.warning('%s: dropping journaled allocation of %s to %s '
+                            '(allocated to %s in the pool file)',
+                            self.pool, name, node_id, self.entries[key])
+            return
+        self.entries[key] = node_id
+        self.index[node_id] = key
+
+    def _replay(self, fd):
+        ''' Applies the journal records written since the last replay '''
+        info = os.fstat(fd)
+        journal_id = (info.st_dev, info.st_ino)
+        if journal_id != self.journal_id or info.st_size < self.offset:
+            # new journal: records are idempotent, replay it all
+            self.journal_id = journal_id
+            self.offset = 0
+            self.records = 0
+        if info.st_size == self.offset:
+            return
+
+        os.lseek(fd, self.offset, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(fd, READ_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        data = ''.join(chunks)
+
+        # a partial record (e.g. the server crashed while writing it) is
+        # ignored and terminated by the next record
+        end = data.rfind('\n') + 1
+        for line in data[:end].splitlines():
+            if line:
+                self._apply(line)
+                self.records += 1
+        self.offset += end
+        self.partial = end < len(data)
+
+    def _refresh(self, fd):
+        signature = file_signature(self.filename)
+        if self.entries is None or signature != self.signature:
+            self._load(signature, fd)
+        else:
+            self._replay(fd)
+
+    def _append(self, fd, key, node_id):
+        record = json.dumps([journal_name(key), node_id]) + '\n'
+        if self.partial:
+            record = '\n' + record
+        os.write(fd, record)
+        self.offset = os.fstat(fd).st_size
+        self.partial = False
+        self.records += 1
+
+    def _dump(self):
+        ''' Replaces the pool file with the contents of the pool '''
+        directory = os.path.dirname(self.filename)
+        mode = stat.S_IMODE(os.stat(self.filename).st_mode)
+        contents = dumps(self.entries, CONTENT_TYPE_YAML, self.pool)
+
+        (fd, tmp_filename) = tempfile.mkstemp(dir=directory,
+                                              prefix='.%s.' %
+                                              os.path.basename(self.pool))
+        try:
+            with os.fdopen(fd, 'w') as fhandler:
+                fhandler.write(contents)
+                fhandler.flush()
+                os.fsync(fhandler.fileno())
+            os.chmod(tmp_filename, mode)
+            os.rename(tmp_filename, self.filename)
+        except Exception:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+
+    def _compact(self, fd):
+        ''' Writes the pool back to its file and truncates the journal '''
+        self._dump()
+        os.ftruncate(fd, 0)
+        self.signature = file_signature(self.filename)
+        self.offset = 0
+        self.records = 0
+        self.partial = False
+        self.compactions += 1
+        log.debug('%s: compacted resource pool', self.pool)
+
+    def _lock(self):
+        ''' Returns the journal of the pool (created if needed), opened
+        and exclusively locked; the lock is released when it is closed
+        '''
+        try:
+            os.makedirs(os.path.dirname(self.journal))
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+
+        while True:
+            fd = os.open(self.journal,
+                         os.O_RDWR | os.O_APPEND | os.O_CREAT, 0644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # the journal may have been removed (--clear-resources)
+                # while waiting for the lock
+                locked = os.fstat(fd)
+                current = file_signature(self.journal)
+                if current is not None and current[0] == locked.st_ino:
+                    return fd
+            except Exception:
+                os.close(fd)
+                raise
+            os.close(fd)
+
+    def _write(self, fd, key, node_id):
+        size = runtime.default.resource_journal_size
+        if size and self.records + 1 < size:
+            self._append(fd, key, node_id)
+            start_compactor()
+        else:
+            self._compact(fd)
+
+    def compact(self):
+        ''' Writes the journaled allocations (of all the processes) back to
+        the pool file and truncates the journal
+
+        :raises: ResourcePoolError, SerializerError, OSError, IOError
+        '''
+        with self.lock:
+            if self.entries is None or not os.path.exists(self.filename):
+                return
+            fd = self._lock()
+            try:
+                self._refresh(fd)
+                if self.records or self.partial:
+                    self._compact(fd)
+            finally:
+                os.close(fd)
+
+    def allocate(self, node_id):
+        ''' Returns the resource allocated to node_id, allocating the first
+        free resource of the pool if it has none, or None if the pool is
+        full.
+
+        The pool is locked (by the threads of this process and by the
+        other processes) from the time it is refreshed until the
+        allocation is written, so that a resource is never allocated
+        twice.
+
+        :raises: ResourcePoolError, SerializerError, OSError, IOError
+        '''
+        with self.lock:
+            fd = self._lock()
+            try:
+                return self._allocate(fd, node_id)
+            finally:
+                os.close(fd)
+
+    def _allocate(self, fd, node_id):
+        self._refresh(fd)
+
+        key = self.index.get(node_id)
+        if key is not None:
+            self.hits += 1
+            return key
+
+        free = self.free
+        while free and self.entries[free[0]] is not None:
+            free.popleft()
+        if not free:
+            return None
+
+        key = free.popleft()
+        self.entries[key] = node_id
+        try:
+            self._write(fd, key, node_id)
+        except Exception:
+            self.entries[key] = None
+            free.appendleft(key)
+            raise
+        self.index[node_id] = key
+        self.allocations += 1
+        return key
+
+
+POOLS = dict()
+POOLS_LOCK = threading.Lock()
+
+def resource_pool(data_root, pool):
+    ''' Returns the (process-wide) resource pool pool of data_root '''
+    key = (data_root, pool)
+    with POOLS_LOCK:
+        if key not in POOLS:
+            POOLS[key] = ResourcePool(data_root, pool)
+        return POOLS[key]
+
+def compact_pools():
+    ''' Compacts the journals of the resource pools used by this process,
+    e.g. when the server stops
+    '''
+    with POOLS_LOCK:
+        pools = POOLS.values()
+    for pool in pools:
+        try:
+            pool.compact()
+        except Exception as err:            #pylint: disable=W0703
+            log.warning('%s: failed to compact resource pool (%s)',
+                        pool.pool, err)
+
+compactor = None    #pylint: disable=C0103
+
+def run_compactor():
+    while True:
+        interval = runtime.default.resource_compact_interval
+        if not interval:
+            return
+        time.sleep(interval)
+        compact_pools()
+
+def start_compactor():
+    ''' Starts the thread compacting the resource pools every
+    resource_compact_interval seconds (once per process)
+    '''
+    global compactor        #pylint: disable=W0603,C0103
+    if not runtime.default.resource_compact_interval:
+        return
+    with POOLS_LOCK:
+        if compactor is None or not compactor.is_alive():
+            compactor = threading.Thread(target=run_compactor,
+                                         name='resource-compactor')
+            compactor.daemon = True
+            compactor.start()
+
+def clear_journals(data_root):
+    ''' Removes the allocation journals of the resource pools of data_root,
+    e.g. after freeing all the resources
+    '''
+    path = os.path.join(data_root, JOURNAL_DIR)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
@@ -38,18 +38,24 @@ import logging
 import os
 import re
 import sys
-
-from wsgiref.simple_server import make_server
-
+import time
 
 from ztpserver import config, controller
 
 from ztpserver.serializers import load, dump
 from ztpserver.validators import NeighbordbValidator
-from ztpserver.constants import CONTENT_TYPE_YAML
-from ztpserver.topology import FUNC_RE, neighbordb_path
+from ztpserver.constants import CONTENT_TYPE_PYTHON, CONTENT_TYPE_YAML
+from ztpserver.repository import create_repository
+from ztpserver.repository import RepositoryError, FileObjectError
+from ztpserver.topology import FUNC_RE, neighbordb_path, load_neighbordb
+from ztpserver.topology import create_neighbordb_snapshot
+from ztpserver.topology import neighbordb_snapshot_path
 from ztpserver.utils import all_files
 from ztpserver.resources import resource_plugins
+from ztpserver.allocation import clear_journals, compact_pools
+from ztpserver.warmup import start_warmup, stop_warmup
+from ztpserver.metrics import MetricsMiddleware, metrics
+from ztpserver.server import serve
 
 log = logging.getLogger('ztpserver')
 log.setLevel(logging.DEBUG)
@@ -103,7 +109,24 @@ def load_config(conf=None):
         log.info('Loading config file: %s' % conf)
         config.runtime.read(conf)
 
-def start_wsgiapp(config_file=None, debug=False):
+def warm_up_caches():
+    ''' Loads neighbordb and the bootstrap script into the caches of the
+    current (server) process
+    '''
+    start = time.time()
+    load_neighbordb('warm-up')
+
+    filename = os.path.join('bootstrap', config.runtime.bootstrap.filename)
+    try:
+        create_repository(config.runtime.default.data_root). \
+            get_file(filename).read(CONTENT_TYPE_PYTHON)
+    except (RepositoryError, FileObjectError) as err:
+        log.warning('Unable to load bootstrap script: %s' % err)
+
+    log.info('Caches warmed up in %.2fs (pid %d)' %
+             (time.time() - start, os.getpid()))
+
+def start_wsgiapp(config_file=None, debug=False, warmup=True):
     ''' Provides the entry point into the application for wsgi compliant
     servers.   Accepts an optional argument ``config_file``.   The
     ``config_file`` keyword argument specifies the path the server
@@ -111,6 +134,7 @@ def start_wsgiapp(config_file=None, debug=False):
 
     :param config_file: string path pointing to configuration file
     :param debug: boolean set debug level logging? (Default: False)
+    :param warmup: start the digest warm-up, if enabled (Default: True)
     :return: a wsgi application object
 
     '''
@@ -130,7 +154,14 @@ def start_wsgiapp(config_file=None, debug=False):
     if not python_supported():
         raise SystemExit('ERROR: ZTPServer requires Python 2.7')
 
-    return controller.Router()
+    if warmup:
+        start_warmup()
+
+    app = controller.Router()
+    if config.runtime.metrics.enabled:
+        log.info('Serving metrics at /metrics')
+        app = MetricsMiddleware(app)
+    return app
 
 def run_server(version, config_file, debug):
     ''' The :py:func:`run_server` is called by the main command line routine to
@@ -141,22 +172,41 @@ def run_server(version, config_file, debug):
 
     :param conf: string path pointing to configuration file
     '''
-    app = start_wsgiapp(config_file, debug)
+    # the digest warm-up thread is started once the workers are forked (in
+    # a helper process, in prefork mode)
+    app = start_wsgiapp(config_file, debug, warmup=False)
 
     host = config.runtime.server.interface
     port = config.runtime.server.port
 
     log.info('URL: http://%s:%s' % (host, port))
 
-    httpd = make_server(host, port, app)
-
     log.info('Starting ZTPServer v%s on http://%s:%s' % 
              (version, host, port))
 
+    def on_ready():
+        start_warmup()
+        if config.runtime.metrics.enabled:
+            # in prefork mode, the helper process running the digest
+            # warm-up reports the digest queue depth
+            metrics.start()
+
+    def on_stop():
+        stop_warmup()
+        metrics.stop()
+
+    if config.runtime.metrics.enabled:
+        metrics.clear_directory()
+
+    warm_up = warm_up_caches if config.runtime.server.warm_up else None
     try:
-        httpd.serve_forever()
+        # the journaled allocations are written back to the resource
+        # files by each server process when it stops
+        serve(app, host, port, warm_up=warm_up, on_ready=on_ready,
+              on_stop=on_stop, on_exit=compact_pools)
     except KeyboardInterrupt:
-        log.info('Shutdown...')
+        pass
+    log.info('Shutdown...')
 
 def validate_neighbordb():
     # Validating neighbordb
@@ -180,9 +230,19 @@ def validate_neighbordb():
                 print '   [%d] %s' % (index, pattern[1])
         else:
             print 'Ok!'            
+            if config.runtime.neighbordb.snapshot:
+                write_neighbordb_snapshot()
     except Exception as exc:        #pylint: disable=W0703
         print 'ERROR: Failed to validate neighbordb\n%s' % exc
 
+def write_neighbordb_snapshot():
+    print 'Writing neighbordb snapshot (\'%s\')...' % \
+        neighbordb_snapshot_path(),
+    if create_neighbordb_snapshot('validator'):
+        print 'Ok!'
+    else:
+        print '\nERROR: Failed to write neighbordb snapshot'
+
 def validate_definitions():
     data_root = config.runtime.default.data_root
 
@@ -291,6 +351,14 @@ def clear_resources(debug):
         except Exception as exc:        #pylint: disable=W0703            
             print '\nERROR: Failed to clear %s\n%s' % \
                 (resource, exc)
+
+    # the journaled allocations would be replayed on top of the cleared pools
+    print 'Clearing allocation journals...',
+    try:
+        clear_journals(data_root)
+        print 'Ok!'
+    except Exception as exc:            #pylint: disable=W0703
+        print '\nERROR: Failed to clear the allocation journals\n%s' % exc
     
 def run_validator(debug):
     start_logging(debug)
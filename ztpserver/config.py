@@ -322,6 +322,41 @@ runtime.add_attribute(BoolAttr(
     default=False
 ))
 
+runtime.add_attribute(IntAttr(
+    name='file_cache_size',
+    min_value=0,
+    default=16777216,
+    environ='ZTPS_DEFAULT_FILE_CACHE_SIZE'
+))
+
+runtime.add_attribute(IntAttr(
+    name='definition_cache_size',
+    min_value=0,
+    default=4096,
+    environ='ZTPS_DEFAULT_DEFINITION_CACHE_SIZE'
+))
+
+runtime.add_attribute(IntAttr(
+    name='resource_journal_size',
+    min_value=0,
+    default=1000,
+    environ='ZTPS_DEFAULT_RESOURCE_JOURNAL_SIZE'
+))
+
+runtime.add_attribute(IntAttr(
+    name='resource_compact_interval',
+    min_value=0,
+    default=60,
+    environ='ZTPS_DEFAULT_RESOURCE_COMPACT_INTERVAL'
+))
+
+runtime.add_attribute(IntAttr(
+    name='log_payload_size',
+    min_value=0,
+    default=4096,
+    environ='ZTPS_DEFAULT_LOG_PAYLOAD_SIZE'
+))
+
 # Group: server
 runtime.add_attribute(StrAttr(
     name='interface',
@@ -337,6 +372,61 @@ runtime.add_attribute(IntAttr(
     default=8080
 ))
 
+runtime.add_attribute(StrAttr(
+    name='mode',
+    group='server',
+    choices=['single', 'threaded', 'prefork'],
+    default='single',
+    environ='ZTPS_SERVER_MODE'
+))
+
+runtime.add_attribute(IntAttr(
+    name='workers',
+    group='server',
+    min_value=1,
+    default=4
+))
+
+runtime.add_attribute(IntAttr(
+    name='threads',
+    group='server',
+    min_value=1,
+    default=16
+))
+
+runtime.add_attribute(BoolAttr(
+    name='keepalive',
+    group='server',
+    default=True
+))
+
+runtime.add_attribute(IntAttr(
+    name='keepalive_timeout',
+    group='server',
+    min_value=1,
+    default=5
+))
+
+runtime.add_attribute(IntAttr(
+    name='backlog',
+    group='server',
+    min_value=1,
+    default=128
+))
+
+runtime.add_attribute(IntAttr(
+    name='shutdown_timeout',
+    group='server',
+    min_value=0,
+    default=30
+))
+
+runtime.add_attribute(BoolAttr(
+    name='warm_up',
+    group='server',
+    default=True
+))
+
 
 # Group: bootstrap
 runtime.add_attribute(StrAttr(
@@ -353,3 +443,82 @@ runtime.add_attribute(StrAttr(
     default='neighbordb',
     environ='ZTPS_NEIGHBORDB_FILENAME'
 ))
+
+runtime.add_attribute(BoolAttr(
+    name='snapshot',
+    group='neighbordb',
+    default=False,
+    environ='ZTPS_NEIGHBORDB_SNAPSHOT'
+))
+
+# Group: warmup
+runtime.add_attribute(BoolAttr(
+    name='enabled',
+    group='warmup',
+    default=False,
+    environ='ZTPS_WARMUP_ENABLED'
+))
+
+runtime.add_attribute(IntAttr(
+    name='workers',
+    group='warmup',
+    min_value=1,
+    default=2
+))
+
+runtime.add_attribute(IntAttr(
+    name='niceness',
+    group='warmup',
+    min_value=0,
+    max_value=19,
+    default=10
+))
+
+runtime.add_attribute(IntAttr(
+    name='interval',
+    group='warmup',
+    min_value=0,
+    default=0
+))
+
+# Group: metrics
+runtime.add_attribute(BoolAttr(
+    name='enabled',
+    group='metrics',
+    default=False,
+    environ='ZTPS_METRICS_ENABLED'
+))
+
+runtime.add_attribute(StrAttr(
+    name='directory',
+    group='metrics',
+    environ='ZTPS_METRICS_DIRECTORY'
+))
+
+runtime.add_attribute(IntAttr(
+    name='flush_interval',
+    group='metrics',
+    min_value=1,
+    default=1
+))
+
+# Group: tracing
+runtime.add_attribute(StrAttr(
+    name='filename',
+    group='tracing',
+    environ='ZTPS_TRACING_FILENAME'
+))
+
+runtime.add_attribute(IntAttr(
+    name='max_bytes',
+    group='tracing',
+    min_value=0,
+    default=10485760
+))
+
+runtime.add_attribute(IntAttr(
+    name='backup_count',
+    group='tracing',
+    min_value=0,
+    default=5
+))
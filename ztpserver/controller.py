@@ -36,23 +36,33 @@ import logging
 import os
 import routes
 import subprocess
+import threading
+import webob
 
 from string import Template
 from subprocess import PIPE
-from webob.static import FileApp
+from webob.static import FileIter
 
 from ztpserver.constants import HTTP_STATUS_NOT_FOUND, HTTP_STATUS_CREATED
 from ztpserver.constants import HTTP_STATUS_BAD_REQUEST, HTTP_STATUS_CONFLICT
 from ztpserver.constants import HTTP_STATUS_INTERNAL_SERVER_ERROR
+from ztpserver.constants import HTTP_STATUS_OK
 from ztpserver.constants import CONTENT_TYPE_JSON, CONTENT_TYPE_PYTHON
 from ztpserver.constants import CONTENT_TYPE_YAML, CONTENT_TYPE_OTHER
 
-from ztpserver.repository import create_repository
+from ztpserver.definitions import definition_cache, plan_cache
+from ztpserver.definitions import Dependencies
+from ztpserver.repository import create_repository, file_signature
+from ztpserver.repository import file_cache, digest_index
+from ztpserver.repository import DIGEST_ALGORITHMS
 from ztpserver.repository import FileObjectNotFound, FileObjectError
-from ztpserver.serializers import SerializerError
+from ztpserver.serializers import SerializerError, dumps
 from ztpserver.topology import create_node, load_pattern
-from ztpserver.topology import load_neighbordb, load_resources
-from ztpserver.topology import replace_config_action
+from ztpserver.topology import load_neighbordb, compile_actions
+from ztpserver.topology import DefinitionPlan
+from ztpserver.topology import replace_config_action, neighbordb_cache
+from ztpserver.tracing import tracer
+from ztpserver.utils import LogPayload
 from ztpserver.wsgiapp import WSGIController, WSGIRouter
 from ztpserver.config import runtime
 
@@ -65,6 +75,12 @@ NODE_FN = '.node'
 ATTRIBUTES_FN = 'attributes'
 BOOTSTRAP_CONF = 'bootstrap.conf'
 
+FILE_WRAPPER_BLOCK_SIZE = 1024 * 1024
+
+# digests computed by /meta requests (client/bootstrap checks the sha1);
+# the other digests are computed in the background
+META_DIGESTS = ('sha1',)
+
 log = logging.getLogger(__name__)    # pylint: disable=C0103
 
 
@@ -77,9 +93,13 @@ class BaseController(WSGIController):
 
     FOLDER = None
 
-    def __init__(self, **kwargs):
-        self.data_root = runtime.default.data_root
-        self.repository = create_repository(self.data_root)
+    def __init__(self, context=None, **kwargs):
+        if context is None:
+            self.data_root = runtime.default.data_root
+            self.repository = create_repository(self.data_root)
+        else:
+            self.data_root = context.data_root
+            self.repository = context.repository
         super(BaseController, self).__init__()
 
     def expand(self, *args, **kwargs):
@@ -106,6 +126,72 @@ class BaseController(WSGIController):
         return dict(body='', content_type='text/html',
                     status=HTTP_STATUS_INTERNAL_SERVER_ERROR)
 
+    def file_response(self, request, fobj, content_type, stream=True):
+        ''' Returns the response for a file in the repository
+
+        The response carries a strong ETag (the SHA1 digest of the file)
+        and a Last-Modified header and answers conditional (If-None-Match,
+        If-Modified-Since) and ranged (Range, If-Range) requests.  If stream
+        is True, the file is streamed from disk (through the server's
+        wsgi.file_wrapper, if any, for non-ranged requests); otherwise its
+        contents are read through the repository.
+
+        Files are never hashed on the request path: until the digest of a
+        file is indexed, it is served without an ETag and hashed in the
+        background.
+
+        :raises: IOError, FileObjectError
+        '''
+        filename = fobj.name
+        fhandler = None
+        try:
+            if stream:
+                fhandler = open(filename, 'rb')
+                stat = os.fstat(fhandler.fileno())
+                signature = (stat.st_ino, stat.st_mtime, stat.st_size)
+
+                file_wrapper = request.environ.get('wsgi.file_wrapper')
+                if file_wrapper is not None and not request.range:
+                    app_iter = file_wrapper(fhandler,
+                                            FILE_WRAPPER_BLOCK_SIZE)
+                else:
+                    app_iter = FileIter(fhandler)
+                response = webob.Response(app_iter=app_iter,
+                                          content_length=stat.st_size)
+            else:
+                signature = file_signature(filename)
+                response = webob.Response(body=fobj.read(content_type))
+
+            response.content_type = content_type
+            response.accept_ranges = 'bytes'
+            response.conditional_response = True
+
+            try:
+                digests = self.repository.cached_digests(filename,
+                                                         ('sha1',))
+            except (IOError, OSError) as err:
+                log.warning('Unable to look up the digests of %s: %s',
+                            filename, err)
+                digests = None
+            if digests is None and signature is not None:
+                # not indexed yet (e.g. before the digest warm-up reached
+                # it) - hashing a large image here would outlast the
+                # client's timeout
+                self.repository.schedule_digests(filename)
+        except Exception:
+            # the response (and the file it streams) is not returned
+            if fhandler is not None:
+                fhandler.close()
+            raise
+
+        # only validate the response if it matches the file on disk
+        if signature is not None and \
+           signature == file_signature(filename):
+            response.last_modified = signature[1]
+            if digests is not None and signature[2] == digests['size']:
+                response.etag = digests['sha1']
+        return response
+
 
 class FilesController(BaseController):
 
@@ -116,17 +202,21 @@ class FilesController(BaseController):
 
     def show(self, request, resource, **kwargs):
         ''' Handles GET /files/{resource} '''
-        log.debug('%s\nResource: %s\n' % (request, resource))
+        log.debug('%s\nResource: %s\n', LogPayload(request), resource)
 
         try:
             urlvars = request.urlvars
             if urlvars.get('format') is not None:
                 resource += '.%s' % urlvars.get('format')
             file_path = self.expand(resource)
-            filename = self.repository.get_file(file_path).name
-            return FileApp(filename, content_type=CONTENT_TYPE_OTHER)
+            return self.file_response(request,
+                                      self.repository.get_file(file_path),
+                                      CONTENT_TYPE_OTHER)
         except FileObjectNotFound:
-            log.error('File %s not found' % resource)
+            log.error('File %s not found', resource)
+            return self.http_not_found()
+        except IOError as err:
+            log.error('Unable to read file %s: %s', resource, err)
             return self.http_not_found()
 
 
@@ -139,14 +229,15 @@ class ActionsController(BaseController):
 
     def show(self, request, resource, **kwargs):
         ''' Handles GET /actions/{resource} '''
-        log.debug('%s\nResource: %s\n' % (request, resource))
+        log.debug('%s\nResource: %s\n', LogPayload(request), resource)
 
         try:
             file_path = self.expand(resource)
-            body = self.repository.get_file(file_path).read(CONTENT_TYPE_PYTHON)
-            return dict(body=body, content_type=CONTENT_TYPE_PYTHON)
+            return self.file_response(request,
+                                      self.repository.get_file(file_path),
+                                      CONTENT_TYPE_PYTHON, stream=False)
         except FileObjectNotFound:
-            log.error('Action %s not found' % resource)
+            log.error('Action %s not found', resource)
             return self.http_not_found()
 
 
@@ -159,47 +250,53 @@ class NodesController(BaseController):
 
 
     def fsm(self, state, **kwargs):
-        ''' Execute the FSM for the request '''
+        ''' Execute the FSM for the request
+
+        Each state runs in a 'state' span of the request's trace (see
+        :py:mod:`ztpserver.tracing`), which is written when the FSM is done.
+        '''
 
         response = dict()
+        tracer.start(kwargs['node_id'], kwargs.get('request'))
         try:
             while state != None:
                 method = getattr(self, state)
                 prev_state = state
-                log.debug('%s: running %s' % (kwargs['node_id'], state))
-                (response, state) = method(response, **kwargs)
+                log.debug('%s: running %s', kwargs['node_id'], state)
+                with tracer.span('state', state):
+                    (response, state) = method(response, **kwargs)
         except ValidationError:            # pylint: disable=W0703
-            log.error('%s: validation error in %s' %
-                      (kwargs['node_id'], prev_state))
+            log.error('%s: validation error in %s',
+                      kwargs['node_id'], prev_state)
             response = self.http_bad_request()
         except Exception as err:            # pylint: disable=W0703
-            log.error('%s: error in %s: %s' %
-                      (kwargs['node_id'], prev_state, str(err)))
+            log.error('%s: error in %s: %s',
+                      kwargs['node_id'], prev_state, str(err))
             response = self.http_bad_request()
+        finally:
+            tracer.finish(response.get('status', HTTP_STATUS_OK))
 
-        log.debug('%s: response to %s: %s' %
-                  (kwargs['node_id'], prev_state, response))
+        log.debug('%s: response to %s: %s',
+                  kwargs['node_id'], prev_state, LogPayload(response))
         return response                     # pylint: disable=W0150
 
     #-------------------------------------------------------------------
 
     def get_config(self, request, resource, **kwargs):
-        log.debug('%s: node resource GET request: \n%s\n' %
-                  (resource, request))
-
-        response = dict()
+        log.debug('%s: node resource GET request: \n%s\n',
+                  resource, LogPayload(request))
 
         try:
             filename = self.expand(resource, STARTUP_CONFIG_FN)
-            response['body'] = self.repository.get_file(filename).read()
-            response['content_type'] = CONTENT_TYPE_OTHER
+            response = self.file_response(request,
+                                          self.repository.get_file(filename),
+                                          CONTENT_TYPE_OTHER, stream=False)
         except FileObjectNotFound:
-            log.error('%s: missing startup-config file %s' %
-                      (resource, filename))
+            log.error('%s: missing startup-config file %s', resource, filename)
             response = self.http_bad_request()
         except Exception as err:
-            log.error('%s: unable to retrieve startup-config (%s)' %
-                      (resource, err))
+            log.error('%s: unable to retrieve startup-config (%s)',
+                      resource, err)
             response = self.http_bad_request()
 
         return response
@@ -209,8 +306,8 @@ class NodesController(BaseController):
     def put_config(self, request, **kwargs):
         node_id = kwargs['resource']
 
-        log.debug('%s: startup-config PUT request: \n%s\n' %
-                  (node_id, request))
+        log.debug('%s: startup-config PUT request: \n%s\n',
+                  node_id, LogPayload(request))
 
         fobj = None
         try:
@@ -219,15 +316,13 @@ class NodesController(BaseController):
             filename = self.expand(node_id, STARTUP_CONFIG_FN)
             fobj = self.repository.get_file(filename)
         except FileObjectNotFound:
-            log.debug('%s: file not found: %s (adding it)' %
-                      (node_id, filename))
+            log.debug('%s: file not found: %s (adding it)', node_id, filename)
             fobj = self.repository.add_file(filename)
         finally:
             if fobj:
                 fobj.write(body, content_type)
             else:
-                log.error('%s: unable to write %s' %
-                          (node_id, filename))
+                log.error('%s: unable to write %s', node_id, filename)
                 return self.http_bad_request()
 
         # Execute event-handler
@@ -241,16 +336,15 @@ class NodesController(BaseController):
             (out, err) = proc.communicate()
             if code or err:
                 log.warn('Startup-config saved for %s '
-                         '(%s failed: return code=%s, stderr=%s)' %
-                         (node_id, script, code, err))
-                log.debug('%s output: \n%s' % (script, out))
+                         '(%s failed: return code=%s, stderr=%s)',
+                         node_id, script, code, err)
+                log.debug('%s output: \n%s', script, LogPayload(out))
             else:
                 log.info('Startup-config saved for %s '
-                         '(%s executed successfully)' %
-                         (node_id, script))
-                log.debug('%s output: \n%s' % (script, out))
+                         '(%s executed successfully)', node_id, script)
+                log.debug('%s output: \n%s', script, LogPayload(out))
         else:
-            log.info('Startup-config saved for %s (no config-handler)' %
+            log.info('Startup-config saved for %s (no config-handler)',
                      node_id)
 
         return {}
@@ -273,26 +367,27 @@ class NodesController(BaseController):
             create a WSGI response object.
 
         """
-        log.info('%s: received system information from node:\n%s' %
-                 (request.remote_addr, request.json))
+        log.info('%s: received system information from node:\n%s',
+                 request.remote_addr, LogPayload(request.body))
 
         try:
             node = create_node(request.json)
         except Exception as err:       # pylint: disable=W0703
-            log.error('Unable to create node: %s (request=%s)' % (err, request))
+            log.error('Unable to create node: %s (request=%s)',
+                      err, LogPayload(request))
             response = self.http_bad_request()
             return self.response(**response)
 
         node_id = node.identifier()
         if not node_id:
-            log.error('Missing node identifier: %s (request=%s)' %
-                      (node, request))
+            log.error('Missing node identifier: %s (request=%s)',
+                      node, LogPayload(request))
             response = self.http_bad_request()
             return self.response(**response)
 
         identifier = runtime.default.identifier
-        log.info('%s: node ID is %s:%s' %
-                 (request.remote_addr, identifier, node_id))
+        log.info('%s: node ID is %s:%s',
+                 request.remote_addr, identifier, node_id)
 
         return self.fsm('node_exists', request=request,
                         node=node, node_id=node_id)
@@ -321,13 +416,13 @@ class NodesController(BaseController):
 
         if self.repository.exists(self.expand(node_id, DEFINITION_FN)) or \
            self.repository.exists(self.expand(node_id, STARTUP_CONFIG_FN)):
-            log.info('%s: this node already exists on the server' % node_id)
+            log.info('%s: this node already exists on the server', node_id)
             response['status'] = HTTP_STATUS_CONFLICT
             next_state = 'dump_node'
         else:
             if self.repository.exists(self.expand(node_id)):
                 log.error('%s: node found on server, but no definition '
-                          'or startup-config configured' % node_id)
+                          'or startup-config configured', node_id)
                 return (self.http_bad_request(), None)
 
         return (response, next_state)
@@ -350,7 +445,7 @@ class NodesController(BaseController):
             # POST request for the node - will try to match neighbordb
             next_state = 'post_node'
             log.info('%s: node does not exist on the server - '
-                     'will try to match node against neighbordb' %
+                     'will try to match node against neighbordb',
                      kwargs['node_id'])
         else:
             # POST request for the node's startup-config
@@ -394,41 +489,39 @@ class NodesController(BaseController):
         node = kwargs['node']
         node_id = kwargs['node_id']
 
-        neighbordb = load_neighbordb(node_id)
+        with tracer.span('neighbordb', 'load'):
+            neighbordb = load_neighbordb(node_id)
         if not neighbordb:
             return (self.http_bad_request(), None)
 
         # pylint: disable=E1103
-        matches = neighbordb.match_node(node)
+        with tracer.span('neighbordb', 'match'):
+            matches = neighbordb.match_node(node, first_match=True)
         if not matches:
-            log.info('%s: node matched no patterns in neighbordb' %
-                     node_id)
+            log.info('%s: node matched no patterns in neighbordb', node_id)
             return (self.http_bad_request(), None)
 
-        log.debug('%s: %d pattern(s) in neihgbordb are a good match' %
-                  (node_id, len(matches)))
         match = matches[0]
 
-        log.info('%s: node matched \'%s\' pattern in neighbordb' %
-                 (node_id, match.name))
+        log.info('%s: node matched \'%s\' pattern in neighbordb',
+                 node_id, match.name)
 
         # Load definition
         try:
             definition_url = self.expand(match.definition,
                                          folder='definitions')
             fobj = self.repository.get_file(definition_url)
-            log.info('%s: node definition copied from: %s' %
-                     (node_id, definition_url))
+            log.info('%s: node definition copied from: %s',
+                     node_id, definition_url)
         except FileObjectNotFound:
-            log.error('%s: failed to find definition (%s)' %
-                      (node_id, definition_url))
+            log.error('%s: failed to find definition (%s)',
+                      node_id, definition_url)
             raise
 
         try:
             definition = fobj.read(content_type=CONTENT_TYPE_YAML)
         except FileObjectError:
-            log.error('%s: failed to load definition' %
-                      (node_id))
+            log.error('%s: failed to load definition', node_id)
             raise
 
         definition_fn = self.expand(node_id, DEFINITION_FN)
@@ -439,18 +532,17 @@ class NodesController(BaseController):
                 config_handler_url = self.expand(match.config_handler,
                                                  folder='config-handlers')
                 fobj = self.repository.get_file(config_handler_url)
-                log.info('%s: node config-handler copied from: %s' %
-                         (node_id, config_handler_url))
+                log.info('%s: node config-handler copied from: %s',
+                         node_id, config_handler_url)
             except FileObjectNotFound:
-                log.error('%s: failed to find config-handler (%s)' %
-                          (node_id, config_handler_url))
+                log.error('%s: failed to find config-handler (%s)',
+                          node_id, config_handler_url)
                 raise
 
             try:
                 config_handler = fobj.read(content_type=CONTENT_TYPE_OTHER)
             except FileObjectError:
-                log.error('%s: failed to load config-handler' %
-                          (node_id))
+                log.error('%s: failed to load config-handler', node_id)
                 raise
 
             config_handler_fn = self.expand(node_id, CONFIG_HANDLER_FN)
@@ -458,8 +550,8 @@ class NodesController(BaseController):
         # Create node folder
         self.repository.add_folder(self.expand(node_id))
 
-        log.info('%s: new dynamically-provisioned node created: /nodes/%s' %
-                 (node_id, node_id))
+        log.info('%s: new dynamically-provisioned node created: /nodes/%s',
+                 node_id, node_id)
 
         # Add definition
         fobj = self.repository.add_file(definition_fn)
@@ -516,8 +608,8 @@ class NodesController(BaseController):
         finally:
             fobj.write(contents, CONTENT_TYPE_JSON)
 
-        log.info('%s: node data written to %s:\n%s' %
-                 (node_id, filename, contents))
+        log.info('%s: node data written to %s:\n%s',
+                 node_id, filename, LogPayload(contents))
 
         return (response, 'set_location')
 
@@ -551,36 +643,72 @@ class NodesController(BaseController):
 
         Returns:
             A dict as the result of the state machine which is used to
-            create a WSGI response object.
-
+            create a WSGI response object, or the response served from
+            the definition cache.
+
+        The rendered definition is cached along with the signatures of
+        the node files and of the files of the resource plugins it ran,
+        and served without running the state machine until one of them
+        changes.  Definitions which ran a plugin which is not declared
+        idempotent are not cached.
         """
-        log.info('%s: received request for definition: %s' %
-                 (resource, request.url))
-        log.debug('%s\nResource: %s\n' % (request, resource))
+        log.info('%s: received request for definition: %s',
+                 resource, request.url)
+        log.debug('%s\nResource: %s\n', LogPayload(request), resource)
 
         node_id = resource.split('/')[0]
+        validation = not runtime.default.disable_topology_validation
+        key = (self.data_root, resource, validation)
+        cached = definition_cache.get(key)
+        if cached is not None:
+            log.debug('%s: definition cache hit', node_id)
+            return self.response(**cached)
+
+        dependencies = definition_cache.start()
         try:
-            fobj = self.repository.get_file(self.expand(resource, NODE_FN))
-            node = create_node(fobj.read(CONTENT_TYPE_JSON))
-        except Exception as err:           # pylint: disable=W0703
-            log.error('%s: unable to read %s file for %s: %s' %
-                      (NODE_FN, node_id, resource, err))
-            response = self.http_bad_request()
-            return self.response(**response)
+            filenames = [NODE_FN, STARTUP_CONFIG_FN, DEFINITION_FN,
+                         ATTRIBUTES_FN] + ([PATTERN_FN] if validation else [])
+            for filename in filenames:
+                dependencies.add(os.path.join(self.data_root,
+                                              self.expand(resource,
+                                                          filename)))
+            if not next(dependencies.files.itervalues()):
+                dependencies.uncacheable('%s file not on disk' % NODE_FN)
 
-        return self.fsm('do_validation', resource=resource, request=request,
-                        node=node, node_id=node_id)
+            try:
+                fobj = self.repository.get_file(self.expand(resource,
+                                                            NODE_FN))
+                node = create_node(fobj.read(CONTENT_TYPE_JSON))
+            except Exception as err:           # pylint: disable=W0703
+                log.error('%s: unable to read %s file for %s: %s',
+                          NODE_FN, node_id, resource, err)
+                response = self.http_bad_request()
+                return self.response(**response)
+
+            response = self.fsm('do_validation', resource=resource,
+                                request=request, node=node, node_id=node_id)
+        finally:
+            definition_cache.stop()
+
+        if response.get('status') != HTTP_STATUS_OK or \
+           not dependencies.cacheable:
+            return response
+
+        response['body'] = dumps(response['body'], response['content_type'],
+                                 node_id)
+        definition_cache.put(key, dependencies, response)
+        return self.response(**response)
 
     def do_validation(self, response, *args, **kwargs):
         if not runtime.default.disable_topology_validation:
-            log.info('%s: topology validation is ENABLED' % kwargs['resource'])
+            log.info('%s: topology validation is ENABLED', kwargs['resource'])
 
             filename = self.expand(kwargs['resource'], PATTERN_FN)
             fobj = self.repository.get_file(filename)
 
             try:
                 log.info('%s: checking syntax of pattern file used for topology'
-                         ' validation: %s' % (kwargs['resource'], filename))
+                         ' validation: %s', kwargs['resource'], filename)
                 pattern = load_pattern(fobj.name, node_id=kwargs['resource'])
             except SerializerError as err:
                 log.error(err.message)
@@ -589,18 +717,18 @@ class NodesController(BaseController):
             if not pattern:
                 raise Exception('failed to validate pattern')
 
-            log.info('%s: evaluating node against pattern: %s' %
-                     (kwargs['resource'], filename))
+            log.info('%s: evaluating node against pattern: %s',
+                     kwargs['resource'], filename)
             if not pattern.match_node(kwargs['node']):
-                log.error('%s: node failed pattern validation (%s)' %
-                          (kwargs['resource'], filename))
+                log.error('%s: node failed pattern validation (%s)',
+                          kwargs['resource'], filename)
                 raise ValidationError('%s: node failed pattern '
                                       'validation (%s)' %
                                       (kwargs['resource'], filename))
-            log.info('%s: node passed pattern validation: %s' %
-                      (kwargs['resource'], filename))
+            log.info('%s: node passed pattern validation: %s',
+                     kwargs['resource'], filename)
         else:
-            log.warning('%s: topology validation is DISABLED' %
+            log.warning('%s: topology validation is DISABLED',
                         kwargs['resource'])
         return (response, 'get_startup_config')
 
@@ -615,21 +743,36 @@ class NodesController(BaseController):
             response['definition'] = dict(name='Autogenerated definition',
                                           actions=actions)
         except FileObjectNotFound:
-            log.debug('%s: no startup-config %s' %
-                      (kwargs['resource'], filename))
+            log.debug('%s: no startup-config %s', kwargs['resource'], filename)
 
         return (response, 'get_definition')
 
+    def definition_plan(self, fobj, filename, node_id):
+        ''' Returns the substitution plan of a definition file, compiled
+        once per version of the file
+        '''
+        path = os.path.join(self.data_root, filename)
+        plan = plan_cache.get(path)
+        if plan is None:
+            dependencies = Dependencies()
+            dependencies.add(path)
+            if dependencies.files[path] is None:
+                dependencies.uncacheable('%s not on disk' % path)
+            plan = DefinitionPlan(fobj.read(CONTENT_TYPE_YAML, node_id))
+            plan_cache.put(path, dependencies, plan)
+        return plan
+
     def get_definition(self, response, *args, **kwargs):
         ''' Reads the node specific definition from disk and stores it in the
-        repsonse dict with key `definition`
+        repsonse dict with key `definition` and the plans of its actions
+        with key `plans`
         '''
 
         try:
             filename = self.expand(kwargs['resource'], DEFINITION_FN)
             fobj = self.repository.get_file(filename)
-            definition = fobj.read(CONTENT_TYPE_YAML,
-                                   kwargs['resource'])
+            plan = self.definition_plan(fobj, filename, kwargs['resource'])
+            definition = plan.template()
             actions = []
             if 'actions' in definition:
                 actions = definition['actions']
@@ -637,31 +780,35 @@ class NodesController(BaseController):
             if 'definition' in response:
                 # startup-config already present
                 _actions = list()
-                for action in actions:
+                plans = list(compile_actions(response['definition']
+                                             ['actions']))
+                for (action, action_plan) in zip(actions, plan.actions):
                     always_execute = action.get('always_execute', False)
                     if always_execute:
                         _actions.append(action)
+                        plans.append(action_plan)
                         log.debug('%s: always_execute action %s included '
-                                  'in definition' %
-                                  (kwargs['resource'],  action.get('name')))
+                                  'in definition',
+                                  kwargs['resource'], action.get('name'))
                     else:
                         log.debug('%s: action %s not included '
-                                  'in definition' %
-                                  (kwargs['resource'],  action.get('name')))
+                                  'in definition',
+                                  kwargs['resource'], action.get('name'))
                 response['definition']['actions'] += _actions
+                response['plans'] = plans
             else:
                 # no startup-config
                 for action in actions:
                     log.debug('%s: action %s included '
-                              'in definition' %
-                              (kwargs['resource'],  action.get('name')))
+                              'in definition',
+                              kwargs['resource'], action.get('name'))
                 response['definition'] = definition
-            log.debug('%s: defintion is %s (%s)' % (kwargs['resource'],
-                                                    filename,
-                                                    definition['actions']))
+                response['plans'] = plan.actions
+            log.debug('%s: defintion is %s (%s)', kwargs['resource'],
+                      filename, LogPayload(definition.get('actions')))
         except FileObjectNotFound:
-            log.warning('%s: missing definition %s' %
-                        (kwargs['resource'], filename))
+            log.warning('%s: missing definition %s',
+                        kwargs['resource'], filename)
         except FileObjectError as err:
             log.error(err.message)
             raise Exception('failed to load definition %s' % filename)
@@ -676,64 +823,58 @@ class NodesController(BaseController):
             fileobj = self.repository.get_file(filename)
             attributes = fileobj.read(CONTENT_TYPE_YAML)
             response['attributes'] = attributes
-            log.debug('%s: loaded %s attributes from %s' %
-                      (kwargs['resource'], attributes, filename))
+            log.debug('%s: loaded %s attributes from %s',
+                      kwargs['resource'], LogPayload(attributes), filename)
         except FileObjectNotFound:
-            log.warning('%s: no node specific attributes file' %
+            log.warning('%s: no node specific attributes file',
                         kwargs['resource'])
             response['attributes'] = dict()
 
         return (response, 'do_substitution')
 
     def do_substitution(self, response, *args, **kwargs):
-        # pylint: disable=R0914
+        ''' Fills the $variable slots of the actions with the node
+        attributes or, failing that, the definition attributes
+        '''
         definition = response.get('definition')
         attrs = definition.get('attributes', dict())
 
         nodeattrs = response.get('attributes', dict())
 
         def lookup(name):
-            log.debug('%s: lookup up value for variable %s' %
-                      (kwargs['resource'], name))
+            log.debug('%s: lookup up value for variable %s',
+                      kwargs['resource'], name)
             return nodeattrs.get(name, attrs.get(name))
 
+        plans = response.get('plans')
+        if plans is None:
+            plans = compile_actions(definition['actions'])
+
         _actions = list()
-        for action in definition['actions']:
-            log.debug('%s: processing action %s (variable substitution)' %
-                      (kwargs['resource'], action.get('name')))
-            _attributes = dict()
-            if 'attributes' in action:
-                for key, value in action.get('attributes').items():
-                    try:
-                        update = dict()
-                        for _key, _value in value.items():
-                            if str(_value).startswith('$'):
-                                _value = lookup(_value[1:])
-                            update[_key] = _value
-                    except AttributeError:
-                        if str(value).startswith('$'):
-                            value = lookup(value[1:])
-                        update = value
-                    finally:
-                        _attributes[key] = update
-            action['attributes'] = _attributes
-            _actions.append(action)
+        for plan in plans:
+            log.debug('%s: processing action %s (variable substitution)',
+                      kwargs['resource'], plan.action.get('name'))
+            _actions.append(plan.substitute(lookup))
         definition['actions'] = _actions
         response['definition'] = definition
+        response['plans'] = plans
         return (response, 'do_resources')
 
     def do_resources(self, response, *args, **kwargs):
+        ''' Replaces the plugin calls in the actions by the resources
+        returned by the plugins
+        '''
         definition = response['definition']
         node = kwargs.get('node')
-        _actions = list()
+        actions = definition.get('actions')
 
-        try:
-            for action in definition.get('actions'):
-                attrs = action.get('attributes', dict())
+        plans = response.get('plans')
+        if plans is None:
+            plans = compile_actions(actions)
 
-                action['attributes'] = \
-                    load_resources(attrs, node, kwargs['resource'])
-                _actions.append(action)
+        try:
+            _actions = [plan.resolve(action, node, kwargs['resource'])
+                        for (plan, action) in zip(plans, actions)]
         except Exception as exc:
             log.error(exc)
             raise Exception('failed to allocate resources')
@@ -777,7 +918,7 @@ class BootstrapController(BaseController):
             else:
                 if 'logging' in config and config['logging']:
                     body['logging'] = config['logging']
-                    log.info('%s: syslog info included in bootstrap config' %
+                    log.info('%s: syslog info included in bootstrap config',
                              request.remote_addr)
 
                 if 'xmpp' in config and config['xmpp']:
@@ -785,23 +926,23 @@ class BootstrapController(BaseController):
                     for key in ['username', 'password', 'domain']:
                         if key not in body['xmpp']:
                             log.warning('Bootstrap config: \'%s\' missing from '
-                                        'XMPP config' % key)
+                                        'XMPP config', key)
                     if 'rooms' not in body['xmpp'] or \
                        not body['xmpp']['rooms']:
                         log.warning('Bootstrap config: no XMPP rooms '
                                     'configured')
-                    log.info('%s: xmpp info included in bootstrap config' %
+                    log.info('%s: xmpp info included in bootstrap config',
                              request.remote_addr)
             resp = dict(body=body, content_type=CONTENT_TYPE_JSON)
         except FileObjectNotFound:
             log.warning('Bootstrap config file not found')
             resp = dict(body=body, content_type=CONTENT_TYPE_JSON)
         except FileObjectError:
-            log.error('Failed to read bootstrap config file (%s)' % filename)
+            log.error('Failed to read bootstrap config file (%s)', filename)
             resp = self.http_bad_request()
         except Exception as exc:
-            log.error('Failed to load bootstrap config file (%s): %s' %
-                      (filename, exc))
+            log.error('Failed to load bootstrap config file (%s): %s',
+                      filename, exc)
             resp = self.http_bad_request()
         return resp
 
@@ -816,16 +957,15 @@ class BootstrapController(BaseController):
             body = Template(fobj).safe_substitute(SERVER=default_server)
 
             resp = dict(body=body, content_type=CONTENT_TYPE_PYTHON)
-            log.info('%s: node beginning provisioning' %
-                     request.remote_addr)
+            log.info('%s: node beginning provisioning', request.remote_addr)
         except KeyError as err:
-            log.debug('Missing variable: %s' % err)
+            log.debug('Missing variable: %s', err)
             resp = self.http_bad_request()
         except FileObjectNotFound:
-            log.error('Bootstrap file not found (%s)' % filename)
+            log.error('Bootstrap file not found (%s)', filename)
             resp = self.http_bad_request()
         except FileObjectError:
-            log.error('Failed to read bootstrap file (%s)' % filename)
+            log.error('Failed to read bootstrap file (%s)', filename)
             resp = self.http_bad_request()
         return resp
 
@@ -834,9 +974,6 @@ class MetaController(BaseController):
 
     FOLDER = 'meta'
 
-    BODY = {'size': None,
-            'sha1': None}
-
     def __repr__(self):
         return 'MetaController(folder=%s)' % self.FOLDER
 
@@ -850,20 +987,76 @@ class MetaController(BaseController):
                 file_resource = self.repository.get_file(file_path)
             except IOError as exc:
                 # IOError is file_path points to a folder
-                log.error('%s is a folder, not a file: %s' %
-                          (file_path, str(exc)))
+                log.error('%s is a folder, not a file: %s',
+                          file_path, str(exc))
                 resp = self.http_not_found()
             else:
-                self.BODY['size'] = file_resource.size()
-                self.BODY['sha1'] = file_resource.hash()
-                resp = dict(body=self.BODY, content_type=CONTENT_TYPE_JSON)
+                body = self.repository.digests(file_resource.name,
+                                               META_DIGESTS)
+                missing = tuple(name for name in DIGEST_ALGORITHMS
+                                if name not in body)
+                if missing:
+                    # included in the responses once they are computed
+                    self.repository.schedule_digests(file_resource.name,
+                                                     missing)
+                resp = dict(body=body, content_type=CONTENT_TYPE_JSON)
         except IOError as exc:
-            log.error('Failed to collect meta information for %s: %s' %
-                      (file_path, exc))
+            log.error('Failed to collect meta information for %s: %s',
+                      file_path, exc)
             resp = self.http_internal_server_error()
         return resp
 
 
+class AppContext(object):
+    ''' Application state shared by all the requests handled by a
+    :py:class:`Router`: the repository, the long-lived controller instances
+    and the process-wide caches.
+
+    Controllers are created on first use and recreated whenever data_root
+    changes.  The same instance serves concurrent requests, so controllers
+    must not keep any per-request state.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data_root = None
+        self.repository = None
+        self.controllers = dict()
+
+        self.file_cache = file_cache
+        self.neighbordb_cache = neighbordb_cache
+        self.definition_cache = definition_cache
+
+    def __repr__(self):
+        return 'AppContext(data_root=%s)' % self.data_root
+
+    @property
+    def digest_index(self):
+        return digest_index(self.data_root)
+
+    def controller(self, cls):
+        ''' Returns the controller instance for cls
+
+        :raises: RepositoryError if data_root does not exist
+        '''
+        data_root = runtime.default.data_root
+        controller = self.controllers.get(cls)
+        if controller is not None and data_root == self.data_root:
+            return controller
+
+        with self.lock:
+            if data_root != self.data_root:
+                self.repository = create_repository(data_root)
+                self.data_root = data_root
+                self.controllers = dict()
+
+            controller = self.controllers.get(cls)
+            if controller is None:
+                controller = cls(context=self)
+                self.controllers[cls] = controller
+            return controller
+
+
 class Router(WSGIRouter):
     ''' Routes incoming requests by mapping the URL to a controller '''
 
@@ -929,4 +1122,8 @@ class Router(WSGIRouter):
                                      member_actions=['show'],
                                      member_prefix='/{resource:.*}')
 
+        self.context = AppContext()
         super(Router, self).__init__(mapper)
+
+    def controller(self, cls):
+        return self.context.controller(cls)
@@ -0,0 +1,225 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.definitions
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The definitions module caches the definitions rendered for
+        GET /nodes/{id}.  Each cached definition records the files it was
+        rendered from (the node files and the files of the resource
+        plugins it ran), so that it is served again only as long as none
+        of them changed.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import collections
+import logging
+import threading
+
+from ztpserver.config import runtime
+from ztpserver.repository import file_signature
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+
+class Dependencies(object):
+    ''' The files a rendered definition depends on, with their
+    (inode, mtime, size) signatures (None for a missing file).
+
+    Signatures are taken before the files are read, so a file which
+    changes while the definition is rendered invalidates it.
+    '''
+
+    __slots__ = ['files', 'reason']
+
+    def __init__(self):
+        self.files = collections.OrderedDict()
+        self.reason = None
+
+    def __repr__(self):
+        return 'Dependencies(files=%d, cacheable=%s)' % \
+               (len(self.files), self.cacheable)
+
+    @property
+    def cacheable(self):
+        return self.reason is None
+
+    def add(self, filename):
+        if filename not in self.files:
+            self.files[filename] = file_signature(filename)
+
+    def uncacheable(self, reason):
+        if self.reason is None:
+            self.reason = reason
+
+    def valid(self):
+        ''' Returns True if none of the files changed '''
+        for (filename, signature) in self.files.iteritems():
+            if file_signature(filename) != signature:
+                return False
+        return True
+
+
+class DefinitionCache(object):
+    ''' Process-wide LRU cache of the responses to GET /nodes/{id} (or of
+    the plans compiled from the definition files)
+
+    Entries are validated against the signatures of their dependencies on
+    every lookup.  The number of entries is bounded by max_size or, by
+    default, the definition_cache_size option.
+    '''
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return 'DefinitionCache(entries=%d, hits=%d, misses=%d, ' \
+               'evictions=%d)' % (len(self.entries), self.hits, self.misses,
+                                  self.evictions)
+
+    def stats(self):
+        ''' Returns the cache counters as a dict '''
+        with self.lock:
+            return dict(entries=len(self.entries),
+                        hits=self.hits,
+                        misses=self.misses,
+                        evictions=self.evictions)
+
+    def clear(self):
+        ''' Drops all cached definitions '''
+        with self.lock:
+            self.entries.clear()
+
+    def size(self):
+        ''' Returns the maximum number of entries (0 if disabled) '''
+        if self.max_size is None:
+            return runtime.default.definition_cache_size
+        return self.max_size
+
+    def get(self, key):
+        ''' Returns the cached response for key or None if it is not cached,
+        any of its dependencies changed or the cache is disabled
+        '''
+        if not self.size():
+            with self.lock:
+                # the cache was disabled at runtime
+                self.entries.clear()
+                self.misses += 1
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and not entry[0].valid():
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+            entry = None
+
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # mark as most recently used
+            if key in self.entries:
+                del self.entries[key]
+                self.entries[key] = entry
+        return entry[1]
+
+    def put(self, key, dependencies, response):
+        ''' Adds the response for key, evicting the least recently used
+        entries if the cache is full
+        '''
+        max_size = self.size()
+        if not max_size or not dependencies.cacheable:
+            return
+
+        with self.lock:
+            self.entries.pop(key, None)
+            while len(self.entries) >= max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            self.entries[key] = (dependencies, response)
+
+    def start(self):
+        ''' Starts recording the dependencies of the definition rendered by
+        the current thread
+        '''
+        dependencies = Dependencies()
+        self.local.dependencies = dependencies
+        return dependencies
+
+    def stop(self):
+        self.local.dependencies = None
+
+    def current(self):
+        return getattr(self.local, 'dependencies', None)
+
+definition_cache = DefinitionCache()    #pylint: disable=C0103
+
+# substitution plans of the definition files, keyed by file path (kept
+# even if the rendered definitions are not cached)
+PLAN_CACHE_SIZE = 16384
+plan_cache = DefinitionCache(PLAN_CACHE_SIZE)   #pylint: disable=C0103
+
+def add_dependency(filename):
+    ''' Records that the definition being rendered by the current thread
+    (if any) depends on filename
+    '''
+    dependencies = definition_cache.current()
+    if dependencies is not None:
+        dependencies.add(filename)
+
+def uncacheable(reason):
+    ''' Prevents the definition being rendered by the current thread (if
+    any) from being cached
+    '''
+    dependencies = definition_cache.current()
+    if dependencies is not None:
+        log.debug('Definition not cacheable: %s', reason)
+        dependencies.uncacheable(reason)
@@ -0,0 +1,515 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.metrics
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The metrics module provides the WSGI middleware which records the
+        requests handled by the server (counts, status codes, latency and
+        bytes sent per route) and serves them, along with the cache and
+        digest warm-up gauges, at GET /metrics in the Prometheus text
+        format.  When a metrics directory is configured, every server
+        process periodically writes its metrics to that directory so that
+        /metrics reports the totals of all the (pre-forked or mod_wsgi)
+        processes.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import bisect
+import errno
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import ztpserver.warmup
+
+from ztpserver.config import runtime
+from ztpserver.definitions import definition_cache
+from ztpserver.repository import digest_index, file_cache
+from ztpserver.resources import plugin_registry
+from ztpserver.topology import neighbordb_cache
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+METRICS_PATH = '/metrics'
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# route label of the requests which did not match any route
+UNMATCHED = 'unmatched'
+
+# name: (type, aggregation across processes, help)
+#   sum  - summed over all the processes which wrote metrics
+#   live - summed over the processes which are still running
+#   max  - maximum over the processes which are still running
+METRICS = {
+    'ztpserver_requests_total':
+        ('counter', 'sum', 'Requests handled, by route, method and status'),
+    'ztpserver_request_duration_seconds':
+        ('histogram', 'sum', 'Time spent handling requests, by route '
+                             'and method'),
+    'ztpserver_response_bytes_total':
+        ('counter', 'sum', 'Response bytes sent, by route and method'),
+    'ztpserver_requests_in_flight':
+        ('gauge', 'live', 'Requests being handled'),
+    'ztpserver_cache_hits_total':
+        ('counter', 'sum', 'Cache hits, by cache'),
+    'ztpserver_cache_misses_total':
+        ('counter', 'sum', 'Cache misses, by cache'),
+    'ztpserver_cache_hit_ratio':
+        ('gauge', 'sum', 'Cache hits / lookups, by cache'),
+    'ztpserver_cache_entries':
+        ('gauge', 'live', 'Cached entries, by cache'),
+    'ztpserver_digest_queue_depth':
+        ('gauge', 'max', 'Files waiting to be hashed by the digest '
+                         'warm-up'),
+    'ztpserver_digest_index_pending':
+        ('gauge', 'live', 'Digests not yet written to the digest index'),
+    'ztpserver_plugin_loads_total':
+        ('counter', 'sum', 'Resource plugin loads, by plugin'),
+    'ztpserver_plugin_load_seconds':
+        ('gauge', 'max', 'Duration of the last load of a resource plugin, '
+                         'by plugin'),
+}
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno != errno.ESRCH
+    return True
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"'). \
+        replace('\n', r'\n')
+
+def format_labels(labels, extra=None):
+    labels = list(labels) + ([extra] if extra else [])
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value))
+                             for (name, value) in labels)
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MetricsStore(object):
+    ''' The (thread-safe) metrics of the current process
+
+    Values are keyed by (name, labels), labels being a tuple of
+    (name, value) pairs.  A histogram is a list of per-bucket counts
+    (the last one for +Inf) followed by the sum of the observations.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = dict()
+        self.histograms = dict()
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, labels=(), value=0):
+        with self.lock:
+            self.values[(name, labels)] = value
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            self._observe((name, labels), value)
+
+    def _observe(self, key, value):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = [0] * (len(BUCKETS) + 2)
+            self.histograms[key] = histogram
+        histogram[bisect.bisect_left(BUCKETS, value)] += 1
+        histogram[-1] += value
+
+    def request_started(self):
+        key = ('ztpserver_requests_in_flight', ())
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + 1
+
+    def request_done(self, route, method, status, duration, size):
+        ''' Records a request (under a single lock acquisition) '''
+        labels = (('route', route), ('method', method))
+        keys = [(('ztpserver_requests_total',
+                  labels + (('status', status),)), 1),
+                (('ztpserver_response_bytes_total', labels), size),
+                (('ztpserver_requests_in_flight', ()), -1)]
+        with self.lock:
+            for (key, value) in keys:
+                self.values[key] = self.values.get(key, 0) + value
+            self._observe(('ztpserver_request_duration_seconds', labels),
+                          duration)
+
+    def snapshot(self):
+        ''' Returns the metrics as a (JSON serializable) dict '''
+        with self.lock:
+            return dict(pid=os.getpid(),
+                        values=[[name, labels, value] for
+                                ((name, labels), value) in
+                                self.values.items()],
+                        histograms=[[name, labels, list(histogram)] for
+                                    ((name, labels), histogram) in
+                                    self.histograms.items()])
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.histograms.clear()
+
+
+def merge(snapshots):
+    ''' Aggregates the snapshots of several processes according to the
+    aggregation of each metric (see METRICS)
+
+    :returns: (values, histograms) dicts keyed by (name, labels)
+    '''
+    values = dict()
+    histograms = dict()
+    for snapshot in snapshots:
+        alive = snapshot['pid'] == os.getpid() or \
+                process_alive(snapshot['pid'])
+        for (name, labels, value) in snapshot['values']:
+            aggregation = METRICS.get(name, ('gauge', 'sum', ''))[1]
+            if aggregation != 'sum' and not alive:
+                continue
+            key = (name, tuple(tuple(x) for x in labels))
+            if key not in values:
+                values[key] = value
+            elif aggregation == 'max':
+                values[key] = max(values[key], value)
+            else:
+                values[key] += value
+        for (name, labels, histogram) in snapshot['histograms']:
+            key = (name, tuple(tuple(x) for x in labels))
+            if key not in histograms:
+                histograms[key] = list(histogram)
+            else:
+                histograms[key] = [x + y for (x, y) in
+                                   zip(histograms[key], histogram)]
+    return (values, histograms)
+
+def render(values, histograms):
+    ''' Returns the metrics in the Prometheus text exposition format '''
+    values = dict(values)
+    for ((name, labels), hits) in values.items():
+        if name == 'ztpserver_cache_hits_total':
+            lookups = hits + values.get(
+                ('ztpserver_cache_misses_total', labels), 0)
+            values[('ztpserver_cache_hit_ratio', labels)] = \
+                float(hits) / lookups if lookups else 0.0
+
+    series = dict()
+    for ((name, labels), value) in values.items():
+        series.setdefault(name, []).append(
+            '%s%s %s' % (name, format_labels(labels), format_value(value)))
+    for ((name, labels), histogram) in histograms.items():
+        lines = series.setdefault(name, [])
+        count = 0
+        for (bound, bucket) in zip(BUCKETS + ('+Inf',), histogram[:-1]):
+            count += bucket
+            lines.append('%s_bucket%s %d' %
+                         (name, format_labels(labels, ('le', bound)), count))
+        lines.append('%s_sum%s %s' % (name, format_labels(labels),
+                                      repr(float(histogram[-1]))))
+        lines.append('%s_count%s %d' % (name, format_labels(labels), count))
+
+    output = []
+    for name in sorted(series):
+        (kind, _, text) = METRICS.get(name, ('gauge', 'sum', name))
+        output.append('# HELP %s %s' % (name, text))
+        output.append('# TYPE %s %s' % (name, kind))
+        output.extend(sorted(series[name]))
+    return '\n'.join(output) + '\n'
+
+
+class Metrics(object):
+    ''' The metrics of the current process and, if a metrics directory is
+    configured, the background thread which writes them to that directory
+    '''
+
+    def __init__(self):
+        self.store = MetricsStore()
+        self.lock = threading.Lock()
+        self.pid = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def __repr__(self):
+        return 'Metrics(pid=%s)' % self.pid
+
+    @staticmethod
+    def directory():
+        return runtime.metrics.directory
+
+    def start(self):
+        ''' Starts collecting in the current process (a forked process
+        starts from empty metrics).  Cheap to call on every request.
+        '''
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.store.clear()
+            self.stopped = threading.Event()
+            self.thread = None
+            if self.directory():
+                self.thread = threading.Thread(target=self.run,
+                                               name='metrics')
+                self.thread.daemon = True
+                self.thread.start()
+            self.pid = os.getpid()
+
+    def stop(self):
+        ''' Stops the background thread, after a last write '''
+        self.stopped.set()
+        if self.thread is not None and \
+           self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+        self.pid = None
+
+    def run(self):
+        interval = runtime.metrics.flush_interval
+        while not self.stopped.wait(interval):
+            self.write()
+        self.write()
+
+    def collect(self):
+        ''' Samples the cache, plugin and digest warm-up gauges '''
+        store = self.store
+        caches = [('file', file_cache.stats()),
+                  ('neighbordb', neighbordb_cache.stats()),
+                  ('definition', definition_cache.stats()),
+                  ('digest', digest_index(runtime.default.data_root).
+                   stats())]
+        for (name, stats) in caches:
+            labels = (('cache', name),)
+            store.set('ztpserver_cache_hits_total', labels, stats['hits'])
+            store.set('ztpserver_cache_misses_total', labels,
+                      stats['misses'])
+            if 'entries' in stats:
+                store.set('ztpserver_cache_entries', labels,
+                          stats['entries'])
+        store.set('ztpserver_digest_index_pending', (),
+                  caches[-1][1]['pending'])
+
+        for (name, stats) in plugin_registry.stats().items():
+            labels = (('plugin', name),)
+            store.set('ztpserver_plugin_loads_total', labels, stats['loads'])
+            store.set('ztpserver_plugin_load_seconds', labels,
+                      stats['load_time'])
+
+        warmup = ztpserver.warmup.warmup
+        if warmup is not None:
+            store.set('ztpserver_digest_queue_depth', (),
+                      warmup.status()['pending'])
+
+    def filename(self, directory):
+        return os.path.join(directory, 'metrics-%d.json' % os.getpid())
+
+    def write(self):
+        ''' Writes the metrics of the current process to the metrics
+        directory
+        '''
+        directory = self.directory()
+        if not directory:
+            return
+        try:
+            self.collect()
+            (fd, tmp) = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+            with os.fdopen(fd, 'w') as fhandler:
+                json.dump(self.store.snapshot(), fhandler)
+            os.rename(tmp, self.filename(directory))
+        except Exception as err:            #pylint: disable=W0703
+            log.warning('Failed to write metrics to %s: %s', directory, err)
+
+    def snapshots(self):
+        ''' Returns the snapshots of all the processes (only the current
+        process if no metrics directory is configured)
+        '''
+        directory = self.directory()
+        if not directory:
+            self.collect()
+            return [self.store.snapshot()]
+
+        self.write()
+        result = []
+        for filename in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            try:
+                with open(filename) as fhandler:
+                    result.append(json.load(fhandler))
+            except (IOError, ValueError) as err:
+                # removed/replaced while listing the directory
+                log.debug('Skipping metrics file %s: %s', filename, err)
+        return result
+
+    def render(self):
+        return render(*merge(self.snapshots()))
+
+    def clear_directory(self):
+        ''' Removes the metrics written by previous server runs '''
+        directory = self.directory()
+        if not directory:
+            return
+        for filename in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+metrics = Metrics()                     #pylint: disable=C0103
+
+
+def is_file_wrapper(app_iter, file_wrapper):
+    ''' Returns True if app_iter was created by the server's
+    wsgi.file_wrapper.  The wrapper may be an old-style class (e.g.
+    wsgiref's FileWrapper on Python 2) or a factory function.
+    '''
+    if file_wrapper is None:
+        return False
+    try:
+        return isinstance(app_iter, file_wrapper)
+    except TypeError:
+        # not a class
+        return False
+
+
+class ResponseIter(object):
+    ''' Counts the bytes of the response and records the request once the
+    server is done sending it
+    '''
+
+    def __init__(self, app_iter, done):
+        self.app_iter = app_iter
+        self.done = done
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.app_iter:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            self.done(self.size)
+
+
+class MetricsMiddleware(object):
+    ''' WSGI middleware recording the requests handled by app, labelled with
+    the template of the route they matched (not the node ID, file name,
+    etc.), and serving GET /metrics
+    '''
+
+    def __init__(self, app, metrics_=None):
+        self.app = app
+        self.metrics = metrics_ or metrics
+
+    def __repr__(self):
+        return 'MetricsMiddleware(app=%r)' % self.app
+
+    def serve_metrics(self, environ, start_response):
+        body = self.metrics.render()
+        start_response('200 OK', [('Content-Type', METRICS_CONTENT_TYPE),
+                                  ('Content-Length', str(len(body)))])
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        return [body]
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        if environ.get('PATH_INFO') == METRICS_PATH and \
+           method in ('GET', 'HEAD'):
+            return self.serve_metrics(environ, start_response)
+
+        metrics_ = self.metrics
+        metrics_.start()
+        store = metrics_.store
+        store.request_started()
+        start = time.time()
+        response = dict()
+
+        def _start_response(status, headers, exc_info=None):
+            response['status'] = status.split(' ', 1)[0]
+            response['headers'] = headers
+            return start_response(status, headers, exc_info)
+
+        def done(size):
+            route = environ.get('routes.route')
+            store.request_done(
+                route.routepath if route is not None else UNMATCHED,
+                method, response.get('status', '500'),
+                time.time() - start, size)
+
+        try:
+            app_iter = self.app(environ, _start_response)
+        except Exception:
+            done(0)
+            raise
+
+        if is_file_wrapper(app_iter, environ.get('wsgi.file_wrapper')):
+            # let the server send the file (e.g. with sendfile(2))
+            size = 0
+            if method != 'HEAD':
+                for (name, value) in response.get('headers', []):
+                    if name.lower() == 'content-length':
+                        size = int(value)
+            done(size)
+            return app_iter
+
+        return ResponseIter(app_iter, done)
@@ -49,17 +49,428 @@
 
 '''
 
+import collections
+import copy
 import hashlib
 import logging
 import mimetypes
 import os
+import Queue
+import tempfile
+import threading
+import time
 
 import ztpserver.serializers
 
+from ztpserver.config import runtime
+from ztpserver.constants import CONTENT_TYPE_JSON
 from ztpserver.serializers import SerializerError
 
 log = logging.getLogger(__name__)   #pylint: disable=C0103
 
+CACHE_MISS = object()
+
+DIGEST_INDEX_FN = '.digests'
+DIGEST_ALGORITHMS = ('sha1', 'sha256', 'md5')
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+# during a batch (e.g. a digest warm-up scan), new digests are written to
+# the digest index at most every DIGEST_SAVE_INTERVAL seconds
+DIGEST_SAVE_INTERVAL = 5
+
+IMMUTABLE_TYPES = (str, unicode, int, long, float, bool, type(None))
+
+def copy_contents(value):
+    ''' Returns a copy of deserialized file contents which can be modified
+    without affecting value
+    '''
+    if isinstance(value, IMMUTABLE_TYPES):
+        return value
+    elif isinstance(value, dict):
+        result = value.copy()
+        for key, item in result.iteritems():
+            if not isinstance(item, IMMUTABLE_TYPES):
+                result[key] = copy_contents(item)
+        return result
+    elif isinstance(value, list):
+        return [item if isinstance(item, IMMUTABLE_TYPES)
+                else copy_contents(item) for item in value]
+    return copy.deepcopy(value)
+
+def file_signature(filename):
+    ''' Returns the (inode, mtime, size) signature of a file or None if the
+    file cannot be accessed
+    '''
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+
+class FileCache(object):
+    ''' Process-wide LRU cache of deserialized file contents.
+
+    Entries are keyed by file path and validated against the
+    (inode, mtime, size) signature of the file on every read, so a file
+    which changes on disk is read again.  The total size of the cached
+    files is bounded by the file_cache_size option.
+    '''
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return 'FileCache(entries=%d, size=%d, hits=%d, misses=%d, ' \
+               'evictions=%d)' % (len(self.entries), self.size, self.hits,
+                                  self.misses, self.evictions)
+
+    def stats(self):
+        ''' Returns the cache counters as a dict '''
+        with self.lock:
+            return dict(entries=len(self.entries),
+                        size=self.size,
+                        hits=self.hits,
+                        misses=self.misses,
+                        evictions=self.evictions)
+
+    def clear(self):
+        ''' Drops all cached files '''
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def invalidate(self, filename):
+        ''' Drops the cached contents of filename '''
+        with self.lock:
+            self._remove(filename)
+
+    def _remove(self, filename):
+        entry = self.entries.pop(filename, None)
+        if entry is not None:
+            self.size -= entry[0][2]
+
+    def get(self, filename, signature, content_type, default=None):
+        ''' Returns a copy of the cached contents of filename or default if
+        the file is not cached with the same signature and content_type
+        '''
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None or entry[0] != signature or \
+               entry[1] != content_type:
+                self.misses += 1
+                return default
+            self.hits += 1
+            # mark as most recently used
+            del self.entries[filename]
+            self.entries[filename] = entry
+        return copy_contents(entry[2])
+
+    def put(self, filename, signature, content_type, contents):
+        ''' Adds the contents of filename to the cache, evicting the least
+        recently used files if the cache is full
+        '''
+        max_size = runtime.default.file_cache_size
+        if signature[2] > max_size:
+            return
+
+        with self.lock:
+            self._remove(filename)
+            while self.entries and self.size + signature[2] > max_size:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+            self.entries[filename] = (signature, content_type, contents)
+            self.size += signature[2]
+
+file_cache = FileCache()    #pylint: disable=C0103
+
+def file_digests(filename, algorithms=DIGEST_ALGORITHMS):
+    ''' Returns a dict with the hex digests of a file, computed in a single
+    pass over the file without reading all of it into memory
+
+    :raises: IOError
+    '''
+    hashes = [(name, hashlib.new(name)) for name in algorithms]
+    with open(filename, 'rb') as fhandler:
+        while True:
+            chunk = fhandler.read(DIGEST_CHUNK_SIZE)
+            if not chunk:
+                break
+            for (_, digest) in hashes:
+                digest.update(chunk)
+    return dict((name, digest.hexdigest()) for (name, digest) in hashes)
+
+
+class DigestIndex(object):
+    ''' Persistent index of file digests for a repository.
+
+    Digests are stored in the DIGEST_INDEX_FN file at the root of the
+    repository, keyed by the path of the file relative to the root, and
+    are only valid for the (inode, mtime, size) signature of the file they
+    were computed for.  Each file version is therefore hashed at most once
+    and concurrent requests for the same file wait for a single
+    computation.  Entries written by other processes are picked up when
+    the index file changes.
+
+    Each digest algorithm is only computed when it is first requested, so
+    callers which need a single digest do not pay for the others; the
+    remaining digests can be computed in a background thread (see
+    schedule).
+
+    Outside of a batch, a new digest is written to the index right away.
+    Within a batch (see begin_batch), new digests are only written every
+    DIGEST_SAVE_INTERVAL seconds and when the batch ends, so that hashing
+    N files does not rewrite the index N times.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.filename = os.path.join(path, DIGEST_INDEX_FN)
+        self.entries = dict()
+        self.signature = None
+        self.lock = threading.Lock()
+        self.pending = dict()
+
+        # entries not written to the index file yet
+        self.unsaved = dict()
+        self.batches = 0
+        self.saved = 0
+
+        # files queued for background hashing
+        self.queue = Queue.Queue()
+        self.queued = set()
+        self.thread = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return 'DigestIndex(filename=%s, entries=%d, hits=%d, misses=%d)' % \
+               (self.filename, len(self.entries), self.hits, self.misses)
+
+    def stats(self):
+        ''' Returns the index counters as a dict '''
+        with self.lock:
+            return dict(entries=len(self.entries),
+                        pending=len(self.pending),
+                        unsaved=len(self.unsaved),
+                        queued=len(self.queued),
+                        hits=self.hits,
+                        misses=self.misses)
+
+    @staticmethod
+    def _valid(entry, signature, algorithms=DIGEST_ALGORITHMS):
+        return isinstance(entry, dict) and \
+               entry.get('signature') == list(signature) and \
+               all(name in entry for name in algorithms)
+
+    @staticmethod
+    def _result(entry, signature):
+        result = dict((name, entry[name]) for name in DIGEST_ALGORITHMS
+                      if name in entry)
+        result['size'] = signature[2]
+        return result
+
+    def _load(self):
+        signature = file_signature(self.filename)
+        if signature == self.signature:
+            return
+
+        entries = dict()
+        if signature is not None:
+            try:
+                entries = ztpserver.serializers.load(self.filename,
+                                                     CONTENT_TYPE_JSON)
+            except SerializerError:
+                log.warning('Ignoring invalid digest index %s' %
+                            self.filename)
+        if not isinstance(entries, dict):
+            entries = dict()
+
+        # drop the entries for files which have since changed
+        for key, entry in entries.items():
+            entry_signature = file_signature(os.path.join(self.path, key))
+            if entry_signature is None or \
+               not self._valid(entry, entry_signature, ()):
+                del entries[key]
+
+        entries.update(self.unsaved)
+        self.entries = entries
+        self.signature = signature
+
+    def _save(self):
+        tmp_filename = None
+        try:
+            (fd, tmp_filename) = tempfile.mkstemp(dir=self.path,
+                                                  prefix=DIGEST_INDEX_FN)
+            with os.fdopen(fd, 'w') as fhandler:
+                fhandler.write(ztpserver.serializers.dumps(self.entries,
+                                                           CONTENT_TYPE_JSON,
+                                                           'N/A'))
+            os.rename(tmp_filename, self.filename)
+            self.signature = file_signature(self.filename)
+            self.unsaved.clear()
+            self.saved = time.time()
+        except (OSError, IOError, SerializerError) as err:
+            log.warning('Failed to write digest index %s (%s)' %
+                        (self.filename, err))
+            if tmp_filename and os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def begin_batch(self):
+        ''' Starts a batch of digest computations (batches may overlap) '''
+        with self.lock:
+            if not self.batches:
+                self.saved = time.time()
+            self.batches += 1
+
+    def end_batch(self):
+        ''' Ends a batch, writing the new digests if it was the last one '''
+        with self.lock:
+            self.batches -= 1
+            if not self.batches:
+                self._flush()
+
+    def _flush(self):
+        if self.unsaved:
+            self._load()
+            self._save()
+
+    def _lookup(self, key, signature, algorithms):
+        ''' Returns (entry, None) if the algorithms digests of key are
+        indexed for signature, (None, event) if another request is
+        computing digests of key and (None, None) if the caller should
+        compute them
+        '''
+        with self.lock:
+            self._load()
+            entry = self.entries.get(key)
+            if self._valid(entry, signature, algorithms):
+                self.hits += 1
+                return (entry, None)
+
+            event = self.pending.get(key)
+            if event is None:
+                self.misses += 1
+                self.pending[key] = threading.Event()
+            return (None, event)
+
+    def digests(self, filename, algorithms=DIGEST_ALGORITHMS):
+        ''' Returns a dict with the size of filename and its digests: the
+        algorithms digests, which are computed if needed, and any other
+        digest which is already indexed
+
+        :raises: IOError
+        '''
+        key = os.path.relpath(filename, self.path)
+        while True:
+            signature = file_signature(filename)
+            if signature is None:
+                raise IOError('%s not found' % filename)
+
+            (entry, event) = self._lookup(key, signature, algorithms)
+            if entry is not None:
+                break
+            elif event is not None:
+                # another request is hashing this file
+                event.wait()
+                continue
+
+            try:
+                with self.lock:
+                    entry = self.entries.get(key)
+                missing = [name for name in algorithms
+                           if not self._valid(entry, signature, (name,))]
+                digests = dict()
+                if missing:
+                    log.debug('Computing %s digests for %s' %
+                              (', '.join(missing), filename))
+                    digests = file_digests(filename, missing)
+                if file_signature(filename) != signature:
+                    # file changed while being hashed
+                    continue
+                with self.lock:
+                    entry = self.entries.get(key)
+                    if self._valid(entry, signature, ()):
+                        entry = dict(entry, **digests)
+                    else:
+                        entry = dict(digests, signature=list(signature))
+                    self.entries[key] = entry
+                    self.unsaved[key] = entry
+                    if not self.batches or \
+                       time.time() - self.saved >= DIGEST_SAVE_INTERVAL:
+                        self._flush()
+                break
+            finally:
+                with self.lock:
+                    self.pending.pop(key).set()
+
+        return self._result(entry, signature)
+
+    def cached(self, filename, algorithms=DIGEST_ALGORITHMS):
+        ''' Returns the same dict as digests if the algorithms digests of
+        filename are indexed, None otherwise (nothing is computed)
+        '''
+        signature = file_signature(filename)
+        if signature is None:
+            return None
+
+        key = os.path.relpath(filename, self.path)
+        with self.lock:
+            self._load()
+            entry = self.entries.get(key)
+            if not self._valid(entry, signature, algorithms):
+                return None
+            self.hits += 1
+        return self._result(entry, signature)
+
+    def schedule(self, filename, algorithms=DIGEST_ALGORITHMS):
+        ''' Computes the algorithms digests of filename in a background
+        thread (files are hashed one at a time)
+        '''
+        key = os.path.relpath(filename, self.path)
+        with self.lock:
+            if key in self.queued:
+                return
+            self.queued.add(key)
+
+            # started in each (forked) process on first use
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._hash_queued,
+                                               name='digest-index')
+                self.thread.daemon = True
+                self.thread.start()
+        self.queue.put((key, filename, algorithms))
+
+    def _hash_queued(self):
+        while True:
+            (key, filename, algorithms) = self.queue.get()
+            try:
+                self.digests(filename, algorithms)
+            except Exception as err:        #pylint: disable=W0703
+                log.warning('Failed to compute digests for %s (%s)' %
+                            (filename, err))
+            finally:
+                with self.lock:
+                    self.queued.discard(key)
+                self.queue.task_done()
+
+DIGEST_INDEXES = dict()
+DIGEST_INDEXES_LOCK = threading.Lock()
+
+def digest_index(path):
+    ''' Returns the (process-wide) digest index of the repository at path '''
+    with DIGEST_INDEXES_LOCK:
+        if path not in DIGEST_INDEXES:
+            DIGEST_INDEXES[path] = DigestIndex(path)
+        return DIGEST_INDEXES[path]
+
 
 
 def create_repository(path):
@@ -106,13 +517,27 @@ class FileObject(object):
         if path is not None:
             self.name = os.path.join(path, name)
 
-        self.type, self.encoding = mimetypes.guess_type(self.name)
+        self._mimetype = None
         self.content_type = kwargs.get('content_type')
 
     def __repr__(self):
         return 'FileObject(name=%s, type=%s, encoding=%s, content_type=%s)' % \
                (self.name, self.type, self.encoding, self.content_type)
 
+    @property
+    def type(self):
+        ''' The MIME type of the file (guessed from its name) '''
+        if self._mimetype is None:
+            self._mimetype = mimetypes.guess_type(self.name)
+        return self._mimetype[0]
+
+    @property
+    def encoding(self):
+        ''' The encoding of the file (guessed from its name) '''
+        if self._mimetype is None:
+            self._mimetype = mimetypes.guess_type(self.name)
+        return self._mimetype[1]
+
     def read(self, content_type=None, node_id=None):
         ''' Reads the contents from the file system
 
@@ -127,14 +552,35 @@ class FileObject(object):
         content_type argument is not specified, the read method will read
         the file as text. If any errors occur, a FileObjectError is raised.
 
+        The contents are served from the file cache as long as the file
+        has not changed on disk.  Callers always get their own copy of the
+        contents.
+
         '''
+        self.content_type = content_type
+
+        signature = None
+        if runtime.default.file_cache_size:
+            signature = file_signature(self.name)
+            if signature is not None:
+                contents = file_cache.get(self.name, signature, content_type,
+                                          default=CACHE_MISS)
+                if contents is not CACHE_MISS:
+                    return contents
+
         try:
-            self.content_type = content_type
-            return ztpserver.serializers.load(self.name, content_type,
-                                              node_id)
+            contents = ztpserver.serializers.load(self.name, content_type,
+                                                  node_id)
         except SerializerError as err:
             raise FileObjectError(err.message)
 
+        if signature is not None:
+            # the signature was taken before reading, so a concurrent
+            # update results in a miss on the next read
+            file_cache.put(self.name, signature, content_type, contents)
+            return copy_contents(contents)
+        return contents
+
     def write(self, contents, content_type=None):
         ''' Writes the contents to the file
 
@@ -154,6 +600,7 @@ class FileObject(object):
         encountered during the write operation, a FileObjectError is raised
 
         '''
+        file_cache.invalidate(self.name)
         try:
             ztpserver.serializers.dump(contents, self.name, content_type)
             self.content_type = content_type
@@ -173,9 +620,7 @@ class FileObject(object):
         :raises: IOError
         '''
 
-        sha1 = hashlib.sha1()
-        sha1.update(open(self.name).read())       #pylint: disable=E1101
-        return sha1.hexdigest()
+        return file_digests(self.name, ('sha1',))['sha1']
 
 class Repository(object):
     ''' The Respository class represents a repository of :py:class:`FileObject`
@@ -287,6 +732,51 @@ class Repository(object):
             raise FileObjectNotFound('file not found (%s)' % file_path)
         return FileObject(file_path)
 
+    def digests(self, file_path, algorithms=DIGEST_ALGORITHMS):
+        ''' Returns the size and the digests of a file in the repository
+
+        :param file_path: the file path of the file
+        :type file_path: str
+        :param algorithms: the digests to compute (if not indexed yet)
+        :type algorithms: tuple
+        :returns: dict -- the size, the algorithms digests and any other
+                  (sha1, sha256, md5) digest which is already indexed
+        :raises: IOError
+
+        Digests are served from the repository's persistent digest index,
+        so each version of a file is only hashed once.
+
+        '''
+        return digest_index(self.path).digests(self.expand(file_path),
+                                               algorithms)
+
+    def cached_digests(self, file_path, algorithms=DIGEST_ALGORITHMS):
+        ''' Returns the size and the digests of a file in the repository if
+        its algorithms digests are indexed, None otherwise
+
+        :param file_path: the file path of the file
+        :type file_path: str
+        :param algorithms: the digests which must be indexed
+        :type algorithms: tuple
+        :returns: dict or None
+
+        '''
+        return digest_index(self.path).cached(self.expand(file_path),
+                                              algorithms)
+
+    def schedule_digests(self, file_path, algorithms=DIGEST_ALGORITHMS):
+        ''' Computes the digests of a file in the repository in the
+        background
+
+        :param file_path: the file path of the file
+        :type file_path: str
+        :param algorithms: the digests to compute
+        :type algorithms: tuple
+        :returns: None
+
+        '''
+        digest_index(self.path).schedule(self.expand(file_path), algorithms)
+
     def delete_file(self, file_path):
         ''' Deletes an existing file in the respository
 
@@ -298,6 +788,7 @@ class Repository(object):
         '''
         try:
             file_path = self.expand(file_path)
+            file_cache.invalidate(file_path)
             os.remove(file_path)
         except (OSError, IOError) as err:
             log.error('Failed to delete file %s (%s)' %
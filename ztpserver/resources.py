@@ -31,26 +31,137 @@
 #
 
 import imp
+import logging
 import os
+import sys
+import threading
+import time
 
 from ztpserver.config import runtime
+from ztpserver.definitions import add_dependency, uncacheable
+from ztpserver.repository import file_signature
+from ztpserver.tracing import tracer
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+
+class PluginRegistry(object):
+    ''' Process-wide registry of the resource plugins under
+    data_root/plugins.
+
+    Each plugin is loaded (read, compiled and executed) once and loaded
+    again only when the (inode, mtime, size) signature of its file
+    changes, so that module-level state (e.g. database connections) is
+    kept between calls.  Every load of a plugin gets a new module object,
+    so that calls running the previous version are not affected.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.plugins = dict()
+        self.listing = None
+
+        self.loads = dict()
+        self.load_times = dict()
+
+    def __repr__(self):
+        return 'PluginRegistry(plugins=%d)' % len(self.plugins)
+
+    @staticmethod
+    def path():
+        return os.path.join(runtime.default.data_root, 'plugins')
+
+    def names(self):
+        ''' Returns the names of the plugins, listing the plugins folder
+        again only if it changed
+        '''
+        path = self.path()
+        signature = file_signature(path)
+        listing = self.listing
+        if listing is None or listing[:2] != (path, signature):
+            plugins = []
+            for (_, _, filenames) in os.walk(path):
+                plugins.extend(filenames)
+                break
+            listing = (path, signature, plugins)
+            self.listing = listing
+        return list(listing[2])
+
+    def get(self, plugin):
+        ''' Returns the (filename, module) of a plugin, loading it if it
+        is not loaded yet or if its file changed
+
+        :raises: IOError, or any exception raised loading the plugin
+        '''
+        filename = os.path.join(self.path(), plugin)
+        signature = file_signature(filename)
+        entry = self.plugins.get(filename)
+        if entry is not None and entry[0] == signature:
+            return (filename, entry[1])
+
+        with self.lock:
+            entry = self.plugins.get(filename)
+            if entry is None or entry[0] != signature:
+                entry = (signature, self.load(plugin, filename))
+                self.plugins[filename] = entry
+        return (filename, entry[1])
+
+    def load(self, plugin, filename):
+        start = time.time()
+        with tracer.span('plugin-load', plugin):
+            module = imp.load_source(plugin, filename)
+        # the next load must create a new module instead of executing the
+        # plugin again in this one
+        if sys.modules.get(plugin) is module:
+            del sys.modules[plugin]
+        elapsed = time.time() - start
+
+        self.loads[plugin] = self.loads.get(plugin, 0) + 1
+        self.load_times[plugin] = elapsed
+        log.info('Loaded plugin %s in %.1f ms', filename, elapsed * 1000)
+        return module
+
+    def stats(self):
+        ''' Returns the number of loads and the duration (in seconds) of
+        the last load of each plugin, as a dict keyed by plugin name
+        '''
+        with self.lock:
+            return dict((name, dict(loads=self.loads[name],
+                                    load_time=self.load_times[name]))
+                        for name in self.loads)
+
+    def clear(self):
+        ''' Drops the loaded plugins '''
+        with self.lock:
+            self.plugins.clear()
+            self.listing = None
+
+plugin_registry = PluginRegistry()      #pylint: disable=C0103
 
 def resource_plugins():
-    path = os.path.join(runtime.default.data_root, 'plugins')
+    return plugin_registry.names()
 
-    plugins = []
-    for (_, _, filenames) in os.walk(path):
-        plugins.extend(filenames)
-        break
-    return plugins
+def record_dependencies(module, filename, node_id, pool):
+    ''' Records the files the result of a plugin depends on, if the plugin
+    declares itself idempotent (IDEMPOTENT = True): the plugin itself and
+    the files returned by its optional dependencies(node_id, pool)
+    function.  The definition is not cached otherwise.
+    '''
+    if not getattr(module, 'IDEMPOTENT', False):
+        uncacheable('plugin %s is not idempotent' % module.__name__)
+        return
 
-def run_plugin(plugin, node_id, pool, node):
+    add_dependency(filename)
+    dependencies = getattr(module, 'dependencies', None)
+    if dependencies is not None:
+        for dependency in dependencies(node_id, pool):
+            add_dependency(dependency)
 
-    filename = os.path.join(runtime.default.data_root, 
-                            'plugins',
-                            plugin)
+def run_plugin(plugin, node_id, pool, node):
     try:
-        module = imp.load_source(plugin, filename)
-        return module.main(node_id, pool, node)
+        with tracer.span('plugin', plugin):
+            (filename, module) = plugin_registry.get(plugin)
+            record_dependencies(module, filename, node_id, pool)
+            return module.main(node_id, pool, node)
     except Exception as exc:
         raise Exception('failed to run plugin: %s' % exc)
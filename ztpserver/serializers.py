@@ -33,15 +33,23 @@
 # pylint: disable=R0201
 #
 
-import collections
 import logging
 import json
 import os
+import re
 import threading
 import yaml
 
 from collections import OrderedDict
 
+# use the libyaml based loader/dumper when PyYAML was built with libyaml
+try:
+    from yaml import CSafeLoader as YAMLLoader
+    from yaml import CSafeDumper as YAMLDumper
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader
+    from yaml import SafeDumper as YAMLDumper
+
 from ztpserver.constants import CONTENT_TYPE_OTHER
 from ztpserver.constants import CONTENT_TYPE_JSON
 from ztpserver.constants import CONTENT_TYPE_YAML
@@ -49,6 +57,40 @@ from ztpserver.constants import CONTENT_TYPE_YAML
 READ_WRITE_LOCK = {}
 log = logging.getLogger(__name__)   #pylint: disable=C0103
 
+PRINTABLE_ASCII_RE = re.compile(r'^[\x20-\x7e]*\Z')
+
+# keys longer than this may be emitted differently by libyaml
+MAX_LIBYAML_KEY_LENGTH = 60
+
+def libyaml_compatible(data):
+    ''' Returns True if libyaml emits data byte-for-byte like the
+    pure-Python emitter: a collection with printable ASCII strings (no
+    line breaks) and short, non-empty keys.  Otherwise, e.g. for multi-line or
+    escaped strings, line folding differs between the two emitters.
+    '''
+
+    if not isinstance(data, (dict, list)):
+        return False
+
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            for key, value in item.iteritems():
+                # empty keys are emitted as '' by libyaml and as an explicit
+                # "? ''" key by the pure-Python emitter
+                if isinstance(key, basestring) and \
+                   (not key or len(key) > MAX_LIBYAML_KEY_LENGTH or
+                    not PRINTABLE_ASCII_RE.match(key)):
+                    return False
+                stack.append(value)
+        elif isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, basestring) and \
+             not PRINTABLE_ASCII_RE.match(item):
+            return False
+    return True
+
 class SerializerError(Exception):
     ''' base error raised by serialization functions '''
     pass
@@ -113,12 +155,13 @@ def represent_odict(dump_odict, tag, mapping, flow_style=None):
             node.flow_style = best_style
     return node
 
-yaml.SafeDumper.add_representer(
-    OrderedDict,
-    lambda dumper, 
-    value: represent_odict(dumper, 
-                           u'tag:yaml.org,2002:map', 
-                           value))
+for _dumper in set([yaml.SafeDumper, YAMLDumper]):
+    _dumper.add_representer(
+        OrderedDict,
+        lambda dumper, 
+        value: represent_odict(dumper, 
+                               u'tag:yaml.org,2002:map', 
+                               value))
 #------------------------------------------------------------------------------
 
 class YAMLSerializer(BaseSerializer):
@@ -126,8 +169,9 @@ class YAMLSerializer(BaseSerializer):
     def deserialize(self, data):
         ''' Deserialize a YAML object and return a dict '''
 
+        # PyYAML already constructs str (not unicode) for ASCII strings
         try:
-            return yaml.safe_load(data)
+            return yaml.load(data, Loader=YAMLLoader)
         except yaml.YAMLError as err:
             msg = '''%s: unable to deserialize YAML data:
 %s 
@@ -140,7 +184,10 @@ Error:
         ''' Serialize a dict object and return YAML '''
 
         try:
-            return yaml.safe_dump(data, default_flow_style=False)
+            dumper = yaml.SafeDumper
+            if libyaml_compatible(data):
+                dumper = YAMLDumper
+            return yaml.dump(data, Dumper=dumper, default_flow_style=False)
         except yaml.YAMLError as err:
             msg = '''%s: unable to serialize YAML data:
 %s 
@@ -150,13 +197,36 @@ Error:
             raise SerializerError(msg)
 
 
+def _json_str(value):
+    ''' Returns value with ASCII unicode strings converted to str; lists are
+    converted in place
+    '''
+    if isinstance(value, unicode):
+        try:
+            return str(value)
+        except UnicodeEncodeError:
+            return value
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            if isinstance(item, (unicode, list)):
+                value[index] = _json_str(item)
+    return value
+
+def _json_object(pairs):
+    ''' object_pairs_hook which builds dicts with str keys and values
+    (nested objects have already been converted by the time their parent
+    is built)
+    '''
+    return dict((_json_str(key), _json_str(value)) for (key, value) in pairs)
+
+
 class JSONSerializer(BaseSerializer):
 
     def deserialize(self, data):
         ''' Deserialize a JSON object and return a dict '''
 
         try:
-            return json.loads(data)
+            return _json_str(json.loads(data, object_pairs_hook=_json_object))
         except Exception as err:
             msg = '''%s: unable to deserialize JSON data:
 %s 
@@ -212,21 +282,7 @@ class Serializer(object):
 
         handler = self.handlers.get(content_type, 
                                     TextSerializer(self.node_id))
-        data = self._convert_from_unicode(handler.deserialize(data))
-        return data
-
-    @staticmethod
-    def _convert_from_unicode(data):
-        if isinstance(data, basestring):
-            return str(data)
-        elif isinstance(data, collections.Mapping):
-            return dict([Serializer._convert_from_unicode(x)
-                         for x in data.items()])
-        elif isinstance(data, collections.Iterable):
-            return type(data)([Serializer._convert_from_unicode(x)
-                               for x in data])
-        else:
-            return data
+        return handler.deserialize(data)
 
 
 def loads(data, content_type, node_id):
@@ -0,0 +1,555 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.server
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The server module provides the WSGI server used when ztpserver
+        runs standalone.  It is based on the wsgiref server and adds:
+            - sendfile(2) for files returned through wsgi.file_wrapper, so
+              large files (e.g. EOS images) are copied by the kernel
+            - a threaded mode serving concurrent requests from a bounded
+              number of threads, with HTTP/1.1 keep-alive
+            - a pre-fork mode running several threaded worker processes
+              on the same listening socket
+            - graceful shutdown on SIGTERM/SIGINT
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler
+from wsgiref.simple_server import WSGIServer
+
+from ztpserver.config import runtime
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+SERVER_MODES = ['single', 'threaded', 'prefork']
+
+# largest count passed to a single sendfile(2) call
+SENDFILE_MAX_COUNT = 1024 * 1024 * 1024
+
+# largest unread request body discarded to keep a connection alive
+MAX_DISCARD_SIZE = 64 * 1024
+
+# delay before restarting a worker process which exited unexpectedly
+RESPAWN_DELAY = 1
+
+# interval (in seconds) at which the helper process checks for SIGTERM
+HELPER_POLL_INTERVAL = 0.5
+
+# interval (in seconds) at which a connection waiting for a free thread
+# checks whether the server is stopping
+SLOT_POLL_INTERVAL = 0.1
+
+# worker ID of the helper process, in prefork mode
+HELPER = -1
+
+def load_sendfile():
+    ''' Returns the sendfile64(3) function of the C library (Python 2 has
+    no os.sendfile) or None if it is not available
+    '''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = libc.sendfile64
+    except (OSError, AttributeError, TypeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_int,
+                     ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    func.restype = ctypes.c_ssize_t
+    return func
+
+LIBC_SENDFILE = load_sendfile()
+
+def sendfile(out_fd, in_fd, offset, count, timeout=None):
+    ''' Copies up to count bytes from in_fd, starting at offset, to out_fd
+    and returns the number of bytes copied.  If out_fd is a non-blocking
+    socket, waits up to timeout seconds for it to become writable.
+
+    :raises: OSError
+    '''
+    position = ctypes.c_int64(offset)
+    while True:
+        result = LIBC_SENDFILE(out_fd, in_fd, ctypes.byref(position),
+                               min(count, SENDFILE_MAX_COUNT))
+        if result >= 0:
+            return result
+        err = ctypes.get_errno()
+        if err == errno.EAGAIN:
+            (_, writable, _) = select.select([], [out_fd], [], timeout)
+            if not writable:
+                raise OSError(errno.ETIMEDOUT, os.strerror(errno.ETIMEDOUT))
+        elif err != errno.EINTR:
+            raise OSError(err, os.strerror(err))
+
+
+class RequestInput(object):
+    ''' wsgi.input stream which is limited to the request body, so that the
+    connection can be reused for the next request
+    '''
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def _limit(self, size):
+        if size is None or size < 0 or size > self.remaining:
+            return self.remaining
+        return size
+
+    def read(self, size=-1):
+        size = self._limit(size)
+        data = self.rfile.read(size) if size else ''
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        size = self._limit(size)
+        data = self.rfile.readline(size) if size else ''
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=None):     #pylint: disable=W0613
+        return list(self)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def discard(self):
+        ''' Reads and discards the unread part of the body.  Returns False
+        if the body is too large to be discarded (or incomplete).
+        '''
+        if self.remaining > MAX_DISCARD_SIZE:
+            return False
+        while self.remaining:
+            if not self.read(self.remaining):
+                return False
+        return True
+
+
+class ZTPServerHandler(ServerHandler):
+    ''' wsgiref handler which sends wsgi.file_wrapper responses with
+    sendfile(2) and supports persistent HTTP/1.1 connections
+    '''
+
+    def cleanup_headers(self):
+        ServerHandler.cleanup_headers(self)
+
+        # the end of a response without a length is signalled by closing
+        # the connection
+        handler = self.request_handler
+        if 'Content-Length' not in self.headers:
+            handler.close_connection = 1
+        if handler.close_connection and self.http_version == '1.1':
+            self.headers['Connection'] = 'close'
+
+    def sendfile(self):
+        ''' Sends self.result (a wsgi.file_wrapper) with sendfile(2).
+        Returns False if the file has to be sent by the regular write
+        path instead.
+        '''
+        length = self.headers.get('Content-Length')
+        if LIBC_SENDFILE is None or length is None:
+            return False
+
+        filelike = self.result.filelike
+        try:
+            in_fd = filelike.fileno()
+            out_fd = self.stdout.fileno()
+            offset = filelike.tell()
+        except (AttributeError, IOError, OSError, ValueError):
+            return False
+
+        start = offset
+        remaining = int(length)
+        timeout = self.request_handler.connection.gettimeout()
+        if not self.headers_sent:
+            self.send_headers()
+        self._flush()
+
+        while remaining > 0:
+            try:
+                sent = sendfile(out_fd, in_fd, offset, remaining, timeout)
+            except OSError as err:
+                if offset == start and \
+                   err.errno in (errno.EINVAL, errno.ENOSYS):
+                    # nothing sent yet - not supported for these files
+                    return False
+                raise
+            if not sent:
+                log.warning('%s: file truncated while being sent '
+                            '(%d bytes missing)' %
+                            (self.environ.get('PATH_INFO'), remaining))
+                self.request_handler.close_connection = 1
+                break
+            offset += sent
+            remaining -= sent
+            self.bytes_sent += sent
+        return True
+
+
+class ZTPRequestHandler(WSGIRequestHandler):
+    ''' wsgiref request handler using :py:class:`ZTPServerHandler`, which
+    serves several requests per connection if the server has keep-alive
+    enabled
+    '''
+
+    def setup(self):
+        if self.server.keepalive:
+            self.protocol_version = 'HTTP/1.1'
+            self.timeout = self.server.keepalive_timeout
+        WSGIRequestHandler.setup(self)
+
+    def handle(self):
+        ''' Handles the requests on the connection '''
+        BaseHTTPRequestHandler.handle(self)
+
+    def handle_one_request(self):
+        ''' Handles a single HTTP request '''
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:
+            # idle keep-alive connection
+            self.close_connection = 1
+            return
+
+        if not self.raw_requestline:
+            self.close_connection = 1
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = 1
+            return
+
+        if not self.parse_request():
+            return
+
+        environ = self.get_environ()
+        stdin = self.rfile
+        if self.request_version != 'HTTP/1.1' or \
+           'chunked' in self.headers.get('Transfer-Encoding', ''):
+            self.close_connection = 1
+        else:
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+                stdin = RequestInput(self.rfile, length)
+            except ValueError:
+                self.close_connection = 1
+
+        handler = ZTPServerHandler(stdin, self.wfile, self.get_stderr(),
+                                   environ)
+        handler.request_handler = self      #pylint: disable=W0201
+        if not self.close_connection:
+            handler.http_version = '1.1'
+        handler.run(self.server.get_app())
+
+        if self.server.stopping or \
+           (isinstance(stdin, RequestInput) and not stdin.discard()):
+            self.close_connection = 1
+
+
+class ZTPServer(WSGIServer):
+    ''' Single-threaded standalone server '''
+
+    def __init__(self, server_address, backlog=5, keepalive=False,
+                 keepalive_timeout=None):
+        self.request_queue_size = backlog
+        self.keepalive = keepalive
+        self.keepalive_timeout = keepalive_timeout
+        self.stopping = False
+        WSGIServer.__init__(self, server_address, ZTPRequestHandler)
+
+    def stop(self, timeout=None):       #pylint: disable=W0613
+        ''' Stops serving requests once the current request is done.
+        Must not be called from the thread running serve_forever().
+        '''
+        self.stopping = True
+        self.shutdown()
+        return 0
+
+
+class ThreadedZTPServer(ZTPServer):
+    ''' Standalone server handling each connection in its own thread, with
+    at most threads connections being handled at any time (further
+    connections wait in the listen backlog).  When the server stops, a
+    connection waiting for a free thread is closed.
+    '''
+
+    def __init__(self, server_address, threads=16, **kwargs):
+        self.threads = threads
+        self.slots = threading.BoundedSemaphore(threads)
+        self.active = set()
+        self.active_lock = threading.Lock()
+        ZTPServer.__init__(self, server_address, **kwargs)
+
+    def process_request(self, request, client_address):
+        # serve_forever() only notices shutdown() between requests, so do
+        # not block until a thread is free
+        while not self.slots.acquire(False):
+            if self.stopping:
+                self.shutdown_request(request)
+                return
+            time.sleep(SLOT_POLL_INTERVAL)
+        thread = threading.Thread(target=self.process_request_thread,
+                                  args=(request, client_address))
+        thread.daemon = True
+        with self.active_lock:
+            self.active.add(thread)
+        thread.start()
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:                   #pylint: disable=W0703
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.active_lock:
+                self.active.discard(threading.current_thread())
+            self.slots.release()
+
+    def stop(self, timeout=None):
+        ''' Stops accepting connections and waits up to timeout seconds
+        for the connections being handled.  Returns the number of
+        connections still being handled.
+        '''
+        ZTPServer.stop(self)
+        deadline = time.time() + (timeout or 0)
+        while True:
+            with self.active_lock:
+                active = list(self.active)
+            if not active or time.time() >= deadline:
+                return len(active)
+            active[0].join(max(0, deadline - time.time()))
+
+def make_server(host, port, app):
+    ''' Returns the standalone WSGI server for app, as configured in the
+    [server] section
+    '''
+    config = runtime.server
+    if config.mode == 'single':
+        server = ZTPServer((host, port), backlog=config.backlog)
+    else:
+        server = ThreadedZTPServer((host, port),
+                                   threads=config.threads,
+                                   backlog=config.backlog,
+                                   keepalive=config.keepalive,
+                                   keepalive_timeout=config.keepalive_timeout)
+    server.set_app(app)
+    return server
+
+def run(server):
+    ''' Serves requests until SIGTERM/SIGINT is received, then shuts the
+    server down gracefully
+    '''
+    def stop(signum, _):
+        if server.stopping:
+            return
+        log.info('Received signal %d - shutting down (pid %d)...' %
+                 (signum, os.getpid()))
+        # shutdown() waits for serve_forever() to return
+        thread = threading.Thread(target=server.stop,
+                                  args=(runtime.server.shutdown_timeout,))
+        thread.daemon = True
+        thread.start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    server.serve_forever()
+    pending = server.stop(runtime.server.shutdown_timeout)
+    if pending:
+        log.warning('Shutdown with %d connection(s) still active' % pending)
+    server.server_close()
+
+def run_helper(on_ready, on_stop=None):
+    ''' Runs on_ready, then waits for SIGTERM/SIGINT and runs on_stop '''
+    stopping = []
+
+    def stop(signum, _):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    on_ready()
+    while not stopping:
+        time.sleep(HELPER_POLL_INTERVAL)
+    if on_stop:
+        on_stop()
+
+def run_prefork(server, workers, warm_up=None, on_ready=None, on_stop=None,
+                on_exit=None):
+    ''' Forks workers processes serving requests from the listening socket
+    of server, restarts the workers which exit unexpectedly and stops them
+    on SIGTERM/SIGINT.  Each worker runs warm_up before serving requests
+    and on_exit once it stopped.
+
+    on_ready (and then on_stop, when stopping) runs in a helper process.
+    It typically starts threads (digest warm-up, metrics), which the
+    parent must not run: a worker forked while one of them holds a lock
+    (e.g. a logging handler lock) would deadlock on it.
+    '''
+    children = dict()
+    stopping = []
+
+    def fork(worker_id, target):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                target()
+            except Exception as err:         #pylint: disable=W0703
+                log.error('%s failed: %s' % (name(worker_id), err))
+                status = 1
+            finally:
+                os._exit(status)            #pylint: disable=W0212
+        children[pid] = worker_id
+
+    def name(worker_id):
+        if worker_id == HELPER:
+            return 'Helper'
+        return 'Worker %d' % worker_id
+
+    def spawn(worker_id):
+        if worker_id == HELPER:
+            fork(worker_id, lambda: run_helper(on_ready, on_stop))
+            return
+
+        def target():
+            log.info('Worker %d started (pid %d)' %
+                     (worker_id, os.getpid()))
+            if warm_up:
+                warm_up()
+            try:
+                run(server)
+            finally:
+                if on_exit:
+                    on_exit()
+        fork(worker_id, target)
+
+    def stop(signum, _):
+        log.info('Received signal %d - stopping workers...' % signum)
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    for worker_id in range(workers):
+        spawn(worker_id)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    if on_ready:
+        spawn(HELPER)
+
+    while children:
+        try:
+            (pid, status) = os.wait()
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                continue
+            break
+        worker_id = children.pop(pid, None)
+        if worker_id is not None and not stopping:
+            log.warning('%s (pid %d) exited with status %d - '
+                        'restarting' % (name(worker_id), pid, status))
+            time.sleep(RESPAWN_DELAY)
+            spawn(worker_id)
+
+    server.server_close()
+
+def serve(app, host, port, warm_up=None, on_ready=None, on_stop=None,
+          on_exit=None):
+    ''' Runs the standalone server for app until it is stopped.
+
+    warm_up is called by every server process (each worker, in pre-fork
+    mode) before serving requests and on_exit once it stopped serving
+    them; on_ready is called once the workers are running and on_stop
+    once they stopped (both in a helper process, in pre-fork mode).
+    '''
+    config = runtime.server
+    server = make_server(host, port, app)
+    log.info('Server mode: %s (workers=%d, threads=%d, keepalive=%s, '
+             'backlog=%d)' % (config.mode,
+                              config.workers if config.mode == 'prefork'
+                              else 1,
+                              config.threads if config.mode != 'single'
+                              else 1,
+                              server.keepalive, config.backlog))
+
+    if config.mode == 'prefork':
+        run_prefork(server, config.workers, warm_up, on_ready, on_stop,
+                    on_exit)
+        return
+
+    if warm_up:
+        warm_up()
+    if on_ready:
+        on_ready()
+    try:
+        run(server)
+    finally:
+        if on_exit:
+            on_exit()
+        if on_stop:
+            on_stop()
@@ -33,16 +33,25 @@
 # pylint: disable=C0103,W0142
 #
 import collections
+import cPickle
+import functools
+import hashlib
 import logging
+import operator
 import os
 import re
 import string # pylint: disable=W0402
+import tempfile
+import threading
+import time
 
 from ztpserver.validators import validate_neighbordb, validate_pattern
 from ztpserver.constants import CONTENT_TYPE_YAML
 from ztpserver.serializers import load, SerializerError
-from ztpserver.utils import expand_range, parse_interface, url_path_join
+from ztpserver.utils import parse_interface, parse_range, url_path_join
+from ztpserver.utils import LogPayload
 from ztpserver.config import runtime
+from ztpserver.repository import copy_contents
 from ztpserver.resources import run_plugin
 
 ANY_DEVICE_PARSER_RE = re.compile(r':(?=[any])')
@@ -50,6 +59,15 @@ NONE_DEVICE_PARSER_RE = re.compile(r':(?=[none])')
 FUNC_RE = re.compile(r'(?P<function>\w+)(?=\(\S+\))\([\'|\"]'
                      r'(?P<arg>.+?)[\'|\"]\)')
 
+SNAPSHOT_MAGIC = 'ZTPS-NEIGHBORDB-SNAPSHOT'
+
+# bump whenever the compiled neighbordb classes change, so that snapshots
+# written by older versions are ignored
+SNAPSHOT_VERSION = 1
+
+REGEX_SPECIAL_CHARS = set('.^$*+?{}[]\\|()')
+REGEX_QUANTIFIER_CHARS = set('*?{')
+
 ALL_CHARS = set([chr(c) for c in range(256)])
 NON_HEX_CHARS = ALL_CHARS - set(string.hexdigits)
 
@@ -57,6 +75,8 @@ log = logging.getLogger(__name__)
 
 
 Neighbor = collections.namedtuple('Neighbor', ['device', 'interface'])
+InterfaceEntry = collections.namedtuple('InterfaceEntry',
+                                        ['interface', 'neighbors', 'pattern'])
 
 def neighbordb_path():
     ''' Returns the path for neighbordb based on the conf file
@@ -78,25 +98,37 @@ def load_file(filename, content_type, node_id):
     try:
         return load(filename, content_type, node_id)
     except SerializerError:
-        log.error('%s: failed to load file: %s' % (node_id, filename))
+        log.error('%s: failed to load file: %s', node_id, filename)
         raise
 
 def load_neighbordb(node_id, contents=None):
+    ''' Returns an instance of Neighbordb.
+
+    If contents is not specified, the compiled neighbordb is served from
+    the process-wide cache (see :py:class:`NeighbordbCache`).
+
+    '''
+    if not contents:
+        return neighbordb_cache.get(node_id)
+    return compile_neighbordb(node_id, contents)
+
+def compile_neighbordb(node_id, contents=None):
+    ''' Parses, validates and compiles neighbordb (bypassing the cache) '''
     try:
         if not contents:
-            log.info('%s: loading neighbordb file: %s' %
-                     (node_id, neighbordb_path()))
+            log.info('%s: loading neighbordb file: %s',
+                     node_id, neighbordb_path())
             contents = load_file(neighbordb_path(), CONTENT_TYPE_YAML,
                                  node_id)
 
         # neighbordb is empty
         if not contents:
-            log.info('%s: unable to load neighbordb - file is missing/empty' %
+            log.info('%s: unable to load neighbordb - file is missing/empty',
                      node_id)
             contents = dict()
 
         if not validate_neighbordb(contents, node_id):
-            log.error('%s: failed to validate neighbordb' % node_id)
+            log.error('%s: failed to validate neighbordb', node_id)
             return
 
         neighbordb = Neighbordb(node_id)
@@ -107,22 +139,117 @@ def load_neighbordb(node_id, contents=None):
         if 'patterns' in contents:
             neighbordb.add_patterns(contents['patterns'])
 
-        log.debug('%s: loaded neighbordb: %s' % (node_id, neighbordb))
+        log.debug('%s: loaded neighbordb: %s', node_id, neighbordb)
         return neighbordb
     except SerializerError as err:
         # pylint: disable=E1101
         tokens = err.message.split('Error:')
-        log.error('%s: failed to load neighbordb: %s' %
-                  (node_id,
-                   'Error:'.join(tokens[1:])
-                   if len(tokens) > 1
-                   else err.message))
+        log.error('%s: failed to load neighbordb: %s',
+                  node_id,
+                  'Error:'.join(tokens[1:]) if len(tokens) > 1 else err.message)
         return None
     except Exception as err:
-        log.error('%s: failed to load neighbordb because of error: %s' %
-                  (node_id, err))
+        log.error('%s: failed to load neighbordb because of error: %s',
+                  node_id, err)
+        return None
+
+def neighbordb_snapshot_path():
+    ''' Returns the path for the compiled neighbordb snapshot '''
+    return '%s.snapshot' % neighbordb_path()
+
+def file_digest(filename):
+    ''' Returns the SHA1 hex digest of the contents of a file '''
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as fhandler:
+        for chunk in iter(lambda: fhandler.read(65536), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def snapshot_header(digest):
+    return '%s %d %s\n' % (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, digest)
+
+def load_neighbordb_snapshot(node_id, digest):
+    ''' Returns the compiled neighbordb from the snapshot or None if there
+    is no snapshot or the snapshot is stale (i.e. it was not compiled from
+    a neighbordb file with the given content digest)
+    '''
+    filename = neighbordb_snapshot_path()
+    try:
+        with open(filename, 'rb') as fhandler:
+            if fhandler.readline() != snapshot_header(digest):
+                log.info('%s: ignoring stale neighbordb snapshot %s',
+                         node_id, filename)
+                return None
+            neighbordb = cPickle.load(fhandler)
+    except IOError:
+        return None
+    except Exception as err:        # pylint: disable=W0703
+        log.warning('%s: failed to load neighbordb snapshot %s: %s',
+                    node_id, filename, err)
         return None
 
+    log.info('%s: loaded neighbordb snapshot %s', node_id, filename)
+    return neighbordb
+
+def write_neighbordb_snapshot(neighbordb, digest, node_id):
+    ''' Atomically writes the snapshot of a compiled neighbordb.
+
+    Returns True if the snapshot was written.
+    '''
+    filename = neighbordb_snapshot_path()
+    (fd, tmp_filename) = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                          prefix='.neighbordb-')
+    try:
+        with os.fdopen(fd, 'wb') as fhandler:
+            fhandler.write(snapshot_header(digest))
+            cPickle.dump(neighbordb, fhandler, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_filename, filename)
+    except Exception as err:        # pylint: disable=W0703
+        log.warning('%s: failed to write neighbordb snapshot %s: %s',
+                    node_id, filename, err)
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        return False
+
+    log.info('%s: wrote neighbordb snapshot %s', node_id, filename)
+    return True
+
+def create_neighbordb_snapshot(node_id):
+    ''' Compiles neighbordb and writes its snapshot.
+
+    Returns True if the snapshot was written.
+    '''
+    digest = file_digest(neighbordb_path())
+    neighbordb = compile_neighbordb(node_id)
+    if neighbordb is None or file_digest(neighbordb_path()) != digest:
+        return False
+    return write_neighbordb_snapshot(neighbordb, digest, node_id)
+
+def load_compiled_neighbordb(node_id):
+    ''' Returns the compiled neighbordb.
+
+    If neighbordb snapshots are enabled, the neighbordb is loaded from an
+    up to date snapshot instead of being compiled; otherwise it is compiled
+    and a new snapshot is written.
+    '''
+    if not runtime.neighbordb.snapshot:
+        return compile_neighbordb(node_id)
+
+    try:
+        digest = file_digest(neighbordb_path())
+    except IOError:
+        return compile_neighbordb(node_id)
+
+    neighbordb = load_neighbordb_snapshot(node_id, digest)
+    if neighbordb is None:
+        neighbordb = compile_neighbordb(node_id)
+
+        # skip the snapshot if neighbordb changed while being compiled
+        if neighbordb is not None and \
+           file_digest(neighbordb_path()) == digest:
+            write_neighbordb_snapshot(neighbordb, digest, node_id)
+    return neighbordb
+
 def load_pattern(pattern, content_type=CONTENT_TYPE_YAML, node_id=None):
     """ Returns an instance of Pattern """
     try:
@@ -139,14 +266,14 @@ def load_pattern(pattern, content_type=CONTENT_TYPE_YAML, node_id=None):
                 pattern[dummy] = dummy
 
         if not validate_pattern(pattern, node_id):
-            log.error('%s: failed to validate pattern attributes' % node_id)
+            log.error('%s: failed to validate pattern attributes', node_id)
             return None
 
         pattern['node_id'] = node_id
         return Pattern(**pattern)
     except TypeError as exc:
-        log.error('%s: failed to load pattern \'%s\' (%s)' %
-                  (node_id, pattern, exc))
+        log.error('%s: failed to load pattern \'%s\' (%s)',
+                  node_id, pattern, exc)
 
 def create_node(nodeattrs):
     try:
@@ -156,44 +283,197 @@ def create_node(nodeattrs):
                 _systemmac = str(_systemmac).replace(symbol, '')
             nodeattrs['systemmac'] = _systemmac
         node = Node(**nodeattrs)
-        log.debug('%s: created node object %r' % (node.identifier(), node))
+        log.debug('%s: created node object %s',
+                  node.identifier(), LogPayload(node, repr))
         return node
     except KeyError as err:
-        log.error('Failed to create node - missing attribute: %s' % err)
+        log.error('Failed to create node - missing attribute: %s', err)
+
+def resolve_resources(value, node, node_id):
+    ''' Returns a copy of value in which the plugin references (e.g.
+    allocate('pool')), at any depth of nested dicts and lists, are
+    replaced by the result of the plugin
+    '''
+    if isinstance(value, dict):
+        return dict((key, resolve_resources(item, node, node_id))
+                    for (key, item) in value.iteritems())
+    elif isinstance(value, list):
+        return [resolve_resources(item, node, node_id) for item in value]
+    elif isinstance(value, basestring):
+        match = FUNC_RE.match(value)
+        if match:
+            return run_plugin(match.group('function'), node_id,
+                              match.group('arg'), node)
+    return value
 
 def load_resources(attributes, node, node_id):
-    log.debug('%s: computing resources (attr=%s)' %
-              (node_id, attributes))
-
-    _attributes = dict()
-    for key, value in attributes.items():
-        if hasattr(value, 'items'):
-            value = load_resources(value, node, node_id)
-        elif hasattr(value, '__iter__'):
-            _value = list()
-            for item in value:
-                match = FUNC_RE.match(item)
-                if match:
-                    plugin = match.group('function')
-                    _value.append(run_plugin(plugin,
-                                             node_id,
-                                             match.group('arg')),
-                                             node)
-                else:
-                    _value.append(item)
-            value = _value
-        else:
-            match = FUNC_RE.match(str(value))
-            if match:
-                plugin = match.group('function')
-                value = run_plugin(plugin,
-                                   node_id,
-                                   match.group('arg'),
-                                   node)
-        _attributes[key] = value
-    log.debug('%s: resources: %s' % (node_id, _attributes))
+    log.debug('%s: computing resources (attr=%s)',
+              node_id, LogPayload(attributes))
+
+    _attributes = resolve_resources(attributes, node, node_id)
+    log.debug('%s: resources: %s', node_id, LogPayload(_attributes))
     return _attributes
 
+def get_path(value, path):
+    ''' Returns the item at path (a sequence of dict keys and list
+    indices) in value
+    '''
+    for key in path:
+        value = value[key]
+    return value
+
+def fill_paths(value, slots):
+    ''' Returns a copy of value (nested dicts and lists) in which the item
+    at each path of slots is replaced by the corresponding value.  Only the
+    containers along the paths are copied; the rest of value is shared
+    with the copy.
+    '''
+    if not slots:
+        return value
+
+    result = copy_container(value)
+    copies = dict()
+    for (path, item) in slots:
+        container = result
+        if len(path) > 1:
+            for depth in xrange(1, len(path)):
+                prefix = path[:depth]
+                child = copies.get(prefix)
+                if child is None:
+                    child = copy_container(container[path[depth - 1]])
+                    container[path[depth - 1]] = child
+                    copies[prefix] = child
+                container = child
+        container[path[-1]] = item
+    return result
+
+def copy_container(value):
+    return dict(value) if isinstance(value, dict) else list(value)
+
+
+class ActionPlan(object):
+    ''' Substitution plan of a definition action, compiled once per
+    definition file: the paths (dict keys and list indices, at any depth
+    of the attributes of the action) of its $variable slots and of its
+    plugin('arg') calls.
+
+    Rendering an action only fills these slots and copies the containers
+    along their paths.  Plans (and the action they hold) are shared by
+    concurrent requests and must not be modified.
+    '''
+
+    __slots__ = ['action', 'variables', 'resources']
+
+    def __init__(self, action):
+        action = copy_contents(action)
+        if not isinstance(action.get('attributes'), (dict, list)):
+            action['attributes'] = dict()
+        self.action = action
+        self.variables = []
+        self.resources = []
+        self._compile(action['attributes'], ())
+        self.variables = tuple(self.variables)
+        self.resources = tuple(self.resources)
+
+    def __repr__(self):
+        return 'ActionPlan(name=%s, variables=%d, resources=%d)' % \
+               (self.action.get('name'), len(self.variables),
+                len(self.resources))
+
+    def _compile(self, value, path):
+        if isinstance(value, dict):
+            for (key, item) in value.iteritems():
+                self._compile(item, path + (key,))
+        elif isinstance(value, list):
+            for (index, item) in enumerate(value):
+                self._compile(item, path + (index,))
+        elif isinstance(value, basestring):
+            if value.startswith('$'):
+                self.variables.append((path, value[1:]))
+            else:
+                match = FUNC_RE.match(value)
+                if match:
+                    self.resources.append((path, match.group('function'),
+                                           match.group('arg')))
+
+    def substitute(self, lookup):
+        ''' Returns a copy of the action in which the value of each
+        $variable slot is replaced by lookup(variable)
+        '''
+        action = dict(self.action)
+        action['attributes'] = fill_paths(
+            action['attributes'],
+            [(path, lookup(name)) for (path, name) in self.variables])
+        return action
+
+    def resolve(self, action, node, node_id):
+        ''' Returns a copy of action (as returned by
+        :py:meth:`substitute`) in which the plugin calls are replaced by
+        the result of the plugins, including those in the values
+        substituted for the $variable slots
+        '''
+        attributes = action['attributes']
+        slots = [(path, run_plugin(plugin, node_id, arg, node))
+                 for (path, plugin, arg) in self.resources]
+        slots += [(path, resolve_resources(get_path(attributes, path),
+                                           node, node_id))
+                  for (path, _) in self.variables]
+
+        action = dict(action)
+        action['attributes'] = fill_paths(attributes, slots)
+        return action
+
+
+def compile_actions(actions):
+    ''' Returns the plans of a list of definition actions '''
+    return tuple(ActionPlan(action) for action in actions)
+
+
+class DefinitionPlan(object):
+    ''' The plans of the actions of a definition file, along with the
+    definition they were compiled from
+    '''
+
+    __slots__ = ['definition', 'actions']
+
+    def __init__(self, definition):
+        self.definition = dict(definition)
+        self.actions = compile_actions(definition.get('actions') or [])
+        if 'actions' in definition:
+            self.definition['actions'] = [x.action for x in self.actions]
+
+    def __repr__(self):
+        return 'DefinitionPlan(name=%s, actions=%d)' % \
+               (self.definition.get('name'), len(self.actions))
+
+    def template(self):
+        ''' Returns a copy of the definition which can be modified without
+        affecting the plan (the actions themselves must not be modified)
+        '''
+        definition = dict(self.definition)
+        if 'actions' in definition:
+            definition['actions'] = list(definition['actions'])
+        return definition
+
+def regex_prefix(regex):
+    ''' Returns the literal prefix which any string matched (from the
+    beginning) by regex must start with.  Returns an empty string if
+    no such prefix can be determined.
+    '''
+    if '|' in regex or '(?' in regex:
+        # alternation or inline flags
+        return ''
+
+    prefix = list()
+    for char in regex:
+        if char in REGEX_SPECIAL_CHARS:
+            if char in REGEX_QUANTIFIER_CHARS and prefix:
+                # the previous character is optional
+                prefix.pop()
+            break
+        prefix.append(char)
+    return ''.join(prefix)
+
 def replace_config_action(resource, filename=None):
     ''' Builds a definition with a single action replace_config '''
 
@@ -208,6 +488,113 @@ def replace_config_action(resource, filename=None):
 
     return action
 
+def intern_string(value):
+    ''' Returns the interned copy of value, so that repeated names (device
+    names, 'any', 'none' etc.) are only stored once
+    '''
+    if isinstance(value, str):
+        return intern(value)
+    return value
+
+def file_signature(filename):
+    ''' Returns the (inode, mtime, size) of a file or None if the file
+    cannot be accessed
+    '''
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+
+class NeighbordbCache(object):
+    ''' Process-wide cache for the compiled neighbordb.
+
+    The cached instance is keyed on the (inode, mtime, size) signature of
+    the neighbordb file and rebuilt whenever the signature changes.
+    Concurrent requests which miss the cache wait for a single rebuild
+    instead of each compiling their own copy.
+    '''
+
+    def __init__(self):
+        self.entry = None
+        self.rebuild_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.rebuild_time = 0.0
+        self.last_rebuild_time = 0.0
+
+    def __repr__(self):
+        return 'NeighbordbCache(hits=%d, misses=%d, rebuilds=%d, ' \
+               'rebuild_time=%.3fs)' % \
+               (self.hits, self.misses, self.rebuilds, self.rebuild_time)
+
+    def stats(self):
+        ''' Returns the cache counters as a dict '''
+        with self.stats_lock:
+            return dict(hits=self.hits,
+                        misses=self.misses,
+                        rebuilds=self.rebuilds,
+                        rebuild_time=self.rebuild_time,
+                        last_rebuild_time=self.last_rebuild_time)
+
+    def clear(self):
+        ''' Drops the cached neighbordb '''
+        with self.rebuild_lock:
+            self.entry = None
+
+    def _hit(self, node_id):
+        with self.stats_lock:
+            self.hits += 1
+        log.debug('%s: neighbordb cache hit', node_id)
+
+    def get(self, node_id):
+        ''' Returns the compiled neighbordb, rebuilding it if the
+        neighbordb file changed since it was last compiled
+        '''
+        signature = file_signature(neighbordb_path())
+        if signature is None:
+            # missing/inaccessible file - let the loader report the error
+            return compile_neighbordb(node_id)
+
+        entry = self.entry
+        if entry is not None and entry[0] == signature:
+            self._hit(node_id)
+            return entry[1]
+
+        with self.rebuild_lock:
+            # another request may have rebuilt it while we were waiting
+            entry = self.entry
+            if entry is not None and entry[0] == signature:
+                self._hit(node_id)
+                return entry[1]
+
+            with self.stats_lock:
+                self.misses += 1
+
+            log.info('%s: neighbordb cache miss - compiling %s',
+                     node_id, neighbordb_path())
+            start = time.time()
+            neighbordb = load_compiled_neighbordb(node_id)
+            elapsed = time.time() - start
+
+            with self.stats_lock:
+                self.rebuilds += 1
+                self.rebuild_time += elapsed
+                self.last_rebuild_time = elapsed
+
+            if neighbordb is not None:
+                self.entry = (signature, neighbordb)
+                log.info('%s: neighbordb compiled in %.3fs (%r)',
+                         node_id, elapsed, self)
+            return neighbordb
+
+neighbordb_cache = NeighbordbCache()
+
+
 class NodeError(Exception):
     ''' Base exception class for :py:class:`Node` '''
     pass
@@ -236,33 +623,61 @@ class OrderedCollection(collections.OrderedDict):
 
 
 class Function(object):
+
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        self.value = value
+        self.value = intern_string(value)
 
     def match(self, arg):
         raise NotImplementedError
 
+    def predicate(self):
+        ''' Returns a callable which has the same truth value as match '''
+        return self.match
+
 
 class IncludesFunction(Function):
+
+    __slots__ = ()
+
     def match(self, arg):
         return self.value in arg
 
 
 class ExcludesFunction(Function):
+
+    __slots__ = ()
+
     def match(self, arg):
         return self.value not in arg
 
 
 class RegexFunction(Function):
+
+    __slots__ = ('regex',)
+
+    def __init__(self, value):
+        super(RegexFunction, self).__init__(value)
+        self.regex = re.compile(value)
+
     def match(self, arg):
-        match = re.match(self.value, arg)
-        return match is not None
+        return self.regex.match(arg) is not None
+
+    def predicate(self):
+        return self.regex.match
 
 
 class ExactFunction(Function):
+
+    __slots__ = ()
+
     def match(self, arg):
         return arg == self.value
 
+    def predicate(self):
+        return functools.partial(operator.eq, self.value)
+
 
 class Node(object):
     ''' A Node object is maps the metadata from an EOS node.  It provides
@@ -270,6 +685,9 @@ class Node(object):
     associated neighbors found on those interfaces.
     '''
 
+    __slots__ = ('systemmac', 'model', 'serialnumber', 'version',
+                 'neighbors')
+
     def __init__(self, **kwargs):
         self.systemmac = kwargs.get('systemmac')
         self.model = kwargs.get('model')
@@ -294,22 +712,24 @@ class Node(object):
                 raise NodeError('%s: interface \'%s\' already added to node' %
                                 (self.identifier(), interface))
 
+            debug = log.isEnabledFor(logging.DEBUG)
             _neighbors = list()
             for peer in peers:
-                log.debug('%s: creating neighbor %s:%s for interface %s' %
-                          ( self.identifier(), peer['device'],
-                            peer['port'], interface))
-                _neighbors.append(Neighbor(peer['device'],
-                                           peer['port']))
-            self.neighbors[interface] = _neighbors
+                if debug:
+                    log.debug('%s: creating neighbor %s:%s for interface %s',
+                              self.identifier(), peer['device'],
+                              peer['port'], interface)
+                _neighbors.append(Neighbor(intern_string(peer['device']),
+                                           intern_string(peer['port'])))
+            self.neighbors[intern_string(interface)] = _neighbors
         except KeyError as err:
-            log.error('%s: failed to neighbor because of missing key (%s)' %
-                      (self.identifier(), str(err)))
+            log.error('%s: failed to neighbor because of missing key (%s)',
+                      self.identifier(), str(err))
             raise NodeError('%s: failed to neighbor because of KeyError (%s)' %
                       (self.identifier(), str(err)))
 
     def add_neighbors(self, neighbors):
-        log.info('%s: parsing node\'s LLDP Neighbor information' %
+        log.info('%s: parsing node\'s LLDP Neighbor information',
                  self.identifier())
         for interface, peers in neighbors.items():
             self.add_neighbor(interface, peers)
@@ -341,6 +761,7 @@ class Neighbordb(object):
 
         self.variables = dict()
         self.patterns = {'globals': list(), 'nodes': dict()}
+        self.index = PatternIndex()
 
     def __repr__(self):
         return 'Neighbordb(variables=%d, globals=%d, nodes=%d)' % \
@@ -350,13 +771,13 @@ class Neighbordb(object):
 
     def add_variable(self, key, value, overwrite=False):
         if key in self.RESERVED_VARIABLES:
-            log.error('%s: failed to add variable: %s (reserved keyword)' %
-                      (self.node_id, key))
+            log.error('%s: failed to add variable: %s (reserved keyword)',
+                      self.node_id, key)
             raise NeighbordbError('%s: failed to add variable: %s '
                                 '(reserved keyword)' % (self.node_id, key))
         elif key in self.variables and not overwrite:
-            log.error('%s: failed to add variable: %s (duplicate)' %
-                      (self.node_id, key))
+            log.error('%s: failed to add variable: %s (duplicate)',
+                      self.node_id, key)
             raise NeighbordbError('%s: failed to add variable %s '
                                 '(duplicate)' % (self.node_id, key))
 
@@ -365,7 +786,7 @@ class Neighbordb(object):
     def add_variables(self, variables):
         if not hasattr(variables, 'items'):
             log.error('%s: failed to add variables: missing attribute '
-                      '\'items\' (%s)' % (self.node_id, variables))
+                      '\'items\' (%s)', self.node_id, variables)
             raise NeighbordbError('%s: failed to add variables: '
                                   'missing attribute \'items\' (%s)' %
                                   (self.node_id, variables))
@@ -386,13 +807,18 @@ class Neighbordb(object):
             kwargs['interfaces'] = kwargs.get('interfaces', list())
             kwargs['variables'] = kwargs.get('variables', dict())
 
+            if kwargs['variables'] == dict():
+                # patterns without variables of their own share the
+                # neighbordb variables instead of copying them
+                kwargs['variables'] = self.variables
+
             for key in set(self.variables).difference(kwargs['variables']):
                 kwargs['variables'][key] = self.variables[key]
 
             pattern = Pattern(**kwargs)
 
-            log.debug('%s: pattern \'%r\' parsed successfully' %
-                      (self.node_id, pattern))
+            log.debug('%s: pattern \'%r\' parsed successfully',
+                      self.node_id, pattern)
 
             # Add pattern to neighbordb
             if 'node' in kwargs:
@@ -402,20 +828,20 @@ class Neighbordb(object):
                     log.warning('%s: pattern \'%r\' ignored because '
                                 'another node-specific pattern is '
                                 'configured earlier in neighbordb'
-                                '\'%r\'' %
-                                (self.node_id, pattern,
-                                 self.patterns['nodes'][pattern.node]))
+                                '\'%r\'',
+                                self.node_id, pattern,
+                                self.patterns['nodes'][pattern.node])
             else:
                 self.patterns['globals'].append(pattern)
+                self.index.add(pattern)
         except KeyError as err:
             log.error('%s: failed to add pattern \'%s\' because of '
-                      'missing key (%s)' % (self.node_id, name, str(err)))
+                      'missing key (%s)', self.node_id, name, str(err))
             raise NeighbordbError('%s: failed to pattern \'%s\' because of '
                                 'missing key (%s)' %
                                   (self.node_id, name, str(err)))
         except PatternError:
-            log.error('%s: failed to add pattern \'%s\'' %
-                      (self.node_id, name))
+            log.error('%s: failed to add pattern \'%s\'', self.node_id, name)
             raise NeighbordbError('%s: failed to add pattern \'%s\'' %
                                   (self.node_id, name))
 
@@ -424,8 +850,8 @@ class Neighbordb(object):
             for pattern in patterns:
                 self.add_pattern(**pattern)
         except TypeError as err:
-            log.error('%s: failed to add patterns %s: %s' %
-                      (self.node_id, patterns, str(err)))
+            log.error('%s: failed to add patterns %s: %s',
+                      self.node_id, patterns, str(err))
             raise NeighbordbError('%s: failed to add patterns %s: %s' %
                                   (self.node_id, patterns, str(err)))
 
@@ -447,46 +873,149 @@ class Neighbordb(object):
 
     def find_patterns(self, node):
         identifier = node.identifier()
-        log.debug('%s: searching for eligible patterns' %
-                  identifier)
+        log.debug('%s: searching for eligible patterns', identifier)
 
         result = []
 
         pattern = self.patterns['nodes'].get(identifier, None)
         if pattern:
-            log.debug('%s: node-specific pattern eligible in neighbordb: %s' %
-                      (identifier,
-                       pattern.name))
+            log.debug('%s: node-specific pattern eligible in neighbordb: %s',
+                      identifier, pattern.name)
             result += [pattern]
 
         elif self.patterns['globals']:
-            log.debug('%s: global patterns eligible in neighbordb' %
-                      identifier)
-            result += self.patterns['globals']
+            candidates = self.index.candidates(node)
+            log.debug('%s: %d/%d global patterns eligible in neighbordb',
+                      identifier, len(candidates),
+                      len(self.patterns['globals']))
+            result += candidates
         else:
-            log.debug('%s: no patterns eligible in neighbordb' %
-                      identifier)
+            log.debug('%s: no patterns eligible in neighbordb', identifier)
 
         return result
 
-    def match_node(self, node):
+    def match_node(self, node, first_match=False):
+        ''' Returns the list of patterns matching node (in neighbordb
+        order).  If first_match is True, matching stops at the first
+        pattern which matches.
+        '''
         identifier = node.identifier()
+        debug = log.isEnabledFor(logging.DEBUG)
         result = list()
         for pattern in self.find_patterns(node):
-            log.debug('%s: attempting to match pattern %s' %
-                      (identifier, pattern.name))
+            if debug:
+                log.debug('%s: attempting to match pattern %s',
+                          identifier, pattern.name)
             if pattern.match_node(node):
-                log.debug('%s: pattern %s matched' %
-                          (identifier, pattern.name))
+                if debug:
+                    log.debug('%s: pattern %s matched',
+                              identifier, pattern.name)
                 result.append(pattern)
-            else:
-                log.debug('%s: pattern %s match failed' %
-                          (identifier, pattern.name))
+                if first_match:
+                    break
+            elif debug:
+                log.debug('%s: pattern %s match failed',
+                          identifier, pattern.name)
         return result
 
 
+class PatternIndex(object):
+    ''' Candidate-pruning index over the global patterns in neighbordb.
+
+    Each pattern is indexed under one value which the LLDP table of a node
+    must contain in order for the pattern to match: an exact remote
+    device, the literal prefix of a remote device regex, an exact remote
+    interface or a local interface (in order of preference).  Patterns
+    without any such positive constraint are always candidates.
+    '''
+
+    def __init__(self):
+        self.patterns = list()
+        self.unindexed = list()
+
+        self.devices = dict()
+        self.prefixes = dict()
+        self.prefix_lengths = set()
+        self.remote_interfaces = dict()
+        self.interfaces = dict()
+
+    def __repr__(self):
+        return 'PatternIndex(patterns=%d, unindexed=%d)' % \
+               (len(self.patterns), len(self.unindexed))
+
+    def __len__(self):
+        return len(self.patterns)
+
+    @staticmethod
+    def keys(pattern):
+        ''' Yields (table, value) tuples for each positive constraint in
+        pattern, most selective first
+        '''
+        for entry in pattern.interfaces:
+            item = entry.pattern
+            if not item.is_positive_constraint():
+                continue
+
+            if item.remote_device not in ['any', 'none']:
+                function = item.remote_device_re
+                if isinstance(function, ExactFunction):
+                    yield (0, 'devices', function.value)
+                elif isinstance(function, RegexFunction):
+                    prefix = regex_prefix(function.value)
+                    if prefix:
+                        yield (1, 'prefixes', prefix)
+
+            if item.remote_interface not in ['any', 'none'] and \
+               isinstance(item.remote_interface_re, ExactFunction):
+                yield (2, 'remote_interfaces',
+                       item.remote_interface_re.value)
+
+            if item.interface not in ['any', 'none']:
+                yield (3, 'interfaces', next(item.members()))
+
+    def add(self, pattern):
+        ''' Adds a pattern to the end of the index '''
+
+        position = len(self.patterns)
+        self.patterns.append(pattern)
+
+        keys = sorted(self.keys(pattern),
+                      key=lambda x: (x[0], -len(x[2])))
+        if not keys:
+            self.unindexed.append(position)
+            return
+
+        (_, table, value) = keys[0]
+        getattr(self, table).setdefault(value, list()).append(position)
+        if table == 'prefixes':
+            self.prefix_lengths.add(len(value))
+
+    def candidates(self, node):
+        ''' Returns the patterns which might match node, in the same
+        order they were added to the index
+        '''
+        positions = set(self.unindexed)
+        prefix_lengths = sorted(self.prefix_lengths)
+
+        for interface, neighbors in node.neighbors.items():
+            positions.update(self.interfaces.get(interface, ()))
+            for neighbor in neighbors:
+                positions.update(self.devices.get(neighbor.device, ()))
+                positions.update(
+                    self.remote_interfaces.get(neighbor.interface, ()))
+                for length in prefix_lengths:
+                    positions.update(
+                        self.prefixes.get(neighbor.device[:length], ()))
+
+        return [self.patterns[x] for x in sorted(positions)]
+
+
 class Pattern(object):
 
+    __slots__ = ('name', 'definition', 'config_handler', 'node', 'node_id',
+                 'variables', 'dispatch', 'wildcards', 'positives', 'size',
+                 'interfaces')
+
     def __init__(self, name=None, definition=None,
                  config_handler=None, interfaces=None,
                  node=None, variables=None, node_id=None):
@@ -499,6 +1028,17 @@ class Pattern(object):
         self.node_id = node_id
         self.variables = variables or dict()
 
+        # interface patterns, keyed by the local interface name without
+        # its trailing number (see split_interface); 'any' and 'none' local
+        # interfaces are kept in wildcards.  Both hold
+        # (position, InterfacePattern) tuples in pattern order.  positives
+        # is the number of local interfaces which must match a positive
+        # constraint.
+        self.dispatch = dict()
+        self.wildcards = list()
+        self.positives = 0
+        self.size = 0
+
         self.interfaces = list()
         if interfaces:
             self.add_interfaces(interfaces)
@@ -511,24 +1051,46 @@ class Pattern(object):
     def variable_substitution(self):
         try:
             log.debug('%s: checking pattern \'%s\' entries for variable '
-                      'substitution' % (self.node_id, self.name))
+                      'substitution', self.node_id, self.name)
             for entry in self.interfaces:
-                for item in entry['patterns']:
-                    for attr in ['remote_device', 'remote_interface']:
-                        value = getattr(item, attr)
-                        if value.startswith('$'):
-                            newvalue = self.variables[value[1:]]
-                            setattr(item, attr, newvalue)
-                    item.refresh()
-            log.debug('%s: pattern \'%s\' variable substitution complete' %
-                      (self.node_id, self.name))
+                item = entry.pattern
+                for attr in ['remote_device', 'remote_interface']:
+                    value = getattr(item, attr)
+                    if value.startswith('$'):
+                        newvalue = self.variables[value[1:]]
+                        setattr(item, attr, intern_string(newvalue))
+                item.refresh()
+            self.positives = sum(item.interface_count for item
+                                 in self.interface_patterns()
+                                 if item.is_positive_constraint())
+            log.debug('%s: pattern \'%s\' variable substitution complete',
+                      self.node_id, self.name)
         except KeyError as exc:
-            log.debug('%s: pattern \'%s\' variable substitution failed: %s' %
-                      (self.node_id, self.name, str(exc)))
+            log.debug('%s: pattern \'%s\' variable substitution failed: %s',
+                      self.node_id, self.name, str(exc))
             raise PatternError('%s: pattern \'%s\' variable substitution '
                                'failed: %s' %
                                (self.node_id, self.name, str(exc)))
 
+    def interface_patterns(self):
+        ''' Yields all interface patterns, in pattern order '''
+        for entry in self.interfaces:
+            yield entry.pattern
+
+    def add_interface_pattern(self, pattern):
+        position = self.size
+        self.size += 1
+
+        if pattern.interface in ['any', 'none']:
+            self.wildcards.append((position, pattern))
+        else:
+            for key in pattern.ranges:
+                self.dispatch.setdefault(key,
+                                         list()).append((position, pattern))
+
+        if pattern.is_positive_constraint():
+            self.positives += pattern.interface_count
+
     def serialize(self):
         data = dict(name=self.name, definition=self.definition,
                     variables=self.variables, node=self.node)
@@ -537,8 +1099,7 @@ class Pattern(object):
 
         interfaces = []
         for item in self.interfaces:
-            _item = item['metadata']
-            interfaces.append({_item['interface']: _item['neighbors']})
+            interfaces.append({item.interface: item.neighbors})
         data['interfaces'] = interfaces
 
         return data
@@ -553,8 +1114,8 @@ class Pattern(object):
         try:
             if not hasattr(interface, 'items'):
                 log.error('%s: pattern \'%s\' - failed to add interface %s: '
-                          'missing attribute (items)' %
-                          (self.node_id, self.name, interface))
+                          'missing attribute (items)',
+                          self.node_id, self.name, interface)
                 raise PatternError('%s: pattern \'%s\' - failed to add '
                                    'interface %s: missing attribute (items)' %
                                    (self.node_id, self.name, interface))
@@ -563,25 +1124,20 @@ class Pattern(object):
                 (remote_device, remote_interface) = \
                     self.parse_interface(neighbors)
 
-                metadata = dict(interface=intf, neighbors=neighbors)
-
-                patterns = list()
                 if intf in ['none', 'any']:
-                    patterns.append(InterfacePattern(intf, remote_device,
-                                                     remote_interface,
-                                                     self.node_id))
+                    pattern = InterfacePattern(intf, remote_device,
+                                               remote_interface,
+                                               self.node_id)
                 else:
-                    intfs = expand_range(intf)
-                    for item in intfs:
-                        pattern = InterfacePattern(item, remote_device,
-                                                   remote_interface,
-                                                   self.node_id)
-                        patterns.append(pattern)
-                self.interfaces.append(dict(metadata=metadata,
-                                            patterns=patterns))
+                    pattern = InterfaceRangePattern(intf, remote_device,
+                                                    remote_interface,
+                                                    self.node_id)
+                self.interfaces.append(InterfaceEntry(intf, neighbors,
+                                                      pattern))
+                self.add_interface_pattern(pattern)
         except InterfacePatternError:
-            log.error('%s: pattern \'%s\' - failed to add interface %s' %
-                      (self.node_id, self.name, interface))
+            log.error('%s: pattern \'%s\' - failed to add interface %s',
+                      self.node_id, self.name, interface)
             raise PatternError('%s: pattern \'%s\' - failed to add '
                                'interface %s' %
                                (self.node_id, self.name, interface))
@@ -591,68 +1147,88 @@ class Pattern(object):
             for interface in interfaces:
                 self.add_interface(interface)
         except TypeError as err:
-            log.error('%s: pattern \'%s\' - failed to add interfaces %s: %s' %
-                      (self.node_id, self.name, interface, str(err)))
+            log.error('%s: pattern \'%s\' - failed to add interfaces %s: %s',
+                      self.node_id, self.name, interface, str(err))
             raise PatternError('%s: pattern \'%s\' - failed to add '
                                'interfaces %s: %s' %
                                (self.node_id, self.name, interface, str(err)))
 
     def match_node(self, node):
+        identifier = node.identifier()
 
-        log.debug('%s: pattern \'%s\' - attempting to match node (%r)' %
-                  (self.node_id, self.name, str(node)))
+        # evaluated once - this runs for every interface of every
+        # candidate pattern
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug('%s: pattern \'%s\' - attempting to match node (%s)',
+                      identifier, self.name, LogPayload(node))
 
         # No need to match system ID - that it already taken care of
         # while selecting the set of nodes which are eligible for a
         # match.
 
-        patterns = list()
-        for entry in self.interfaces:
-            for pattern in entry['patterns']:
-                patterns.append(pattern)
-
+        # Each node interface is checked once, so only wildcards need to
+        # be consumed; a range is matched once per member interface.
+        consumed = set()
+        matched = 0
         for interface, neighbors in node.neighbors.items():
-            log.debug('%s: pattern \'%s\' - attempting to match '
-                      'interface %s(%s)' %
-                      (self.node_id, self.name, interface, str(neighbors)))
+            # only the interface patterns whose range includes this
+            # interface and wildcards can match - check them in pattern
+            # order
+            (key, index) = split_interface(interface)
+            candidates = [x for x in self.dispatch.get(key, ())
+                          if x[1].includes(key, index)]
+            if not candidates:
+                candidates = self.wildcards
+            elif self.wildcards:
+                candidates = sorted(candidates + self.wildcards)
 
             match = False
-            for index, pattern in enumerate(patterns):
-                log.debug('%s: pattern \'%s\' - checking interface pattern '
-                          'for %s: %s' %
-                          (self.node_id, self.name, interface, pattern))
-                result = pattern.match(interface, neighbors)
+            for position, pattern in candidates:
+                if position in consumed:
+                    continue
+
+                result = pattern.match_neighbors(neighbors)
 
                 # True, False, None
                 if result is True:
-                    log.debug('%s: pattern \'%s\' - interface pattern match '
-                              'for %s: %s' %
-                              (self.node_id, self.name, interface, pattern))
-                    del patterns[index]
+                    if debug:
+                        log.debug('%s: pattern \'%s\' - interface pattern '
+                                  'match for %s: %s',
+                                  identifier, self.name, interface, pattern)
+                    if pattern.interface in ['any', 'none']:
+                        consumed.add(position)
+                    if pattern.is_positive:
+                        matched += 1
                     match = True
                     break
                 elif result is False:
-                    log.debug('%s: pattern \'%s\' - interface pattern match '
-                              'failure for %s: %s' %
-                              (self.node_id, self.name, interface, pattern))
+                    if debug:
+                        log.debug('%s: pattern \'%s\' - interface pattern '
+                                  'match failure for %s: %s',
+                                  identifier, self.name, interface, pattern)
                     return False
 
-            if not match:
+            if not match and debug:
                 log.debug('%s: pattern \'%s\' - interface %s did not match '
-                          'any interface patterns' %
-                          (self.node_id, self.name, interface))
-
-        for pattern in patterns:
-            if pattern.is_positive_constraint():
-                log.debug('%s: pattern \'%s\' - interface pattern %s did '
-                          'not match any interface' %
-                          (self.node_id, self.name, pattern))
-                return False
+                          'any interface patterns',
+                          identifier, self.name, interface)
+
+        if matched < self.positives:
+            if debug:
+                log.debug('%s: pattern \'%s\' - %d interface pattern(s) '
+                          'did not match any interface',
+                          identifier, self.name, self.positives - matched)
+            return False
         return True
 
 
 class InterfacePattern(object):
 
+    __slots__ = ('interface', 'remote_device', 'remote_interface', 'node_id',
+                 'remote_device_re', 'remote_interface_re', 'matcher',
+                 'is_positive')
+
     KEYWORDS = {
         'any': RegexFunction('.*'),
         'none': RegexFunction('[^a-zA-Z0-9]')
@@ -665,29 +1241,53 @@ class InterfacePattern(object):
         'regex': RegexFunction
     }
 
+    interface_count = 1
+
     def __init__(self, interface, remote_device, remote_interface, node_id):
         match = re.match(r'^[ehnrtE]+(\d.*)$', interface)
         if match:
             self.interface = 'Ethernet%s' % match.groups()[0]
         else:
             self.interface = interface
+        self.interface = intern_string(self.interface)
 
-        self.remote_device = remote_device
-        self.remote_interface = remote_interface
+        self.remote_device = intern_string(remote_device)
+        self.remote_interface = intern_string(remote_interface)
         self.node_id = node_id
 
-        self.remote_device_re = self.compile(remote_device)
-        self.remote_interface_re = self.compile(remote_interface)
-
+        self.refresh()
 
     def __repr__(self):
         return 'InterfacePattern(interface=%s, remote_device=%s, ' \
                'remote_interface=%s)' % \
                 (self.interface, self.remote_device, self.remote_interface)
 
+    def __getstate__(self):
+        # the compiled matcher is a closure, which cannot be pickled - it
+        # is rebuilt by refresh() when unpickling
+        return dict(interface=self.interface,
+                    remote_device=self.remote_device,
+                    remote_interface=self.remote_interface,
+                    node_id=self.node_id)
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            setattr(self, key, intern_string(value))
+        self.refresh()
+
     def refresh(self):
         self.remote_device_re = self.compile(self.remote_device)
         self.remote_interface_re = self.compile(self.remote_interface)
+        self.matcher = self.compile_matcher()
+        self.is_positive = self.is_positive_constraint()
+
+    def members(self):
+        ''' Yields the local interfaces matched by the pattern '''
+        yield self.interface
+
+    def applies_to(self, interface):
+        ''' Returns True if the pattern applies to the local interface '''
+        return self.interface in self.KEYWORDS or self.interface == interface
 
     def compile(self, value):
         if value in self.KEYWORDS:
@@ -702,150 +1302,66 @@ class InterfacePattern(object):
             else:
                 return ExactFunction(value)
         except KeyError as exc:
-            log.error('%s: compile error: unknown function \'%s\' (%s)' %
-                      (self.node_id, function, str(exc)))
+            log.error('%s: compile error: unknown function \'%s\' (%s)',
+                      self.node_id, function, str(exc))
             raise InterfacePatternError
 
-    def match(self, interface, neighbors):
-        for neighbor in neighbors:
-            res = self.match_neighbor(interface, Neighbor(neighbor.device,
-                                                          neighbor.interface))
-            if res is True:
-                return True
-            elif res is False:
-                return False
-        return None
-
-    def match_neighbor(self, interface, neighbor):
-        # pylint: disable=R0911,R0912
-        log.debug('%s: attempting to match %s(%s) against '
-                  'interface pattern %r' %
-                  (self.node_id, interface, neighbor, self))
-
-        if self.interface == 'any':
-            if self.remote_device == 'any':
-                if self.remote_interface == 'any':
-                    return True
-                elif self.remote_interface == 'none':
-                    # bogus
-                    return False
-                else:
-                    if self.match_remote_interface(neighbor.interface):
-                        return True
-            elif self.remote_device == 'none':
-                if self.remote_interface == 'any':
-                    # bogus
-                    return False
-                elif self.remote_interface == 'none':
-                    # bogus
-                    return False
-                else:
-                    return False
-            else:
-                if self.remote_interface == 'any':
-                    if self.match_remote_device(neighbor.device):
-                        return True
-                elif self.remote_interface == 'none':
-                    if self.match_remote_device(neighbor.device):
-                        return False
-                else:
-                    if(self.match_remote_device(neighbor.device) and
-                       self.match_remote_interface(neighbor.interface)):
-                        return True
-
-        elif self.interface == 'none':
-            if self.remote_device == 'any':
-                if self.remote_interface == 'any':
-                    # bogus
-                    return False
-                elif self.remote_interface == 'none':
-                    # bogus
-                    return False
-                else:
-                    if self.match_remote_interface(neighbor.interface):
-                        return False
-            elif self.remote_device == 'none':
-                if self.remote_interface == 'any':
-                    # bogus
-                    return False
-                elif self.remote_interface == 'none':
-                    # no LLDP capable neighbors
-                    return False
-                else:
-                    # bogus
-                    return False
-            else:
-                if self.remote_interface == 'any':
-                    if self.match_remote_device(neighbor.device):
-                        return False
-                elif self.remote_interface == 'none':
-                    if self.match_remote_device(neighbor.device):
-                        return False
-                else:
-                    if(self.match_remote_device(neighbor.device) and
-                       self.match_remote_interface(neighbor.interface)):
-                        return False
+    def compile_matcher(self):
+        ''' Returns a function(device, port) specialised for the keyword
+        class of the pattern, for neighbors of a local interface the
+        pattern applies to.
+
+        The function returns True if the neighbor satisfies the pattern,
+        False if the neighbor violates it and None if the pattern does
+        not apply to the neighbor.
+        '''
+
+        values = (self.interface, self.remote_device, self.remote_interface)
+        if self.remote_device == 'none' and \
+           self.interface in self.KEYWORDS:
+            # bogus / no LLDP capable neighbors
+            result = False
+            checks = (False, False)
         else:
-            if self.remote_device == 'any':
-                if self.remote_interface == 'any':
-                    if self.match_interface(interface):
-                        return True
-                elif self.remote_interface == 'none':
-                    if self.match_interface(interface):
-                        return False
-                else:
-                    if(self.match_interface(interface) and
-                        self.match_remote_interface(neighbor.interface)):
-                        return True
-            elif self.remote_device == 'none':
-                if self.remote_interface == 'any':
-                    if self.match_interface(interface):
-                        return False
-                elif self.remote_interface == 'none':
-                    if self.match_interface(interface):
-                        return False
-                else:
-                    if(self.match_interface(interface) and
-                        self.match_remote_interface(neighbor.interface)):
-                        return False
-            elif self.match_interface(interface):
-                if self.remote_interface == 'any':
-                    if self.match_remote_device(neighbor.device):
-                        return True
-                elif self.remote_interface == 'none':
-                    if self.match_remote_device(neighbor.device):
-                        return False
-                else:
-                    if(self.match_interface(interface) and
-                       self.match_remote_device(neighbor.device) and
-                       self.match_remote_interface(neighbor.interface)):
-                        return True
-        return None
+            result = 'none' not in values
+            checks = tuple(x not in self.KEYWORDS for x in values[1:])
 
+        device = self.remote_device_re.predicate()
+        port = self.remote_interface_re.predicate()
 
-    def match_interface(self, interface):
-        if self.interface == 'any':
-            return True
-        elif self.interface is None:
-            return False
-        else:
-            return self.interface == interface
+        if checks == (False, False):
+            return lambda dev, prt: result
+        elif checks == (True, False):
+            return lambda dev, prt: result if device(dev) else None
+        elif checks == (False, True):
+            return lambda dev, prt: result if port(prt) else None
+        return lambda dev, prt: \
+            result if device(dev) and port(prt) else None
 
-    def match_remote_device(self, remote_device):
-        if self.remote_device == 'any':
-            return True
-        elif self.remote_device is None:
-            return False
-        else:
-            return self.remote_device_re.match(remote_device)
+    def match(self, interface, neighbors):
+        if not self.applies_to(interface):
+            return None
+        return self.match_neighbors(neighbors)
 
-    def match_remote_interface(self, remote_interface):
-        if self.remote_interface == 'any':
-            return True
-        elif self.remote_interface is None:
-            return False
-        else:
-            return self.remote_interface_re.match(remote_interface)
+    def match_neighbors(self, neighbors):
+        ''' Same as match, for neighbors of a local interface which the
+        pattern is known to apply to
+        '''
+        matcher = self.matcher
+        for neighbor in neighbors:
+            res = matcher(neighbor.device, neighbor.interface)
+            if res is not None:
+                return res
+        return None
+
+    def match_neighbor(self, interface, neighbor):
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('%s: attempting to match %s(%s) against '
+                      'interface pattern %r',
+                      self.node_id, interface, neighbor, self)
+        if not self.applies_to(interface):
+            return None
+        return self.matcher(neighbor.device, neighbor.interface)
 
     def is_positive_constraint(self):
         if self.interface == 'any':
@@ -859,3 +1375,73 @@ class InterfacePattern(object):
                 return True
             elif self.remote_device != 'none':
                 return self.interface != 'none'
+
+
+class InterfaceRangePattern(InterfacePattern):
+    ''' Interface pattern for a range of local interfaces, e.g.
+    'Ethernet1-48,Ethernet49/1-49/4'.
+
+    The range is kept as (start, end) interface numbers keyed by the
+    interface name without its trailing number, instead of being expanded
+    into one interface pattern per member interface.
+    '''
+
+    __slots__ = ('ranges', 'interface_count')
+
+    def __init__(self, interface, remote_device, remote_interface, node_id):
+        self.ranges = dict()
+        for (prefix, path, start, end) in parse_range(interface):
+            self.ranges.setdefault(intern_string('%s%s' % (prefix, path)),
+                                   list()).append((start, end))
+
+        self.interface_count = 0
+        for key, ranges in self.ranges.items():
+            self.ranges[key] = tuple(merge_ranges(ranges))
+            self.interface_count += sum(end - start + 1
+                                        for (start, end) in self.ranges[key])
+
+        super(InterfaceRangePattern, self).__init__(interface, remote_device,
+                                                    remote_interface, node_id)
+
+    def __getstate__(self):
+        state = super(InterfaceRangePattern, self).__getstate__()
+        state.update(ranges=self.ranges, interface_count=self.interface_count)
+        return state
+
+    def members(self):
+        for key in sorted(self.ranges):
+            for (start, end) in self.ranges[key]:
+                for index in range(start, end + 1):
+                    yield '%s%d' % (key, index)
+
+    def includes(self, key, index):
+        ''' Returns True if the interface key + index is in the range '''
+        for (start, end) in self.ranges.get(key, ()):
+            if start <= index <= end:
+                return True
+        return False
+
+    def applies_to(self, interface):
+        return self.includes(*split_interface(interface))
+
+
+def split_interface(interface):
+    ''' Splits an interface name into (key, number), where key is the name
+    without its trailing number, e.g. 'Ethernet49/1' -> ('Ethernet49/', 1).
+    The number is None if the name does not end with one.
+    '''
+    key = interface.rstrip(string.digits)
+    if len(key) < len(interface):
+        return (key, int(interface[len(key):]))
+    return (interface, None)
+
+
+def merge_ranges(ranges):
+    ''' Returns a sorted list of non-overlapping (start, end) ranges '''
+    result = list()
+    for (start, end) in sorted(ranges):
+        if result and start <= result[-1][1] + 1:
+            result[-1] = (result[-1][0], max(end, result[-1][1]))
+        else:
+            result.append((start, end))
+    return result
@@ -0,0 +1,273 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.tracing
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The tracing module records lightweight spans (wall time and
+        outcome) for the states of the nodes FSM, the resource plugins and
+        the neighbordb lookups, tagged with the node ID.  The spans of a
+        request and a per-request summary are written as JSON lines to a
+        rotating file configured in the [tracing] section.  Each process
+        writes (and rotates) its own <filename>.<pid> file, so that the
+        prefork workers and the mod_wsgi processes never rotate a file
+        another process is writing to.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+
+from ztpserver.config import runtime
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+# keys are not sorted so that the C encoder is used
+ENCODER = json.JSONEncoder(default=str)
+
+
+class Span(object):
+    ''' Times the block it wraps and records its outcome in the trace '''
+
+    __slots__ = ['trace', 'kind', 'name', 'start', 'duration', 'error']
+
+    def __init__(self, trace, kind, name):
+        self.trace = trace
+        self.kind = kind
+        self.name = name
+        self.start = None
+        self.duration = None
+        self.error = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, _):
+        self.duration = time.time() - self.start
+        if exc_type is not None:
+            self.error = '%s: %s' % (exc_type.__name__, exc_value)
+        self.trace.spans.append(self)
+        return False
+
+    def record(self):
+        record = dict(type='span', trace=self.trace.trace_id,
+                      node_id=self.trace.node_id, kind=self.kind,
+                      name=self.name, start=round(self.start, 6),
+                      duration_ms=round(self.duration * 1000, 3),
+                      outcome='error' if self.error else 'ok')
+        if self.error:
+            record['error'] = self.error
+        return record
+
+
+class NullSpan(object):
+    ''' Span used when tracing is disabled '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NULL_SPAN = NullSpan()
+
+
+class Trace(object):
+    ''' The spans recorded while handling one request '''
+
+    def __init__(self, sink, trace_id, node_id, request=None):
+        self.sink = sink
+        self.trace_id = trace_id
+        self.node_id = node_id
+        self.method = getattr(request, 'method', None)
+        self.path = getattr(request, 'path_info', None)
+        self.start = time.time()
+        self.spans = []
+
+    def span(self, kind, name):
+        return Span(self, kind, name)
+
+    def summary(self, status=None):
+        ''' Returns the summary record for the request: the wall time spent
+        in each state and plugin and the outcome of the request
+        '''
+        times = dict()
+        errors = []
+        for span in self.spans:
+            key = '%s:%s' % (span.kind, span.name)
+            times[key] = round(times.get(key, 0) + span.duration * 1000, 3)
+            if span.error:
+                errors.append(key)
+        return dict(type='request', trace=self.trace_id,
+                    node_id=self.node_id, method=self.method,
+                    path=self.path, status=status,
+                    start=round(self.start, 6),
+                    duration_ms=round((time.time() - self.start) * 1000, 3),
+                    states=[x.name for x in self.spans if x.kind == 'state'],
+                    times=times, errors=errors)
+
+    def finish(self, status=None):
+        records = [x.record() for x in self.spans]
+        records.append(self.summary(status))
+        self.sink.write(records)
+
+
+class TraceFileHandler(logging.handlers.RotatingFileHandler):
+    ''' Rotating file handler which logs the errors writing the traces
+    instead of printing them to stderr
+    '''
+
+    def handleError(self, record):
+        log.warning('Failed to write trace to %s: %s',
+                    self.baseFilename, sys.exc_info()[1])
+
+
+def process_filename(filename, pid=None):
+    ''' Returns the trace file of process pid (default: this process) '''
+    return '%s.%d' % (filename, pid or os.getpid())
+
+
+class TraceSink(object):
+    ''' Rotating JSON-lines file the traces of this process are written
+    to
+    '''
+
+    def __init__(self, filename, max_bytes, backup_count):
+        self.filename = filename
+        self.pid = os.getpid()
+        self.handler = TraceFileHandler(
+            process_filename(filename, self.pid), maxBytes=max_bytes,
+            backupCount=backup_count, delay=True)
+        self.ids = itertools.count(1)
+
+    def __repr__(self):
+        return 'TraceSink(filename=%s)' % self.handler.baseFilename
+
+    def trace_id(self):
+        # unique across the worker processes
+        return '%d-%d' % (os.getpid(), next(self.ids))
+
+    def write(self, records):
+        lines = '\n'.join(ENCODER.encode(x) for x in records)
+        record = logging.LogRecord('ztpserver.tracing', logging.INFO,
+                                   __file__, 0, lines, None, None)
+        self.handler.handle(record)
+
+    def close(self):
+        self.handler.close()
+
+
+class Tracer(object):
+    ''' Creates the per-request traces and keeps track of the trace of the
+    current thread, so that nested code (e.g. resource plugins) can add
+    spans to it
+    '''
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sink = None
+
+    def get_sink(self):
+        ''' Returns the sink configured in [tracing] or None if tracing is
+        disabled
+        '''
+        config = runtime.tracing
+        filename = config.filename
+        if not filename:
+            return None
+
+        # forked workers open their own file
+        pid = os.getpid()
+        sink = self.sink
+        if sink is None or sink.filename != filename or sink.pid != pid:
+            with self.lock:
+                sink = self.sink
+                if sink is None or sink.filename != filename or \
+                   sink.pid != pid:
+                    if sink is not None:
+                        sink.close()
+                    sink = TraceSink(filename, config.max_bytes,
+                                     config.backup_count)
+                    self.sink = sink
+        return sink
+
+    def start(self, node_id, request=None):
+        ''' Starts the trace of the current request '''
+        sink = self.get_sink()
+        if sink is None:
+            self.local.trace = None
+            return None
+        trace = Trace(sink, sink.trace_id(), node_id, request)
+        self.local.trace = trace
+        return trace
+
+    def finish(self, status=None):
+        ''' Writes the trace of the current request, if any '''
+        trace = getattr(self.local, 'trace', None)
+        if trace is not None:
+            self.local.trace = None
+            trace.finish(status)
+
+    def current(self):
+        return getattr(self.local, 'trace', None)
+
+    def span(self, kind, name):
+        ''' Returns a span of the current trace (a no-op span if the
+        current request is not being traced)
+        '''
+        trace = getattr(self.local, 'trace', None)
+        if trace is None:
+            return NULL_SPAN
+        return Span(trace, kind, name)
+
+tracer = Tracer()                       #pylint: disable=C0103
+
+def span(kind, name):
+    ''' Returns a span of the trace of the current request '''
+    return tracer.span(kind, name)
@@ -37,8 +37,30 @@ import os
 
 from urlparse import urlsplit, urlunsplit
 
+from ztpserver.config import runtime
+
 log = logging.getLogger(__name__)
 
+class LogPayload(object):
+    ''' Log message argument for a potentially large value (a request, a
+    node's LLDP table, a definition).  The value is only formatted if the
+    record is emitted and is truncated to log_payload_size characters.
+    '''
+
+    __slots__ = ['value', 'formatter']
+
+    def __init__(self, value, formatter=str):
+        self.value = value
+        self.formatter = formatter
+
+    def __str__(self):
+        text = self.formatter(self.value)
+        size = runtime.default.log_payload_size
+        if size and len(text) > size:
+            return '%s... (%d characters truncated)' % (text[:size],
+                                                       len(text) - size)
+        return text
+
 def atoi(text):
     return int(text) if text.isdigit() else text
 
@@ -50,158 +72,114 @@ MANAGEMENT_RE = re.compile(r'^(m(a(nagement)?)?)(\d+)(\/(\d+)){0,2}$')
 INTERFACE_NO_RE = re.compile(r'^(\d+)(\/(\d+)){0,2}$')
 
 
-def expand_range(interfaces):
-    ''' Returns a naturally sorted list of items expanded from interfaces. '''
+def _range_error(group, reason=None):
+    msg = 'Unable to expand interface range: %s ' % group
+    if reason:
+        msg += '(%s)' % reason
+    log.warning(msg)
+    return TypeError(msg)
 
-    # pylint: disable=R0914,R0912
+def _module_path(tokens):
+    return ''.join('%s/' % x for x in tokens[:-1])
 
-    items = set()
+def parse_range(interfaces):
+    ''' Returns a list of (prefix, path, start, end) tuples parsed from
+    interfaces, where path is the module path of the range (e.g. '49/') and
+    start/end are the first and last interface numbers in the range.
+
+    For example, 'Ethernet1-48,Ethernet49/1-49/4' is parsed to:
+        [('Ethernet', '', 1, 48), ('Ethernet', '49/', 1, 4)]
+
+    '''
+
+    # pylint: disable=R0912
+
+    ranges = list()
     prefix = None
     for group in [x.strip() for x in interfaces.split(',')]:
-        ranges = [x.strip() for x in group.split('-')]
-        if len(ranges) == 1:
-            interface = ranges[0].lower()
-            match = ETHERNET_RE.match(interface)
-            if match:
-                intf_no = interface[len(match.groups()[0]):]
-
-                for token in intf_no.split('/'):
-                    if int(token) < 1:
-                        log.warning('Unable to expand '
-                                    'interface range: %s '
-                                    '(invalid interface number)' %
-                                    group)
-                        raise TypeError('Unable to expand '
-                                        'interface range: %s '
-                                        '(invalid interface number)' %
-                                        group)
-
-                prefix = 'Ethernet'
-                items.add('%s%s' % (prefix, intf_no))
-            else:
-                match = MANAGEMENT_RE.match(interface)
+        tokens = [x.strip() for x in group.split('-')]
+        if len(tokens) == 1:
+            interface = tokens[0].lower()
+            for regex, intf_type in [(ETHERNET_RE, 'Ethernet'),
+                                     (MANAGEMENT_RE, 'Management'),
+                                     (INTERFACE_NO_RE, None)]:
+                match = regex.match(interface)
                 if match:
-                    intf_no = interface[len(match.groups()[0]):]
-
-                    for token in intf_no.split('/'):
-                        if int(token) < 1:
-                            log.warning('Unable to expand '
-                                        'interface range: %s '
-                                        '(invalid interface number)' %
-                                        group)
-                            raise TypeError('Unable to expand '
-                                            'interface range: %s '
-                                            '(invalid interface number)' %
-                                            group)
-
-                    prefix = 'Management'
-                    items.add('%s%s' % (prefix, intf_no))
-                else:
-                    match = INTERFACE_NO_RE.match(interface)
-                    if match:
-
-                        for token in interface.split('/'):
-                            if int(token) < 1:
-                                log.warning('Unable to expand '
-                                            'interface range: %s '
-                                            '(invalid interface number)' %
-                                            group)
-                                raise TypeError('Unable to expand '
-                                                'interface range: %s '
-                                                '(invalid interface number)' %
-                                                group)
-
-                        items.add('%s%s' % (prefix, interface))
-                    else:
-
-                        log.warning('Unable to expand interface range: %s '
-                                    '(invalid interface)' % group)
-                        raise TypeError('Unable to expand interface range: %s '
-                                        '(invalid interface)' % group)
-        elif len(ranges) == 2:
-            [start, end] = [x.lower() for x in ranges]
-
-            items_len = len(items)
+                    break
+            else:
+                raise _range_error(group, 'invalid interface')
+
+            if intf_type:
+                prefix = intf_type
+                interface = interface[len(match.groups()[0]):]
+
+            intf_tokens = interface.split('/')
+            for token in intf_tokens:
+                if int(token) < 1:
+                    raise _range_error(group, 'invalid interface number')
+
+            index = int(intf_tokens[-1])
+            ranges.append((prefix, _module_path(intf_tokens), index, index))
+        elif len(tokens) == 2:
+            [start, end] = [x.lower() for x in tokens]
+
             for regex, intf_type in [(ETHERNET_RE, 'Ethernet'),
                                      (MANAGEMENT_RE, 'Management'),
                                      (INTERFACE_NO_RE, prefix)]:
                 match_start = regex.match(start)
                 if match_start:
-                    if regex != INTERFACE_NO_RE:
-                        start_intf_tokens = \
-                            start[len(match_start.groups()[0]):].split('/')
-                    else:
-                        start_intf_tokens = start.split('/')
-
-                    match_end = regex.match(end)
-                    end_intf_tokens = None
-                    if match_end:
-                        if regex != INTERFACE_NO_RE:
-                            end_intf_tokens = \
-                                end[len(match_end.groups()[0]):].split('/')
-                        else:
-                            end_intf_tokens = end.split('/')
-                    else:
-                        match_end = INTERFACE_NO_RE.match(end)
-                        if match_end:
-                            end_intf_tokens = end.split('/')
-
-                    if not end_intf_tokens:
-                        log.warning('Unable to expand '
-                                    'interface range: %s '
-                                    '(invalid range end)' % group)
-
-                        raise TypeError('Unable to expand '
-                                        'interface range: %s '
-                                        '(invalid range end)' % group)
-
-                    if start_intf_tokens[:-1] != end_intf_tokens[:-1]:
-                        log.warning('Unable to expand '
-                                    'interface range: %s '
-                                    '(invalid range)' % group)
-                        raise TypeError('Unable to expand '
-                                        'interface range: %s '
-                                        '(invalid range)' % group)
-
-                    start_index = int(start_intf_tokens[-1])
-                    end_index = int(end_intf_tokens[-1])
-                    if start_index >= end_index:
-                        log.warning('Unable to expand '
-                                    'interface range: %s '
-                                    '(non-increasing range)' %
-                                    group)
-                        raise TypeError('Unable to expand '
-                                        'interface range: %s '
-                                        '(non-increasing range)' %
-                                        group)
-
-                    if start_index < 1 or end_index < 1:
-                        log.warning('Unable to expand '
-                                    'interface range: %s '
-                                    '(invalid interface number)' %
-                                    group)
-                        raise TypeError('Unable to expand '
-                                        'interface range: %s '
-                                        '(invalid interface number)' %
-                                        group)
-
-                    for index in range(start_index,
-                                       end_index + 1):
-                        prefix = intf_type
-                        items.add('%s%s' %
-                                  (intf_type,
-                                   '/'.join(start_intf_tokens[:-1] +
-                                            [str(index)])))
-            if items_len == len(items):
-                log.warning('Unable to expand interface range: %s ' %
-                            group)
-                raise TypeError('Unable to expand interface range: %s ' %
-                                group)
+                    break
+            else:
+                raise _range_error(group)
+
+            if regex != INTERFACE_NO_RE:
+                start_intf_tokens = \
+                    start[len(match_start.groups()[0]):].split('/')
+            else:
+                start_intf_tokens = start.split('/')
+
+            match_end = regex.match(end)
+            end_intf_tokens = None
+            if match_end:
+                if regex != INTERFACE_NO_RE:
+                    end_intf_tokens = \
+                        end[len(match_end.groups()[0]):].split('/')
+                else:
+                    end_intf_tokens = end.split('/')
+            else:
+                match_end = INTERFACE_NO_RE.match(end)
+                if match_end:
+                    end_intf_tokens = end.split('/')
+
+            if not end_intf_tokens:
+                raise _range_error(group, 'invalid range end')
+
+            if start_intf_tokens[:-1] != end_intf_tokens[:-1]:
+                raise _range_error(group, 'invalid range')
+
+            start_index = int(start_intf_tokens[-1])
+            end_index = int(end_intf_tokens[-1])
+            if start_index >= end_index:
+                raise _range_error(group, 'non-increasing range')
+
+            if start_index < 1 or end_index < 1:
+                raise _range_error(group, 'invalid interface number')
+
+            prefix = intf_type
+            ranges.append((intf_type, _module_path(start_intf_tokens),
+                           start_index, end_index))
         else:
-            log.warning('Unable to expand interface range: %s '
-                        '(invalid input)' % group)
-            raise TypeError('Unable to expand interface range: %s '
-                            '(invalid input)' % group)
+            raise _range_error(group, 'invalid input')
+
+    return ranges
+
+def expand_range(interfaces):
+    ''' Returns a naturally sorted list of items expanded from interfaces. '''
+
+    items = set()
+    for (prefix, path, start, end) in parse_range(interfaces):
+        for index in range(start, end + 1):
+            items.add('%s%s%d' % (prefix, path, index))
 
     log.debug('%s expanded to: %s' % (interfaces, items))
     return items
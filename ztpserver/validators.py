@@ -37,7 +37,7 @@ import inspect
 import logging
 import collections
 
-from ztpserver.utils import expand_range, parse_interface
+from ztpserver.utils import parse_interface, parse_range
 from ztpserver.config import runtime
 
 REQUIRED_PATTERN_ATTRIBUTES = ['name', 'definition']
@@ -295,8 +295,11 @@ class InterfacePatternValidator(Validator):
 
             if interface not in INTERFACE_PATTERN_KEYWORDS:
                 try:
-                    for entry in expand_range(interface):
-                        self._validate_pattern(entry, device, port)
+                    # all interfaces in a range validate alike - check the
+                    # first one instead of expanding the range
+                    (prefix, path, start, _) = parse_range(interface)[0]
+                    self._validate_pattern('%s%s%d' % (prefix, path, start),
+                                           device, port)
                 except Exception as err:
                     raise ValidationError('invalid interface %s (%s)' % 
                                           (interface, err))
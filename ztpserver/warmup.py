@@ -0,0 +1,221 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.warmup
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The warmup module fills the repository digest index in the
+        background, so that switches requesting /meta for large files
+        (e.g. EOS images) do not have to wait for them to be hashed.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import glob
+import logging
+import os
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from ztpserver.config import runtime
+from ztpserver.repository import digest_index
+from ztpserver.utils import all_files
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+WARMUP_FOLDERS = ['files', 'actions']
+WARMUP_NODE_FILES = ['startup-config']
+
+def lower_priority(niceness):
+    ''' Increments the niceness of the calling (worker) thread.  On Linux
+    the niceness applies to the calling thread only and also lowers the
+    I/O priority of the thread with the CFQ/BFQ I/O schedulers
+    '''
+    if niceness:
+        try:
+            os.nice(niceness)
+        except OSError as err:
+            log.warning('Digest warm-up: failed to set niceness (%s)' % err)
+
+
+class DigestWarmup(object):
+    ''' Computes the digests of the files served by the repository using a
+    bounded pool of low priority threads.
+
+    The files are rescanned every interval seconds (if interval is not 0),
+    so new files are hashed shortly after they are added; files which are
+    already indexed are not read again.
+    '''
+
+    def __init__(self, path, workers=1, niceness=0, interval=0):
+        self.path = path
+        self.workers = workers
+        self.niceness = niceness
+        self.interval = interval
+
+        self.index = digest_index(path)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+        self.scans = 0
+        self.total = 0
+        self.done = 0
+        self.bytes = 0
+
+    def __repr__(self):
+        return 'DigestWarmup(path=%s, workers=%d, niceness=%d, ' \
+               'interval=%d)' % (self.path, self.workers, self.niceness,
+                                 self.interval)
+
+    def status(self):
+        ''' Returns the progress of the current (or last) scan as a dict '''
+        with self.lock:
+            return dict(running=self.thread is not None and
+                        self.thread.is_alive(),
+                        scans=self.scans,
+                        total=self.total,
+                        done=self.done,
+                        pending=self.total - self.done,
+                        bytes=self.bytes)
+
+    def files(self):
+        ''' Returns the files to be hashed '''
+        result = []
+        for folder in WARMUP_FOLDERS:
+            result += all_files(os.path.join(self.path, folder))
+        for filename in WARMUP_NODE_FILES:
+            result += glob.glob(os.path.join(self.path, 'nodes', '*',
+                                             filename))
+        return result
+
+    def digest(self, filename):
+        ''' Adds the digests of filename to the index '''
+        if self.stopped.is_set():
+            return
+        try:
+            size = self.index.digests(filename)['size']
+        except IOError as err:
+            log.warning('Digest warm-up: failed to hash %s (%s)' %
+                        (filename, err))
+            size = 0
+        with self.lock:
+            self.done += 1
+            self.bytes += size
+
+    def scan(self):
+        ''' Hashes all the files which are not indexed yet '''
+        files = self.files()
+        with self.lock:
+            self.scans += 1
+            self.total = len(files)
+            self.done = 0
+            self.bytes = 0
+
+        start = time.time()
+        misses = self.index.stats()['misses']
+        pool = ThreadPool(self.workers, initializer=lower_priority,
+                          initargs=(self.niceness,))
+        # the index is written periodically and once the scan is done,
+        # instead of once per file
+        self.index.begin_batch()
+        try:
+            for _ in pool.imap_unordered(self.digest, files):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+            self.index.end_batch()
+
+        hashed = self.index.stats()['misses'] - misses
+        status = self.status()
+        if self.scans == 1 or hashed:
+            log.info('Digest warm-up: %d/%d files indexed (%d hashed, '
+                     '%.1f MB) in %.1fs' %
+                     (status['done'], status['total'], hashed,
+                      status['bytes'] / 1048576.0, time.time() - start))
+
+    def run(self):
+        log.info('Digest warm-up: started for %s (workers=%d, niceness=%d, '
+                 'interval=%ds)' % (self.path, self.workers, self.niceness,
+                                    self.interval))
+        while not self.stopped.is_set():
+            try:
+                self.scan()
+            except Exception as err:        #pylint: disable=W0703
+                log.error('Digest warm-up: scan failed (%s)' % err)
+            if not self.interval:
+                break
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        ''' Starts the warm-up in a background thread '''
+        self.thread = threading.Thread(target=self.run,
+                                       name='digest-warmup')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        ''' Stops the warm-up after the files being hashed are done '''
+        self.stopped.set()
+
+warmup = None       #pylint: disable=C0103
+
+def start_warmup():
+    ''' Starts the (process-wide) digest warm-up if it is enabled in the
+    [warmup] configuration section
+    '''
+    global warmup       #pylint: disable=W0603,C0103
+    if not runtime.warmup.enabled:
+        return None
+    if warmup is None:
+        warmup = DigestWarmup(runtime.default.data_root,
+                              workers=runtime.warmup.workers,
+                              niceness=runtime.warmup.niceness,
+                              interval=runtime.warmup.interval)
+        warmup.start()
+    return warmup
+
+def stop_warmup():
+    ''' Stops the digest warm-up (if running) '''
+    if warmup is not None:
+        warmup.stop()
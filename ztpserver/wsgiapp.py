@@ -33,12 +33,14 @@
 # pylint: disable=W0613,C0103,R0201,W0622,W0614
 #
 import logging
+import re
 
 import webob
 import webob.dec
 import webob.exc
 
-from routes.middleware import RoutesMiddleware
+from routes.middleware import RoutesMiddleware, is_form_post
+from routes.util import URLGenerator
 
 from ztpserver.serializers import dumps
 from ztpserver.constants import CONTENT_TYPE_HTML, HTTP_STATUS_OK
@@ -103,15 +105,263 @@ class WSGIController(object):
 
         return result
 
+class RouteTrie(object):
+    ''' Prefix trie of the path segments of the routes in a routes.Mapper,
+    used to dispatch requests without the mapper's regex scan.
+
+    A route is compiled if its path is made of whole segments which are
+    literals, {name} parameters (optionally restricted to an alternation of
+    words, e.g. {type:a|b}), a trailing {name:.*} parameter and/or a
+    trailing {.format}, and if its only condition is the request method.
+    Candidates are ranked like the mapper does: longest static prefix
+    first, then in the order they were connected.  Routes ranked after a
+    route which does not qualify are not compiled, so that it cannot be
+    shadowed.
+
+    match() returns the same match dict as the mapper, or None if the
+    request must be left to the mapper.
+    '''
+
+    TAIL = '.*'
+    WORDS_RE = re.compile(r'^\w+(\|\w+)*$')
+
+    def __init__(self, mapper):
+        self.root = self.node()
+        self.size = 0
+
+        if mapper.prefix:
+            return
+
+        entries = []
+        limit = None
+        for (index, route) in enumerate(mapper.matchlist):
+            if route.static:
+                continue
+            prefix = []
+            for token in route.routelist:
+                if not isinstance(token, str):
+                    break
+                prefix.append(token)
+            key = (-len(''.join(prefix).rstrip('/')), index)
+
+            entry = self.compile(route)
+            if entry is None:
+                log.debug('RouteTrie: %s is left to the mapper' %
+                          route.routepath)
+                limit = key if limit is None else min(limit, key)
+            else:
+                entries.append((key, entry))
+
+        for (key, (segments, entry)) in entries:
+            if limit is not None and key > limit:
+                continue
+            node = self.root
+            for (kind, value) in segments:
+                if kind == 'literal':
+                    node = node['literals'].setdefault(value, self.node())
+                elif kind == 'param':
+                    if node['param'] is None:
+                        node['param'] = self.node()
+                    node = node['param']
+                else:
+                    break
+            entry['key'] = key
+            node['tails' if entry['tail'] else 'ends'].append(entry)
+            self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def node(cls):
+        return dict(literals=dict(), param=None, ends=list(), tails=list())
+
+    @classmethod
+    def split(cls, route):
+        ''' Returns the segments of the path of route as lists of tokens
+        (literal strings and routes parameter dicts)
+        '''
+        segments = []
+        current = []
+        for token in route.routelist:
+            if not isinstance(token, basestring):
+                current.append(token)
+                continue
+            parts = token.split('/')
+            if parts[0]:
+                current.append(parts[0])
+            for part in parts[1:]:
+                segments.append(current)
+                current = [part] if part else []
+        segments.append(current)
+        return segments
+
+    def compile(self, route):
+        ''' Returns the trie path and the entry for route or None if route
+        cannot be compiled
+        '''
+        if route.minimization or \
+           set(route.conditions or {}) - set(['method']):
+            return None
+        methods = (route.conditions or {}).get('method')
+        if isinstance(methods, basestring):
+            methods = [methods]
+
+        segments = self.split(route)
+        if segments[0]:
+            return None
+
+        path = []
+        params = []
+        tail = fmt = None
+        last = len(segments) - 1
+        for (position, tokens) in enumerate(segments[1:], 1):
+            if tokens and isinstance(tokens[-1], dict) and \
+               tokens[-1]['type'] == '.' and position == last:
+                fmt = tokens[-1]['name']
+                tokens = tokens[:-1]
+
+            if not tokens:
+                path.append(('literal', ''))
+            elif len(tokens) > 1:
+                return None
+            elif isinstance(tokens[0], basestring):
+                path.append(('literal', tokens[0]))
+            elif tokens[0]['type'] != ':':
+                return None
+            else:
+                name = tokens[0]['name']
+                requirement = route.reqs.get(name)
+                if requirement == self.TAIL and position == last:
+                    tail = (position - 1, name)
+                    path.append(('tail', name))
+                elif requirement is None:
+                    params.append((position - 1, name, None))
+                    path.append(('param', name))
+                elif self.WORDS_RE.match(requirement):
+                    params.append((position - 1, name,
+                                   frozenset(requirement.split('|'))))
+                    path.append(('param', name))
+                else:
+                    return None
+
+        defaults = dict(route.defaults)
+        if fmt is not None:
+            defaults[fmt] = None
+        return (path, dict(route=route, methods=methods, params=params,
+                           tail=tail, format=fmt, defaults=defaults,
+                           encoding=route.encoding,
+                           errors=route.decode_errors))
+
+    def match(self, environ):
+        ''' Returns (match dict, route) for the request or None '''
+
+        if '_method' in environ.get('QUERY_STRING', '') or \
+           (environ['REQUEST_METHOD'] == 'POST' and is_form_post(environ)):
+            return None
+
+        segments = environ['PATH_INFO'].split('/')
+        if segments[0]:
+            return None
+        del segments[0]
+        count = len(segments)
+
+        best = None
+        stack = [(self.root, 0)]
+        while stack:
+            (node, depth) = stack.pop()
+            if depth < count:
+                candidates = node['tails']
+            else:
+                candidates = node['ends']
+            for entry in candidates:
+                if best is not None and best[0]['key'] < entry['key']:
+                    continue
+                result = self.check(entry, environ, segments)
+                if result is False:
+                    return None
+                elif result is not None:
+                    best = (entry, result)
+
+            if depth < count:
+                child = node['literals'].get(segments[depth])
+                if child is not None:
+                    stack.append((child, depth + 1))
+                if node['param'] is not None and segments[depth]:
+                    stack.append((node['param'], depth + 1))
+
+        if best is None:
+            return None
+        return (best[1], best[0]['route'])
+
+    @classmethod
+    def check(cls, entry, environ, segments):
+        ''' Returns the match dict of the request for entry, None if it does
+        not match or False if the mapper must decide
+        '''
+        methods = entry['methods']
+        if methods and environ['REQUEST_METHOD'] not in methods:
+            return None
+
+        values = []
+        for (position, name, choices) in entry['params']:
+            value = segments[position]
+            if choices is not None and value not in choices:
+                return None
+            values.append((name, value))
+
+        if entry['tail'] is not None:
+            (position, name) = entry['tail']
+            values.append((name, '/'.join(segments[position:])))
+        elif entry['format'] is not None and '.' in segments[-1]:
+            # may carry a {.format} extension
+            return False
+
+        defaults = entry['defaults']
+        encoding = entry['encoding']
+        result = defaults.copy()
+        for (name, value) in values:
+            if encoding and name != 'path_info':
+                value = value.decode(encoding, entry['errors'])
+            if value or not defaults.get(name):
+                result[name] = value
+        return result
+
+
 class WSGIRouter(object):
 
     def __init__(self, mapper):
         self.map = mapper
         self.router = RoutesMiddleware(self.route, self.map)
+        self.trie = RouteTrie(mapper)
 
     @webob.dec.wsgify
     def __call__(self, request):
-        return self.router
+        environ = request.environ
+        result = self.trie.match(environ)
+        if result is None:
+            return self.router
+
+        # same environ as RoutesMiddleware
+        (match, route) = result
+        url = URLGenerator(self.map, environ)
+        environ['wsgiorg.routing_args'] = (url, match)
+        environ['routes.route'] = route
+        environ['routes.url'] = url
+
+        if 'path_info' in match:
+            oldpath = environ['PATH_INFO']
+            newpath = match['path_info'] or ''
+            environ['PATH_INFO'] = newpath
+            if not newpath.startswith('/'):
+                environ['PATH_INFO'] = '/' + newpath
+            environ['SCRIPT_NAME'] += re.sub(r'^(.*?)/' + re.escape(newpath) +
+                                             '$', r'\1', oldpath)
+        return self.route
+
+    def controller(self, cls):
+        ''' Returns the controller handling requests routed to cls '''
+        return cls()
 
     @webob.dec.wsgify
     def route(self, request):
@@ -123,4 +373,4 @@ class WSGIRouter(object):
             return webob.exc.HTTPNotFound()            
 
         controller = request.urlvars['controller']
-        return controller()
+        return self.controller(controller)